@@ -0,0 +1,154 @@
+import logging
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger("ElephMind-ANN")
+
+# =========================================================================
+# APPROXIMATE NEAREST NEIGHBOURS (IVF)
+# =========================================================================
+# Inverted-file index over the rows of an external (n, dim) matrix of
+# L2-normalized vectors (the similar-case partition owns the vectors; the
+# index only stores row numbers).
+#
+#   train:  spherical k-means on a sample -> nlist unit centroids,
+#           every row goes to the list of its closest centroid.
+#   query:  the nprobe closest centroids -> union of their lists = candidates,
+#           which the caller scores exactly (so results are exact cosines,
+#           only recall is approximate).
+#   insert: row appended to its closest list (centroids are not updated).
+#
+# Overwritten rows are not removed from their old list: `assignment[row]`
+# names the only list whose entry is valid, stale entries are skipped.
+# The index is retrained (rebuild) once the rows inserted since training
+# reach the trained size, or half the indexed entries are stale.
+
+KMEANS_ITERATIONS = 10
+TRAIN_POINTS_PER_LIST = 64  # Sample size cap for k-means (>= 39 per centroid keeps centroids stable)
+ASSIGN_CHUNK_ROWS = 8192
+
+
+def spherical_kmeans(x: np.ndarray, k: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """(k, dim) unit centroids of unit rows `x` (cosine k-means, empty clusters reseeded)."""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(x.shape[0], k, replace=False)].astype(np.float32, copy=True)
+
+    for _ in range(iterations):
+        sims = x @ centroids.T
+        labels = np.argmax(sims, axis=1)
+
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=k)
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+        centroids[nonempty] = np.add.reduceat(x[order], starts, axis=0)
+
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:
+            # Worst-represented points become the new centroids
+            worst = np.argsort(sims[np.arange(x.shape[0]), labels])[:empty.size]
+            centroids[empty] = x[worst]
+
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        centroids /= np.maximum(norms, 1e-12)
+    return centroids
+
+
+class IVFIndex:
+    """IVF coarse quantizer + inverted lists of row numbers, incremental inserts and lazy rebuild."""
+
+    def __init__(self, nprobe: int = 8, nlist: Optional[int] = None, min_rows: int = 4096, seed: int = 0):
+        self.nprobe = max(1, nprobe)
+        self.nlist = nlist          # None: sqrt(n) lists at every (re)build
+        self.min_rows = min_rows    # Below this, exact search is as fast and k-means is meaningless
+        self.seed = seed
+        self.reset()
+
+    def reset(self):
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: List[np.ndarray] = []
+        self.pending: List[List[int]] = []           # Inserts since training, per list
+        self.assignment = np.full(0, -1, dtype=np.int32)
+        self.trained_rows = 0
+        self.inserted = 0
+        self.stale = 0
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def needs_rebuild(self, live_rows: int) -> bool:
+        if live_rows < self.min_rows:
+            return False
+        if not self.trained:
+            return True
+        return self.inserted >= self.trained_rows or self.stale * 2 >= self.trained_rows + self.inserted
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        labels = np.empty(vectors.shape[0], dtype=np.int32)
+        for start in range(0, vectors.shape[0], ASSIGN_CHUNK_ROWS):
+            chunk = np.asarray(vectors[start:start + ASSIGN_CHUNK_ROWS], dtype=np.float32)
+            labels[start:start + chunk.shape[0]] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return labels
+
+    def _ensure_assignment(self, row: int):
+        if row >= self.assignment.shape[0]:
+            grown = np.full(max(row + 1, 2 * self.assignment.shape[0]), -1, dtype=np.int32)
+            grown[:self.assignment.shape[0]] = self.assignment
+            self.assignment = grown
+
+    def build(self, matrix: np.ndarray, rows: np.ndarray):
+        """(Re)train on matrix[rows] and index those rows."""
+        rows = np.asarray(rows, dtype=np.int64)
+        n = rows.shape[0]
+        nlist = max(1, min(n, self.nlist or int(np.sqrt(n))))
+
+        rng = np.random.default_rng(self.seed)
+        sample = rows if n <= nlist * TRAIN_POINTS_PER_LIST else rng.choice(rows, nlist * TRAIN_POINTS_PER_LIST, replace=False)
+        self.reset()
+        self.centroids = spherical_kmeans(np.asarray(matrix[np.sort(sample)], dtype=np.float32), nlist, seed=self.seed)
+
+        labels = self._assign(matrix[rows] if n else np.empty((0, matrix.shape[1]), np.float32))
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=nlist)
+        self.lists = np.split(rows[order], np.cumsum(counts)[:-1])
+        self.pending = [[] for _ in range(nlist)]
+
+        if n:
+            self._ensure_assignment(int(rows.max()))
+            self.assignment[rows] = labels
+        self.trained_rows = n
+        logger.info(f"🗂️ IVF index built: {n} rows, {nlist} lists")
+
+    def add(self, row: int, vector: np.ndarray):
+        """Index (or re-index, if the row was overwritten) one row."""
+        if not self.trained:
+            return
+        self._ensure_assignment(row)
+        if self.assignment[row] >= 0:
+            self.stale += 1
+        label = int(np.argmax(self.centroids @ vector))
+        self.assignment[row] = label
+        self.pending[label].append(row)
+        self.inserted += 1
+
+    def remove(self, row: int):
+        if row < self.assignment.shape[0] and self.assignment[row] >= 0:
+            self.assignment[row] = -1
+            self.stale += 1
+
+    def candidates(self, query: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        """Sorted unique rows of the nprobe lists closest to the query."""
+        sims = self.centroids @ query
+        k = min(nprobe or self.nprobe, sims.shape[0])
+        probe = np.argpartition(-sims, k - 1)[:k]
+
+        parts = []
+        for label in probe:
+            for rows in (self.lists[label], np.asarray(self.pending[label], dtype=np.int64)):
+                if rows.size:
+                    parts.append(rows[self.assignment[rows] == label])
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(parts))
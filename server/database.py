@@ -1,12 +1,14 @@
 import sqlite3
 import os
+import time
 import logging
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from enum import Enum
 
 class JobStatus(str, Enum):
     PENDING = "pending"
     PROCESSING = "processing"
+    CLASSIFIED = "classified"  # Result available, heatmap still queued
     COMPLETED = "completed"
     FAILED = "failed"
 
@@ -106,6 +108,28 @@ def init_db():
             FOREIGN KEY(username) REFERENCES users(username)
         )
     ''')
+
+    # Result Versions (re-scoring writes new versions; jobs.result stays version 1)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS result_versions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            prompt_version TEXT,
+            result TEXT NOT NULL, -- JSON serialized
+            created_at REAL,
+            UNIQUE(job_id, version),
+            FOREIGN KEY(job_id) REFERENCES jobs(id)
+        )
+    ''')
+
+    # Prior studies: jobs linked to a patient, with domain key + per-label probabilities
+    for column in ("patient_id INTEGER REFERENCES patients(id)", "domain TEXT", "findings TEXT"):
+        try:
+            c.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+        except sqlite3.OperationalError:
+            pass # Column exists
+    c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_patient_domain_created ON jobs(patient_id, domain, created_at)')
     
     conn.commit()
     conn.close()
@@ -328,6 +352,15 @@ def create_patient(
         logging.error(f"Error creating patient: {e}")
         return None
 
+def get_patient(username: str, patient_db_id: int) -> Optional[Dict[str, Any]]:
+    """Get a patient record if owned by user."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT * FROM patients WHERE id = ? AND owner_username = ?', (patient_db_id, username))
+    row = c.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
 def get_patients_by_user(username: str) -> List[Dict[str, Any]]:
     """Get all patients belonging to a user."""
     conn = get_db_connection()
@@ -344,6 +377,8 @@ def delete_patient(username: str, patient_db_id: int) -> bool:
         c = conn.cursor()
         c.execute('DELETE FROM patients WHERE id = ? AND owner_username = ?', (patient_db_id, username))
         count = c.rowcount
+        if count:
+            c.execute('UPDATE jobs SET patient_id = NULL WHERE patient_id = ? AND username = ?', (patient_db_id, username))
         conn.commit()
         conn.close()
         return count > 0
@@ -385,14 +420,35 @@ def update_patient(username: str, patient_db_id: int, updates: Dict[str, Any]) -
 
 import json
 
+def result_findings(result: Optional[Dict[str, Any]]) -> Tuple[Optional[str], Optional[str]]:
+    """
+    (domain key, JSON {label_id: probability}) of a result, stored next to it for prior-study lookups.
+    (None, None) only without a domain key (QC rejected); an empty `specific` (triaged normal) gives "{}".
+    """
+    domain = ((result or {}).get('domain') or {}).get('key')
+    if not domain:
+        return None, None
+    findings = {item['label_id']: item.get('probability', 0) for item in result.get('specific') or [] if item.get('label_id')}
+    return domain, json.dumps(findings)
+
+def _decode_job(row) -> Dict[str, Any]:
+    job = dict(row)
+    for column in ('result', 'findings'):
+        if job.get(column):
+            try:
+                job[column] = json.loads(job[column])
+            except ValueError:
+                job[column] = None
+    return job
+
 def create_job(job_data: Dict[str, Any]):
     """Create a new job record."""
     try:
         conn = get_db_connection()
         c = conn.cursor()
         c.execute('''
-            INSERT INTO jobs (id, status, result, error, created_at, storage_path, username, file_type)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO jobs (id, status, result, error, created_at, storage_path, username, file_type, patient_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             job_data['id'],
             job_data.get('status', 'pending'),
@@ -401,7 +457,8 @@ def create_job(job_data: Dict[str, Any]):
             job_data['created_at'],
             job_data.get('storage_path'),
             job_data.get('username'),
-            job_data.get('file_type')
+            job_data.get('file_type'),
+            job_data.get('patient_id')
         ))
         conn.commit()
         conn.close()
@@ -423,15 +480,7 @@ def get_job(job_id: str, username: Optional[str] = None) -> Optional[Dict[str, A
     row = c.fetchone()
     conn.close()
     
-    if row:
-        job = dict(row)
-        if job['result']:
-            try:
-                job['result'] = json.loads(job['result'])
-            except:
-                job['result'] = None
-        return job
-    return None
+    return _decode_job(row) if row else None
 
 def update_job_status(job_id: str, status: str, result: Optional[Dict] = None, error: Optional[str] = None):
     """Update job status and result."""
@@ -445,6 +494,10 @@ def update_job_status(job_id: str, status: str, result: Optional[Dict] = None, e
         if result is not None:
             updates.append("result = ?")
             params.append(json.dumps(result))
+            domain, findings = result_findings(result)
+            if findings is not None:
+                updates.extend(["domain = ?", "findings = ?"])
+                params.extend([domain, findings])
             
         if error is not None:
             updates.append("error = ?")
@@ -476,15 +529,7 @@ def get_latest_job(username: str) -> Optional[Dict[str, Any]]:
     row = c.fetchone()
     conn.close()
     
-    if row:
-        job = dict(row)
-        if job['result']:
-            try:
-                job['result'] = json.loads(job['result'])
-            except:
-                job['result'] = None
-        return job
-    return None
+    return _decode_job(row) if row else None
 
 def get_active_job_by_image(username: str, image_id: str) -> Optional[Dict[str, Any]]:
     """
@@ -502,12 +547,139 @@ def get_active_job_by_image(username: str, image_id: str) -> Optional[Dict[str,
     row = c.fetchone()
     conn.close()
     
-    if row:
-        job = dict(row)
-        if job['result']:
-            try:
-                job['result'] = json.loads(job['result'])
-            except:
-                job['result'] = None
-        return job
-    return None
+    return _decode_job(row) if row else None
+
+def link_job_patient(job_id: str, username: str, patient_db_id: Optional[int]) -> bool:
+    """Link an owned job to an owned patient (None unlinks). Fills domain/findings of older jobs."""
+    job = get_job(job_id, username=username)
+    if not job:
+        return False
+    if patient_db_id is not None and not get_patient(username, patient_db_id):
+        return False
+    domain, findings = result_findings(job.get('result'))
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        'UPDATE jobs SET patient_id = ?, domain = COALESCE(domain, ?), findings = COALESCE(findings, ?) WHERE id = ? AND username = ?',
+        (patient_db_id, domain, findings, job_id, username)
+    )
+    conn.commit()
+    conn.close()
+    return True
+
+def get_patient_studies(username: str, patient_db_id: int, domain: str, before: Optional[float] = None,
+                        limit: int = 50) -> List[Dict[str, Any]]:
+    """
+    Analyzed studies of a patient in a domain, newest first (idx_jobs_patient_domain_created).
+    Light rows: no result JSON, findings are the latest scoring.
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    query = '''
+        SELECT id, storage_path, created_at, status, domain, findings FROM jobs
+        WHERE patient_id = ? AND domain = ? AND username = ? AND status IN (?, ?)
+    '''
+    params: List[Any] = [patient_db_id, domain, username, JobStatus.CLASSIFIED.value, JobStatus.COMPLETED.value]
+    if before is not None:
+        query += " AND created_at < ?"
+        params.append(before)
+    query += " ORDER BY created_at DESC LIMIT ?"
+    params.append(limit)
+    c.execute(query, params)
+    rows = c.fetchall()
+    conn.close()
+    return [_decode_job(row) for row in rows]
+
+# --- Result Versions (Re-scoring) ---
+
+def get_completed_jobs_page(username: Optional[str] = None, after: Optional[Tuple[float, str]] = None,
+                            batch_size: int = 200) -> List[Dict[str, Any]]:
+    """
+    One page of completed jobs (oldest first), optionally for one user. Keyset paging:
+    pass the (created_at, id) of the last row as `after`. Only the columns re-scoring needs.
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    query = "SELECT id, username, storage_path, result, created_at FROM jobs WHERE status = ?"
+    params: List[Any] = [JobStatus.COMPLETED.value]
+    if username:
+        query += " AND username = ?"
+        params.append(username)
+    if after is not None:
+        query += " AND (created_at > ? OR (created_at = ? AND id > ?))"
+        params.extend([after[0], after[0], after[1]])
+    query += " ORDER BY created_at ASC, id ASC LIMIT ?"
+    params.append(batch_size)
+    c.execute(query, params)
+    rows = c.fetchall()
+    conn.close()
+    return [_decode_job(row) for row in rows]
+
+def get_classified_jobs() -> List[Dict[str, Any]]:
+    """Jobs whose heatmap was still queued (oldest first): the explain queue lives in memory."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT id, username, storage_path, result, created_at FROM jobs WHERE status = ? ORDER BY created_at ASC",
+              (JobStatus.CLASSIFIED.value,))
+    rows = c.fetchall()
+    conn.close()
+    return [_decode_job(row) for row in rows]
+
+def get_latest_prompt_versions(job_ids: List[str]) -> Dict[str, Optional[str]]:
+    """prompt_version of the newest result version of each job (jobs never re-scored are absent)."""
+    if not job_ids:
+        return {}
+    conn = get_db_connection()
+    c = conn.cursor()
+    placeholders = ", ".join("?" for _ in job_ids)
+    c.execute(f'''
+        SELECT rv.job_id, rv.prompt_version FROM result_versions rv
+        JOIN (
+            SELECT job_id, MAX(version) AS version FROM result_versions
+            WHERE job_id IN ({placeholders}) GROUP BY job_id
+        ) latest ON rv.job_id = latest.job_id AND rv.version = latest.version
+    ''', job_ids)
+    rows = c.fetchall()
+    conn.close()
+    return {row['job_id']: row['prompt_version'] for row in rows}
+
+def add_result_version(job_id: str, result: Dict[str, Any], prompt_version: Optional[str] = None) -> int:
+    """Append a new result version for a job. Version 1 is jobs.result itself."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT COALESCE(MAX(version), 1) FROM result_versions WHERE job_id = ?", (job_id,))
+    version = c.fetchone()[0] + 1
+    c.execute('''
+        INSERT INTO result_versions (job_id, version, prompt_version, result, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (job_id, version, prompt_version, json.dumps(result), time.time()))
+    domain, findings = result_findings(result)
+    if findings is not None:
+        # Prior studies compare latest scorings (a re-score may move the study to another domain)
+        c.execute("UPDATE jobs SET domain = ?, findings = ? WHERE id = ?", (domain, findings, job_id))
+    conn.commit()
+    conn.close()
+    return version
+
+def get_result_versions(job_id: str, latest_only: bool = False) -> List[Dict[str, Any]]:
+    """Re-scored versions of a job, newest first."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        "SELECT * FROM result_versions WHERE job_id = ? ORDER BY version DESC" + (" LIMIT 1" if latest_only else ""),
+        (job_id,)
+    )
+    rows = c.fetchall()
+    conn.close()
+
+    versions = []
+    for row in rows:
+        version = dict(row)
+        version['result'] = json.loads(version['result'])
+        versions.append(version)
+    return versions
+
+def get_latest_result_version(job_id: str) -> Optional[Dict[str, Any]]:
+    """Most recent re-scored version of a job (None if never re-scored)."""
+    versions = get_result_versions(job_id, latest_only=True)
+    return versions[0] if versions else None
@@ -0,0 +1,289 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import storage_manager
+
+try:
+    import fcntl  # POSIX only: cross-process append lock (inference workers)
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger("ElephMind-EmbeddingStore")
+
+# =========================================================================
+# PERSISTENT EMBEDDING STORE
+# =========================================================================
+# Keeps what the vision tower computed for an analyzed image, so re-scoring,
+# similarity search and heatmap regeneration are a disk read instead of a
+# full forward pass.
+#
+# Layout (next to the user's images):
+#   <user_dir>/embeddings/<vision_version_hash>/
+#       version.json          {"model_version", "generation"}
+#       vectors.<gen>.f16     append-only float16 data (memory-mapped for reads)
+#       index.<gen>.jsonl     one line per put: {"image_id", "ts", "arrays": {name: [offset, shape]}}
+#
+# Data is written before its index line, so a crash never leaves an index
+# entry pointing at missing bytes. The last entry of an image_id wins.
+#
+# Bounded per user: once the data file passes `max_bytes` (superseded records
+# included), live entries are copied into generation + 1 down to 3/4 of the
+# budget, newest first. Hidden states (~2.4 MB per image) of the oldest images
+# go first and their pooled embedding (~2 KB, all re-scoring and prior studies
+# need) is kept; only then are whole entries dropped. Hidden states older than
+# `max_age_s` are dropped the same way. The switch is atomic (version.json),
+# open maps of the old files stay valid.
+
+FLOAT16_MAX = float(np.finfo(np.float16).max)
+POOLED_ARRAY = "image_embeds"
+
+
+def version_hash(model_version: str) -> str:
+    return hashlib.sha256(model_version.encode()).hexdigest()[:16]
+
+
+def _entry_size(arrays: Dict[str, list]) -> int:
+    """float16 elements referenced by one index entry."""
+    return sum(int(np.prod(shape)) for _, shape in arrays.values())
+
+
+def _entry_end(arrays: Dict[str, list]) -> int:
+    """First float16 element past the arrays of one index entry."""
+    return max(offset + int(np.prod(shape)) for offset, shape in arrays.values())
+
+
+class EmbeddingStore:
+    """Append-only memory-mapped float16 arrays of ONE user and ONE model version."""
+
+    def __init__(self, root: Path, model_version: str, max_bytes: int = 0, max_age_s: float = 0):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.root / "version.json"
+        self.lock_path = self.root / ".lock"
+        self.max_bytes = max(0, max_bytes)    # 0 = unbounded
+        self.max_age_s = max(0.0, max_age_s)  # 0 = hidden states kept until the size bound
+        self._lock = threading.Lock()
+        self.generation = -1
+        self._index: Dict[str, Dict[str, Any]] = {}
+        self._index_offset = 0
+        self._mmap: Optional[np.memmap] = None
+
+        with self._file_lock():
+            if not self.manifest_path.exists():
+                self._write_manifest({"model_version": model_version, "generation": 0})
+
+    def _paths(self, generation: int) -> Tuple[Path, Path]:
+        return self.root / f"vectors.{generation}.f16", self.root / f"index.{generation}.jsonl"
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self.lock_path, "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        tmp = self.manifest_path.with_name(f"{self.manifest_path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.manifest_path)
+
+    # --- Index / mapping refresh (other processes may have appended or compacted) ---
+
+    def _refresh_index(self):
+        with open(self.manifest_path, "r") as f:
+            generation = int(json.load(f).get("generation", 0))
+        if generation != self.generation:
+            self.generation = generation
+            self._index = {}
+            self._index_offset = 0
+            self._mmap = None
+
+        _, index_path = self._paths(self.generation)
+        if not index_path.exists() or index_path.stat().st_size == self._index_offset:
+            return
+        with open(index_path, "rb") as f:
+            f.seek(self._index_offset)
+            chunk = f.read()
+        # Only consume complete lines (a writer may be mid-append)
+        complete = chunk[:chunk.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            if line.strip():
+                entry = json.loads(line)
+                self._index[entry["image_id"]] = {"ts": entry.get("ts", 0.0), "arrays": entry["arrays"]}
+        self._index_offset += len(complete)
+
+    def _mapped(self, needed: int) -> np.memmap:
+        """float16 view of the data file, remapped when it has grown past `needed` elements."""
+        if self._mmap is None or self._mmap.shape[0] < needed:
+            self._mmap = np.memmap(self._paths(self.generation)[0], dtype=np.float16, mode="r")
+        return self._mmap
+
+    # --- Retention ---
+
+    def _over_budget(self, data_bytes: int, now: float) -> bool:
+        if self.max_bytes and data_bytes > self.max_bytes:
+            return True
+        if self.max_age_s:
+            cutoff = now - self.max_age_s
+            return any(entry["ts"] < cutoff and len(entry["arrays"]) > 1 for entry in self._index.values())
+        return False
+
+    def _retained(self, now: float) -> List[Tuple[str, float, Dict[str, list]]]:
+        """(image_id, ts, arrays) kept by a compaction, oldest first."""
+        newest_first = sorted(self._index.items(), key=lambda item: item[1]["ts"], reverse=True)
+        budget = self.max_bytes * 3 // 4 // 2 if self.max_bytes else None  # float16 elements
+        cutoff = now - self.max_age_s * 3 / 4 if self.max_age_s else None
+
+        # Full entries first, newest first, then the pooled embedding of the rest
+        kept, used = {}, 0
+        for image_id, entry in newest_first:
+            arrays = entry["arrays"]
+            if cutoff is not None and entry["ts"] < cutoff:
+                continue
+            if budget is None or used + _entry_size(arrays) <= budget:
+                kept[image_id] = arrays
+                used += _entry_size(arrays)
+        for image_id, entry in newest_first:
+            pooled = {POOLED_ARRAY: entry["arrays"][POOLED_ARRAY]} if POOLED_ARRAY in entry["arrays"] else None
+            if image_id in kept or pooled is None:
+                continue
+            if budget is None or used + _entry_size(pooled) <= budget:
+                kept[image_id] = pooled
+                used += _entry_size(pooled)
+
+        return [(image_id, entry["ts"], kept[image_id]) for image_id, entry in reversed(newest_first) if image_id in kept]
+
+    def _compact(self, now: float):
+        """Copy the retained entries into generation + 1 (caller holds the file lock)."""
+        old_paths = self._paths(self.generation)
+        new_generation = self.generation + 1
+        data_path, index_path = self._paths(new_generation)
+        retained = self._retained(now)
+
+        data = self._mapped(max((_entry_end(entry["arrays"]) for entry in self._index.values()), default=0))
+        lines, offset = [], 0
+        with open(data_path, "wb") as f:
+            for image_id, ts, arrays in retained:
+                entry = {}
+                for name, (start, shape) in arrays.items():
+                    size = int(np.prod(shape))
+                    f.write(np.ascontiguousarray(data[start:start + size]).tobytes())
+                    entry[name] = [offset, shape]
+                    offset += size
+                lines.append(json.dumps({"image_id": image_id, "ts": ts, "arrays": entry}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        with open(index_path, "w") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+        with open(self.manifest_path, "r") as f:
+            manifest = json.load(f)
+        manifest["generation"] = new_generation
+        self._write_manifest(manifest)
+        for path in old_paths:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+        logger.info(f"🧹 Embedding store compacted: {self.root} (generation {new_generation}, "
+                    f"{len(retained)}/{len(self._index)} images, {offset * 2 / 1e6:.1f} MB)")
+        self._refresh_index()
+    # --- Public API ---
+
+    def __contains__(self, image_id: str) -> bool:
+        with self._lock:
+            self._refresh_index()
+            return image_id in self._index
+
+    def get(self, image_id: str) -> Optional[Dict[str, np.ndarray]]:
+        """{name: float16 array view} or None. Views are read-only memory maps."""
+        with self._lock:
+            self._refresh_index()
+            entry = self._index.get(image_id)
+            if entry is None:
+                return None
+            data = self._mapped(_entry_end(entry["arrays"]))
+            return {
+                name: data[offset:offset + int(np.prod(shape))].reshape(shape)
+                for name, (offset, shape) in entry["arrays"].items()
+            }
+
+    def put(self, image_id: str, arrays: Dict[str, np.ndarray]):
+        """Append arrays (stored as float16) and their index line, then enforce the bounds."""
+        blobs = {name: np.clip(np.asarray(a, dtype=np.float32), -FLOAT16_MAX, FLOAT16_MAX).astype(np.float16)
+                 for name, a in arrays.items()}
+
+        with self._lock, self._file_lock():
+            self._refresh_index()  # Latest generation of every process
+            data_path, index_path = self._paths(self.generation)
+            with open(data_path, "ab") as f:
+                offset = f.tell() // 2  # float16 elements
+                entry = {}
+                for name, blob in blobs.items():
+                    f.write(np.ascontiguousarray(blob).tobytes())
+                    entry[name] = [offset, list(blob.shape)]
+                    offset += blob.size
+                f.flush()
+                os.fsync(f.fileno())
+
+            now = time.time()
+            with open(index_path, "a") as f:
+                f.write(json.dumps({"image_id": image_id, "ts": now, "arrays": entry}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._refresh_index()
+            if self._over_budget(offset * 2, now):
+                self._compact(now)
+
+
+class EmbeddingStoreRegistry:
+    """One EmbeddingStore per user for the active model version."""
+
+    def __init__(self, model_version: str, max_bytes: int = 0, max_age_s: float = 0):
+        self.model_version = model_version
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.version_hash = version_hash(model_version)
+        self._stores: Dict[str, EmbeddingStore] = {}
+        self._lock = threading.Lock()
+
+    def for_user(self, username: str) -> EmbeddingStore:
+        with self._lock:
+            store = self._stores.get(username)
+            if store is None:
+                root = storage_manager.get_user_storage_path(username) / "embeddings" / self.version_hash
+                store = EmbeddingStore(root, self.model_version, max_bytes=self.max_bytes, max_age_s=self.max_age_s)
+                self._stores[username] = store
+            return store
+
+    def get(self, username: str, image_id: str) -> Optional[Dict[str, np.ndarray]]:
+        try:
+            return self.for_user(username).get(image_id)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Embedding store read failed ({username}/{image_id}): {e}")
+            return None
+
+    def put(self, username: str, image_id: str, arrays: Dict[str, np.ndarray]):
+        try:
+            self.for_user(username).put(image_id, arrays)
+        except OSError as e:
+            logger.warning(f"Embedding store write failed ({username}/{image_id}): {e}")
@@ -5,10 +5,14 @@ import numpy as np
 import cv2
 from PIL import Image
 import logging
+import threading
+import weakref
 from typing import List, Dict, Any, Optional, Tuple, Union
-from pytorch_grad_cam import GradCAMPlusPlus
 from pytorch_grad_cam.utils.image import show_cam_on_image
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from image_context import ImageContext
+from image_pipeline import rgb_array
+from vision_backends import pooled_embedding
 
 logger = logging.getLogger(__name__)
 
@@ -67,31 +71,92 @@ EXPERT_KNOWLEDGE = {
     )
 }
 
-# =========================================================================
-# WRAPPERS AND UTILS
-# =========================================================================
+# Anatomical context of the explanation per domain (anything else: DEFAULT_ANATOMICAL_CONTEXT)
+ANATOMICAL_CONTEXTS = {
+    "Thoracic": "lung parenchyma",
+    "Orthopedics": "bone structure",
+    "Dermatology": "skin lesion",
+    "Ophthalmology": "retina",
+}
+DEFAULT_ANATOMICAL_CONTEXT = "body part"
+
+# Morphology Engine (CTR) segmentation configs
+CTR_HEART_CONFIG = ExpertSegConfig(
+    modality="CXR",
+    target_organ="Heart",
+    anatomical_prompts=["heart silhouette", "cardiac shadow", "mediastinum"],
+    threshold_percentile=85, # Heart is salient
+    min_area_ratio=0.05,
+    max_area_ratio=0.40,
+    morphology_kernel=5
+)
+CTR_LUNG_CONFIG = ExpertSegConfig(
+    modality="CXR",
+    target_organ="Thorax",
+    anatomical_prompts=["lung fields", "thoracic cage", "rib cage", "diaphragm"],
+    threshold_percentile=75,
+    min_area_ratio=0.20,
+    max_area_ratio=0.85,
+    morphology_kernel=5
+)
+
+# Resolutions: every mask / CAM operation (threshold, morphology, validation,
+# fusion, reliability) runs on a fixed working grid whatever the upload size
+# (4000x3000 dermoscopy included). Only the overlay is upscaled, once, capped.
+WORK_LONG_SIDE = 448      # Working grid long side (aspect ratio preserved)
+DISPLAY_MAX_SIDE = 1024   # Heatmap overlay long side cap
 
-class HuggingFaceWeirdCLIPWrapper(nn.Module):
+def working_size(image_size: Tuple[int, int]) -> Tuple[int, int]:
+    """(width, height) of the working grid for an image of `image_size` (width, height)."""
+    w, h = image_size
+    scale = WORK_LONG_SIDE / max(w, h)
+    return max(1, round(w * scale)), max(1, round(h * scale))
+
+def display_rgb(image: Image.Image) -> np.ndarray:
+    """uint8 RGB pixels downscaled to DISPLAY_MAX_SIDE if larger (read-only shared buffer if not)."""
+    img_np = rgb_array(image)
+    h, w = img_np.shape[:2]
+    scale = DISPLAY_MAX_SIDE / max(w, h)
+    if scale < 1.0:
+        img_np = cv2.resize(img_np, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    return img_np
+
+def display_image(image: Image.Image) -> np.ndarray:
+    """Float32 [0, 1] RGB copy of the image, downscaled to DISPLAY_MAX_SIDE if larger."""
+    return display_rgb(image).astype(np.float32) / 255.0
+
+def expert_config(anatomical_context: str) -> ExpertSegConfig:
+    """Segmentation config constraining the explanation for an anatomical context."""
+    if "lung" in anatomical_context.lower():
+        return EXPERT_KNOWLEDGE["Thoracic"]
+    elif "bone" in anatomical_context.lower() or "knee" in anatomical_context.lower():
+        return EXPERT_KNOWLEDGE["Orthopedics"]
+    else:
+        return replace(EXPERT_KNOWLEDGE["Default"], anatomical_prompts=[anatomical_context])
+
+def anatomical_mask_configs(anatomical_context: str) -> Dict[str, ExpertSegConfig]:
     """
-    Wraps SigLIP to act like a standard classifier for Grad-CAM.
-    Target: Cosine Similarity Score.
+    Every named mask a domain's pipeline will ask for, so they can be scored in ONE pass:
+    'anatomy' (explanation constraint) + 'heart' / 'thorax' (CTR) for chest images.
     """
-    def __init__(self, model, text_input_ids, attention_mask):
-        super(HuggingFaceWeirdCLIPWrapper, self).__init__()
-        self.model = model
-        self.text_input_ids = text_input_ids
-        self.attention_mask = attention_mask
-
-    def forward(self, pixel_values):
-        outputs = self.model(
-            pixel_values=pixel_values, 
-            input_ids=self.text_input_ids,
-            attention_mask=self.attention_mask
-        )
-        # outputs.logits_per_image is (Batch, Num_Prompts)
-        # This IS the similarity score (scaled). 
-        # Grad-CAM++ will derive gradients relative to this score.
-        return outputs.logits_per_image
+    configs = {"anatomy": expert_config(anatomical_context)}
+    if configs["anatomy"] is EXPERT_KNOWLEDGE["Thoracic"]:
+        configs["heart"] = CTR_HEART_CONFIG
+        configs["thorax"] = CTR_LUNG_CONFIG
+    return configs
+
+def explainability_prompts() -> List[str]:
+    """Every text prompt explainability can ask for (encoded once into the text bank)."""
+    prompts = []
+    for config in list(EXPERT_KNOWLEDGE.values()) + [CTR_HEART_CONFIG, CTR_LUNG_CONFIG]:
+        prompts.extend(config.anatomical_prompts)
+    prompts.extend(ANATOMICAL_CONTEXTS.values())  # Default config uses the context itself as prompt
+    prompts.append(DEFAULT_ANATOMICAL_CONTEXT)
+    return list(dict.fromkeys(prompts))
+
+# =========================================================================
+# WRAPPERS AND UTILS
+# =========================================================================
 
 def reshape_transform(tensor, width=32, height=32):
     """Reshape Transformer attention/embeddings for Grad-CAM."""
@@ -104,6 +169,85 @@ def reshape_transform(tensor, width=32, height=32):
     result = result.transpose(2, 3).transpose(1, 2)
     return result
 
+class GradCamPlusPlus:
+    """
+    Grad-CAM++ (same weighting as pytorch_grad_cam.GradCAMPlusPlus) on one vision layer.
+    
+    - ONE forward hook per model, registered once and reused across requests
+      (inactive unless the current thread is computing a CAM).
+    - Vision tower only, scored against fixed text embeddings (text bank).
+    - All target prompts in ONE forward (input repeated per prompt) and ONE
+      backward (each copy differentiates its own prompt logit), gradients
+      taken w.r.t. the hooked activation only (nothing upstream is tracked).
+    """
+    def __init__(self, model, target_layer: nn.Module):
+        self.model = model
+        self._local = threading.local()
+        self._handle = target_layer.register_forward_hook(self._hook)
+
+    def _hook(self, module, inputs, output):
+        if not getattr(self._local, "capture", False):
+            return None
+        # Graph starts here: upstream layers run without autograd bookkeeping
+        activation = output.detach().requires_grad_(True)
+        self._local.activation = activation
+        return activation
+
+    def __call__(self, pixel_values: torch.Tensor, text_embeds: torch.Tensor,
+                 logit_scale: float, logit_bias: float, output_size: Optional[Tuple[int, int]] = None) -> np.ndarray:
+        """
+        (1, 3, H, W) pixels + (P, D) text embeddings -> (P, h, w) CAMs in [0, 1],
+        resized once to output_size (width, height), default the input size.
+        """
+        num_targets = text_embeds.size(0)
+        batch = pixel_values.expand(num_targets, -1, -1, -1)
+
+        self._local.capture = True
+        try:
+            with torch.enable_grad():
+                outputs = self.model.vision_model(pixel_values=batch)
+                image_embeds = pooled_embedding(self.model, outputs)
+                logits = image_embeds @ text_embeds.t() * logit_scale + logit_bias  # (P, P)
+                activation = self._local.activation
+                grads = torch.autograd.grad(logits.diagonal().sum(), activation)[0]
+        finally:
+            self._local.capture = False
+            self._local.activation = None
+
+        activations = reshape_transform(activation.detach()).float().cpu().numpy()  # (P, C, h, w)
+        grads = reshape_transform(grads).float().cpu().numpy()
+
+        # Grad-CAM++ channel weights
+        grads_power_2 = grads ** 2
+        grads_power_3 = grads_power_2 * grads
+        sum_activations = np.sum(activations, axis=(2, 3))
+        aij = grads_power_2 / (2 * grads_power_2 + sum_activations[:, :, None, None] * grads_power_3 + 1e-6)
+        aij = np.where(grads != 0, aij, 0)
+        weights = np.sum(np.maximum(grads, 0) * aij, axis=(2, 3))
+
+        cams = np.maximum(np.sum(weights[:, :, None, None] * activations, axis=1), 0)
+        width, height = output_size or (pixel_values.shape[-1], pixel_values.shape[-2])
+        scaled = []
+        for cam in cams:
+            cam = cam - cam.min()
+            cam = cam / (1e-7 + cam.max())
+            scaled.append(cv2.resize(cam.astype(np.float32), (width, height)))
+        return np.stack(scaled)
+
+_GRADCAM_BY_MODEL: "weakref.WeakKeyDictionary[nn.Module, GradCamPlusPlus]" = weakref.WeakKeyDictionary()
+_GRADCAM_LOCK = threading.Lock()
+
+def get_gradcam(model) -> GradCamPlusPlus:
+    """Shared Grad-CAM++ of a model (hook registered on first use)."""
+    with _GRADCAM_LOCK:
+        cam = _GRADCAM_BY_MODEL.get(model)
+        if cam is None:
+            # Layer Selection: 2nd to last encoder layer (Better spatial features than last Norm)
+            # SigLIP structure: model.vision_model.encoder.layers
+            cam = GradCamPlusPlus(model, model.vision_model.encoder.layers[-2].layer_norm1)
+            _GRADCAM_BY_MODEL[model] = cam
+        return cam
+
 # =========================================================================
 # EXPERT+ EXPLAINABILITY ENGINE
 # =========================================================================
@@ -116,91 +260,108 @@ class ExplainabilityEngine:
         self.device = self.model.device
 
     def _get_expert_config(self, anatomical_context: str) -> ExpertSegConfig:
-        if "lung" in anatomical_context.lower():
-            return EXPERT_KNOWLEDGE["Thoracic"]
-        elif "bone" in anatomical_context.lower() or "knee" in anatomical_context.lower():
-            return EXPERT_KNOWLEDGE["Orthopedics"]
-        else:
-            base = EXPERT_KNOWLEDGE["Default"]
-            base.anatomical_prompts = [anatomical_context]
-            return base
-
-    def generate_expert_mask(self, image: Image.Image, config: ExpertSegConfig) -> Dict[str, Any]:
+        return expert_config(anatomical_context)
+
+    def _ensure_context(self, image: Image.Image, context: Optional[ImageContext]) -> ImageContext:
+        """Reuse the request's vision pass; only build one when called standalone."""
+        if context is not None:
+            return context
+        return self.wrapper.build_context(image)
+
+    def generate_expert_mask(self, image: Image.Image, config: ExpertSegConfig, context: Optional[ImageContext] = None) -> Dict[str, Any]:
+        """Single-config segmentation (see anatomical_masks)."""
+        return self.anatomical_masks(image, {"mask": config}, context=context)["mask"]
+
+    def anatomical_masks(self, image: Image.Image, configs: Dict[str, ExpertSegConfig],
+                         context: Optional[ImageContext] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Mask service: named masks {name: {"mask", "audit"}} for several configs.
+        Configs not yet computed for this image are scored TOGETHER (one
+        similarity matmul over the union of their prompts, one upscale),
+        then cached on the context for the other consumers (CTR, explain).
+        """
+        context = self._ensure_context(image, context)
+        missing = {repr(cfg): cfg for cfg in configs.values() if repr(cfg) not in context.masks}
+        if missing:
+            context.masks.update(self._score_masks(image, list(missing.values()), context))
+
+        # Copies: callers extend their audit dict
+        return {
+            name: {"mask": context.masks[repr(cfg)]["mask"], "audit": dict(context.masks[repr(cfg)]["audit"])}
+            for name, cfg in configs.items()
+        }
+
+    def _score_masks(self, image: Image.Image, configs: List[ExpertSegConfig], context: ImageContext) -> Dict[str, Dict[str, Any]]:
         """
         Expert Segmentation: 
         Multi-Prompt Ensembling -> Patch Similarity -> Adaptive Threshold -> Morphology -> Validation.
         """
-        audit = {
-            "seg_prompts": config.anatomical_prompts,
-            "seg_status": "INIT"
-        }
         try:
-            w, h = image.size
-            inputs = self.processor(text=config.anatomical_prompts, images=image, padding="max_length", return_tensors="pt")
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+            w, h = working_size(image.size)  # Masks live on the working grid, not the upload size
+            prompts = list(dict.fromkeys(p for cfg in configs for p in cfg.anatomical_prompts))
+            column = {p: i for i, p in enumerate(prompts)}
             
             with torch.no_grad():
-                # Vision Features (1, Token, Dim)
-                vision_outputs = self.model.vision_model(
-                    pixel_values=inputs["pixel_values"],
-                    output_hidden_states=True
-                )
-                last_hidden_state = vision_outputs.last_hidden_state
+                # Vision Features (1, Token, Dim) - shared request context, no extra vision pass
+                last_hidden_state = context.last_hidden_state
                 
-                # Text Features (Prompts, Dim)
-                # Text Features (Prompts, Dim)
-                # FIX: Robustly handle attention_mask (some processors don't return it for text-only inputs if irrelevant)
-                text_inputs_ids = inputs["input_ids"]
-                text_attention_mask = inputs.get("attention_mask")
+                # Text Features (Prompts, Dim) - cached text bank vectors, no text tower
+                text_embeds = self.wrapper.text_bank.vectors(prompts).to(last_hidden_state.device)
                 
-                if text_attention_mask is None:
-                    text_attention_mask = torch.ones_like(text_inputs_ids)
-
-                text_outputs = self.model.text_model(
-                    input_ids=text_inputs_ids,
-                    attention_mask=text_attention_mask
-                )
-                text_embeds = text_outputs.pooler_output
-                text_embeds = text_embeds / text_embeds.norm(p=2, dim=-1, keepdim=True)
+                # Similarity for the union of prompts: (T, D) @ (D, P) -> (T, P)
+                sim_map = torch.matmul(last_hidden_state[0], text_embeds.t())
+                # Mean across each config's prompts -> (Configs, T)
+                sim_maps = torch.stack([
+                    sim_map[:, [column[p] for p in cfg.anatomical_prompts]].mean(dim=1)
+                    for cfg in configs
+                ])
                 
-                # Similarity: (1, T, D) @ (D, P) -> (1, T, P)
-                sim_map = torch.matmul(last_hidden_state, text_embeds.t())
-                # Mean across Prompts -> (1, T)
-                sim_map = sim_map.mean(dim=2)
-                
-                # Reshape & Upscale
-                num_tokens = sim_map.size(1)
+                # Reshape & Upscale (all configs in one interpolate)
+                num_tokens = sim_maps.size(1)
                 side = int(np.sqrt(num_tokens))
-                sim_grid = sim_map.reshape(1, side, side)
-                
-                sim_grid = torch.nn.functional.interpolate(
-                    sim_grid.unsqueeze(0), 
+                sim_grids = torch.nn.functional.interpolate(
+                    sim_maps.reshape(1, len(configs), side, side), 
                     size=(h, w), 
                     mode='bilinear', 
                     align_corners=False
-                ).squeeze().cpu().numpy()
-                
-                # Adaptive Thresholding (Percentile)
-                thresh = np.percentile(sim_grid, config.threshold_percentile)
-                binary_mask = (sim_grid > thresh).astype(np.float32)
-                audit["seg_threshold"] = float(thresh)
-
-                # Morphological Cleaning
-                kernel = np.ones((config.morphology_kernel, config.morphology_kernel), np.uint8)
-                binary_mask = cv2.morphologyEx(binary_mask, cv2.MORPH_OPEN, kernel) # Remove noise
-                binary_mask = cv2.morphologyEx(binary_mask, cv2.MORPH_CLOSE, kernel) # Fill holes
-                binary_mask = cv2.GaussianBlur(binary_mask, (15, 15), 0) # Smooth contours
-                binary_mask = (binary_mask - binary_mask.min()) / (binary_mask.max() - binary_mask.min() + 1e-8)
-                
-                # Validation
-                val = self._validate_mask(binary_mask, config)
-                audit["seg_validation"] = val
-                
-                if not val["valid"]:
-                    logger.warning(f"Mask Invalid: {val['reason']}")
-                    return {"mask": None, "audit": audit}
-                
-                return {"mask": binary_mask, "audit": audit}
+                )[0].cpu().numpy()
+        except Exception as e:
+            logger.error(f"Segmentation Failed: {e}")
+            return {
+                repr(cfg): {"mask": None, "audit": {"seg_prompts": cfg.anatomical_prompts, "seg_status": "INIT", "seg_error": str(e)}}
+                for cfg in configs
+            }
+
+        return {repr(cfg): self._finalize_mask(sim_grids[i], cfg) for i, cfg in enumerate(configs)}
+
+    def _finalize_mask(self, sim_grid: np.ndarray, config: ExpertSegConfig) -> Dict[str, Any]:
+        """Threshold + morphology + validation of one similarity grid."""
+        audit = {
+            "seg_prompts": config.anatomical_prompts,
+            "seg_status": "INIT"
+        }
+        try:
+            # Adaptive Thresholding (Percentile)
+            thresh = np.percentile(sim_grid, config.threshold_percentile)
+            binary_mask = (sim_grid > thresh).astype(np.float32)
+            audit["seg_threshold"] = float(thresh)
+
+            # Morphological Cleaning
+            kernel = np.ones((config.morphology_kernel, config.morphology_kernel), np.uint8)
+            binary_mask = cv2.morphologyEx(binary_mask, cv2.MORPH_OPEN, kernel) # Remove noise
+            binary_mask = cv2.morphologyEx(binary_mask, cv2.MORPH_CLOSE, kernel) # Fill holes
+            binary_mask = cv2.GaussianBlur(binary_mask, (15, 15), 0) # Smooth contours
+            binary_mask = (binary_mask - binary_mask.min()) / (binary_mask.max() - binary_mask.min() + 1e-8)
+            
+            # Validation
+            val = self._validate_mask(binary_mask, config)
+            audit["seg_validation"] = val
+            
+            if not val["valid"]:
+                logger.warning(f"Mask Invalid ({config.target_organ}): {val['reason']}")
+                return {"mask": None, "audit": audit}
+            
+            return {"mask": binary_mask, "audit": audit}
                 
         except Exception as e:
             logger.error(f"Segmentation Failed: {e}")
@@ -220,7 +381,7 @@ class ExplainabilityEngine:
         # For now, strict Area check + Opening usually covers this.
         return {"valid": True}
 
-    def generate_expert_gradcam(self, image: Image.Image, target_prompts: List[str]) -> Dict[str, Any]:
+    def generate_expert_gradcam(self, image: Image.Image, target_prompts: List[str], context: Optional[ImageContext] = None) -> Dict[str, Any]:
         """
         Expert Grad-CAM:
         1. Multi-Prompt Ensembling (Averaging heatmaps).
@@ -230,48 +391,20 @@ class ExplainabilityEngine:
         audit = {"gradcam_prompts": target_prompts, "gradcam_status": "INIT"}
         
         try:
-             # Prepare Inputs
-            inputs = self.processor(text=target_prompts, images=image, padding="max_length", return_tensors="pt")
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
-            
-            # Robust Mask handling
-            input_ids = inputs.get('input_ids')
-            attention_mask = inputs.get('attention_mask')
-            if attention_mask is None and input_ids is not None:
-                attention_mask = torch.ones_like(input_ids)
-
-            # Wrapper
-            model_wrapper_cam = HuggingFaceWeirdCLIPWrapper(self.model, input_ids, attention_mask)
-            
-            # Layer Selection: 2nd to last encoder layer (Better spatial features than last Norm)
-            # SigLIP structure: model.vision_model.encoder.layers
-            target_layers = [self.model.vision_model.encoder.layers[-2].layer_norm1] 
-            
-            cam = GradCAMPlusPlus(
-                model=model_wrapper_cam, 
-                target_layers=target_layers,
-                reshape_transform=reshape_transform # Needs to handle (B, T, D)
-            )
-            
-            pixel_values = inputs.get('pixel_values')
+             # Prepare Inputs (pixel preprocessing comes from the shared context)
+            context = self._ensure_context(image, context)
+            text_bank = self.wrapper.text_bank
+            text_embeds = text_bank.vectors(target_prompts).to(self.device)
+
+            pixel_values = context.pixel_values.to(self.device)
             
             # ENSEMBLING GRAD-CAM
-            # We want to run Grad-CAM for EACH prompt index and average them.
-            # Grayscale CAM output is (Batch, H, W)
-            # We assume Batch=1 here.
-            
-            maps = []
-            for i in range(len(target_prompts)):
-                # Target Class Index = i (The index of the prompt in the logits)
-                # GradCAMPlusPlus targets=[ClassifierOutputTarget(i)]
-                from pytorch_grad_cam.utils.model_targets import ClassifierOutputTarget
-                
-                targets = [ClassifierOutputTarget(i)]
-                grayscale_cam = cam(input_tensor=pixel_values, targets=targets)
-                maps.append(grayscale_cam[0, :])
-            
-            # Average
-            avg_cam = np.mean(np.array(maps), axis=0)
+            # One CAM per prompt, all from a single forward/backward (reused hook), then averaged.
+            maps = get_gradcam(self.model)(
+                pixel_values, text_embeds, text_bank.logit_scale, text_bank.logit_bias,
+                output_size=working_size(image.size)
+            )
+            avg_cam = maps.mean(axis=0)
             
             # Point 5: Smart Normalization & Thresholding
             # "cam = normalize(cam)"
@@ -300,15 +433,15 @@ class ExplainabilityEngine:
             audit["gradcam_error"] = str(e)
             return {"map": None, "audit": audit}
 
-    def explain(self, image: Image.Image, target_text: str, anatomical_context: str) -> Dict[str, Any]:
+    def explain(self, image: Image.Image, target_text: str, anatomical_context: str, context: Optional[ImageContext] = None) -> Dict[str, Any]:
         """
         Final Expert Fusion Pipeline.
         """
         # 0. Setup
-        config = self._get_expert_config(anatomical_context)
+        context = self._ensure_context(image, context)
         
-        # 1. Anatomical Mask (Strict Constraint)
-        seg_res = self.generate_expert_mask(image, config)
+        # 1. Anatomical Mask (Strict Constraint) - shared with the CTR engine for chest images
+        seg_res = self.anatomical_masks(image, anatomical_mask_configs(anatomical_context), context=context)["anatomy"]
         mask = seg_res["mask"]
         audit = seg_res["audit"]
         
@@ -326,7 +459,7 @@ class ExplainabilityEngine:
         # 2. Attention Map (Multi-Prompt)
         # Using list of prompts implies Multi-Prompt Grad-CAM (Point 4)
         # We can auto-augment target_text if needed, but for now we trust the input.
-        gradcam_res = self.generate_expert_gradcam(image, [target_text])
+        gradcam_res = self.generate_expert_gradcam(image, [target_text], context=context)
         heatmap = gradcam_res["map"]
         audit.update(gradcam_res["audit"])
         
@@ -340,7 +473,7 @@ class ExplainabilityEngine:
                 "display_text": "Attention Insuffisante"
             }
              
-        # 3. Constraint Fusion (Point 7)
+        # 3. Constraint Fusion (Point 7) - both maps are on the working grid
         if mask.shape != heatmap.shape:
              mask = cv2.resize(mask, (heatmap.shape[1], heatmap.shape[0]))
              
@@ -356,29 +489,22 @@ class ExplainabilityEngine:
         # FIX: JSON Serialization Error (np.float32 -> float)
         audit["reliability_score"] = round(float(reliability), 4)
         
-        # 5. Visualize
-        img_np = np.array(image)
-        
-        # FIX: Ensure img_np is float32 [0,1]
-        img_np = img_np.astype(np.float32) / 255.0
-        
-        # FIX: Resize final_map (Heatmap) to match Original Image Size
+        # 5. Visualize: the ONLY upscale, to the capped display size
         # show_cam_on_image requires heatmap and image to be same shape
-        if final_map.shape != img_np.shape[:2]:
-            final_map = cv2.resize(final_map, (img_np.shape[1], img_np.shape[0]))
-            
-        visualization = show_cam_on_image(img_np, final_map, use_rgb=True)
+        img_np = display_image(image)
+        display_map = cv2.resize(final_map, (img_np.shape[1], img_np.shape[0]), interpolation=cv2.INTER_LINEAR)
+        visualization = show_cam_on_image(img_np, display_map, use_rgb=True)
         
         return {
             "heatmap_array": visualization,
-            "heatmap_raw": final_map,
+            "heatmap_raw": final_map,  # Working grid
             # FIX: Cast to float for JSON safety
             "reliability_score": round(float(reliability), 2),
             "confidence_label": confidence,
             "display_text": "Zone d'attention du modèle (Grad-CAM++)"
         }
 
-    def calculate_cardiothoracic_ratio(self, image: Image.Image) -> Dict[str, Any]:
+    def calculate_cardiothoracic_ratio(self, image: Image.Image, context: Optional[ImageContext] = None) -> Dict[str, Any]:
         """
         Morphology Engine: Calculate Heart/Thorax Ratio (CTR).
         
@@ -392,34 +518,16 @@ class ExplainabilityEngine:
         audit = {"ctr_status": "INIT"}
         
         try:
-            # 1. Heart Segmentation
-            heart_config = ExpertSegConfig(
-                modality="CXR",
-                target_organ="Heart",
-                anatomical_prompts=["heart silhouette", "cardiac shadow", "mediastinum"],
-                threshold_percentile=85, # Heart is salient
-                min_area_ratio=0.05,
-                max_area_ratio=0.40,
-                morphology_kernel=5
-            )
-            heart_res = self.generate_expert_mask(image, heart_config)
-            heart_mask = heart_res["mask"]
+            context = self._ensure_context(image, context)
+            
+            # 1+2. Heart & Thorax masks: one scoring pass, shared with explain()
+            masks = self.anatomical_masks(image, anatomical_mask_configs(ANATOMICAL_CONTEXTS["Thoracic"]), context=context)
+            heart_mask = masks["heart"]["mask"]
             
             if heart_mask is None:
                 return {"ctr": 0.0, "valid": False, "reason": "Heart segmentation failed"}
                 
-            # 2. Lung/Thorax Segmentation
-            lung_config = ExpertSegConfig(
-                modality="CXR",
-                target_organ="Thorax",
-                anatomical_prompts=["lung fields", "thoracic cage", "rib cage", "diaphragm"],
-                threshold_percentile=75,
-                min_area_ratio=0.20,
-                max_area_ratio=0.85,
-                morphology_kernel=5
-            )
-            lung_res = self.generate_expert_mask(image, lung_config)
-            lung_mask = lung_res["mask"]
+            lung_mask = masks["thorax"]["mask"]
             
             if lung_mask is None:
                  return {"ctr": 0.0, "valid": False, "reason": "Lung segmentation failed"}
@@ -447,6 +555,11 @@ class ExplainabilityEngine:
                  return {"ctr": 0.0, "valid": False, "reason": "Zero lung width"}
                  
             ctr = heart_width / lung_width
+            
+            # Widths were measured on the working grid: report upload pixels (even after a reduced decode)
+            px_scale = image.info.get("original_size", image.size)[0] / heart_mask.shape[1]
+            heart_width = round(heart_width * px_scale)
+            lung_width = round(lung_width * px_scale)
             logger.info(f"📐 Morphology Engine: Heart={heart_width}px, Lungs={lung_width}px, CTR={ctr:.2f}")
             
             return {
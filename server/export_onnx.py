@@ -0,0 +1,100 @@
+# export_onnx.py - Export the SigLIP vision tower to ONNX (one-off CLI)
+#
+# Usage:
+#   python export_onnx.py                                  # model from MODEL_DIR / models/oeil d'elephant
+#   python export_onnx.py --model-dir /path/to/model --samples ./parity_images --tolerance 0.05
+#
+# Then run the API with INFERENCE_BACKEND=onnx (and ONNX_VISION_PATH if --output was changed).
+import argparse
+import inspect
+import json
+import os
+import sys
+
+import torch
+from transformers import AutoModel, AutoProcessor
+
+from main import MEDICAL_DOMAINS
+from prompt_bank import TextEmbeddingBank
+from vision_backends import (
+    DEFAULT_ONNX_FILENAME,
+    OnnxVisionBackend,
+    TorchVisionBackend,
+    VisionEncoder,
+    check_parity,
+    load_sample_folder,
+    synthetic_samples,
+)
+
+
+def main():
+    default_model = os.getenv("MODEL_DIR") or os.path.join("models", "oeil d'elephant")
+
+    parser = argparse.ArgumentParser(description="Export the SigLIP vision encoder to ONNX with a logit parity check.")
+    parser.add_argument("--model-dir", default=default_model)
+    parser.add_argument("--output", default=None, help=f"Default: <model-dir>/{DEFAULT_ONNX_FILENAME}")
+    parser.add_argument("--samples", default=None, help="Folder of sample images for the parity check")
+    parser.add_argument("--tolerance", type=float, default=float(os.getenv("ONNX_PARITY_TOLERANCE", "0.05")))
+    parser.add_argument("--opset", type=int, default=17)
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(args.model_dir, DEFAULT_ONNX_FILENAME)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+
+    print(f"Loading model from: {args.model_dir}")
+    processor = AutoProcessor.from_pretrained(args.model_dir, local_files_only=True)
+    model = AutoModel.from_pretrained(args.model_dir, local_files_only=True)
+    model.eval()
+    if hasattr(model, 'logit_scale'):
+        with torch.no_grad():
+            model.logit_scale.data.fill_(3.80666)  # Same calibration as MedSigClipWrapper.load()
+
+    text_bank = TextEmbeddingBank(model, processor)
+    text_bank.build(MEDICAL_DOMAINS)
+
+    # Export (dynamic batch axis, fixed 448x448 input)
+    dummy = processor(images=synthetic_samples(1), return_tensors="pt")["pixel_values"]
+    extra = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        extra["dynamo"] = False  # TorchScript exporter: no onnxscript dependency
+    print(f"Exporting vision encoder to: {output}")
+    torch.onnx.export(
+        VisionEncoder(model).eval(),
+        (dummy,),
+        output,
+        input_names=["pixel_values"],
+        output_names=["last_hidden_state", "image_embeds"],
+        dynamic_axes={
+            "pixel_values": {0: "batch"},
+            "last_hidden_state": {0: "batch"},
+            "image_embeds": {0: "batch"},
+        },
+        opset_version=args.opset,
+        do_constant_folding=True,
+        **extra,
+    )
+
+    # Parity check on the sample set
+    images = load_sample_folder(args.samples) if args.samples else []
+    if not images:
+        images = synthetic_samples(8)
+    report = check_parity(TorchVisionBackend(model), OnnxVisionBackend(output), processor, text_bank, images, args.tolerance)
+    report["model_dir"] = args.model_dir
+    report["onnx_path"] = output
+
+    report_path = output + ".parity.json"
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+    if not report["passed"]:
+        # Never leave a drifting graph where the backend would pick it up
+        os.remove(output)
+        print(f"ERROR: logit drift {report['max_abs_logit_diff']} exceeds tolerance {args.tolerance}. Export discarded.")
+        sys.exit(1)
+
+    print("Export complete! Set INFERENCE_BACKEND=onnx to activate.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# export_text_bank.py - Encode every prompt once into a tensor file (one-off CLI)
+#
+# Usage:
+#   python export_text_bank.py                         # model from MODEL_DIR / models/oeil d'elephant
+#   python export_text_bank.py --model-dir /path/to/model --output /path/to/text_bank.pt
+#
+# Then run the API with INFERENCE_VISION_ONLY=true (and TEXT_BANK_PATH if --output was changed).
+# Re-run after any change to MEDICAL_DOMAINS or the explainability prompts.
+import argparse
+import os
+
+import torch
+from transformers import AutoModel, AutoProcessor
+
+from explainability import explainability_prompts
+from main import MEDICAL_DOMAINS
+from prompt_bank import DEFAULT_TEXT_BANK_FILENAME, TextEmbeddingBank
+
+
+def main():
+    default_model = os.getenv("MODEL_DIR") or os.path.join("models", "oeil d'elephant")
+
+    parser = argparse.ArgumentParser(description="Export the text embeddings of every prompt for vision-only workers.")
+    parser.add_argument("--model-dir", default=default_model)
+    parser.add_argument("--output", default=None, help=f"Default: <model-dir>/{DEFAULT_TEXT_BANK_FILENAME}")
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(args.model_dir, DEFAULT_TEXT_BANK_FILENAME)
+
+    print(f"Loading model from: {args.model_dir}")
+    processor = AutoProcessor.from_pretrained(args.model_dir, local_files_only=True)
+    model = AutoModel.from_pretrained(args.model_dir, local_files_only=True)
+    model.eval()
+
+    text_bank = TextEmbeddingBank(model, processor)
+    with torch.no_grad():
+        text_bank.build(MEDICAL_DOMAINS, extra_prompts=explainability_prompts())
+    text_bank.save(output)
+
+    print(f"Export complete ({text_bank.version})! Set INFERENCE_VISION_ONLY=true to activate.")
+
+
+if __name__ == "__main__":
+    main()
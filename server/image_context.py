@@ -0,0 +1,64 @@
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple
+
+import torch
+from PIL import Image
+
+from image_pipeline import pixel_values_for
+
+logger = logging.getLogger("ElephMind-ImageContext")
+
+# =========================================================================
+# PER-REQUEST IMAGE CONTEXT
+# =========================================================================
+# One /analyze job used to run the SigLIP vision tower (and the processor's
+# pixel preprocessing) once per stage. The context holds everything the
+# stages need from the vision side, computed exactly once per image.
+
+@dataclass
+class ImageContext:
+    image: Image.Image
+    pixel_values: torch.Tensor       # (1, 3, H, W) preprocessed pixels
+    image_embeds: torch.Tensor       # (1, D) L2-normalized pooled embedding
+    last_hidden_state: torch.Tensor  # (1, Tokens, D) patch features
+    masks: Dict[str, Any] = field(default_factory=dict, repr=False)  # Anatomical masks by config (mask service)
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """Original image size as (width, height)."""
+        return self.image.size
+
+
+def build_image_contexts(backend, processor, images: List[Image.Image]) -> List[ImageContext]:
+    """Preprocess and run ONE batched vision forward (any backend), then split per image.
+    `processor`: PixelPreprocessor (fast path) or the HF processor."""
+    pixel_values = pixel_values_for(processor, images)
+    last_hidden_state, image_embeds = backend.encode(pixel_values)
+
+    return [
+        ImageContext(
+            image=image,
+            pixel_values=pixel_values[i:i + 1],
+            image_embeds=image_embeds[i:i + 1],
+            last_hidden_state=last_hidden_state[i:i + 1],
+        )
+        for i, image in enumerate(images)
+    ]
+
+
+def build_image_context(backend, processor, image: Image.Image) -> ImageContext:
+    """Preprocess once and run a single vision forward for the whole pipeline."""
+    return build_image_contexts(backend, processor, [image])[0]
+
+
+def context_from_embeddings(processor, image: Image.Image, image_embeds: torch.Tensor,
+                            last_hidden_state: torch.Tensor) -> ImageContext:
+    """Rebuild a context from stored vision outputs (no vision forward; pixels are cheap)."""
+    pixel_values = pixel_values_for(processor, [image])
+    return ImageContext(
+        image=image,
+        pixel_values=pixel_values,
+        image_embeds=image_embeds.reshape(1, -1),
+        last_hidden_state=last_hidden_state.reshape(1, *last_hidden_state.shape[-2:]),
+    )
@@ -0,0 +1,112 @@
+import logging
+from typing import Any, Dict, List
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+logger = logging.getLogger("ElephMind-ImagePipeline")
+
+# =========================================================================
+# ZERO-COPY IMAGE PIPELINE
+# =========================================================================
+# An upload used to be copied at every stage: cv2 decode -> PIL (copy) ->
+# np.array (QC copy) -> processor (PIL resize, float copies for rescale,
+# normalize, channel transpose, stack, torch) -> np.array again for the
+# explanation overlay and the stored original.
+#
+# Now the decoded RGB uint8 buffer is attached ONCE to the image
+# (image.info["rgb"], read-only) and every stage reads that buffer:
+# QC, content hash, preprocessing, overlay. The preprocessor resizes into a
+# reused uint8 scratch and writes rescale + normalize directly into a
+# preallocated float32 (N, 3, H, W) tensor: one float write per pixel.
+
+RGB_INFO_KEY = "rgb"
+
+
+def attach_rgb(image: Image.Image, rgb: np.ndarray) -> Image.Image:
+    """Make `rgb` (H, W, 3 uint8, same pixels) the shared read-only buffer of `image`."""
+    rgb.flags.writeable = False  # Shared by every stage: nobody may modify it in place
+    image.info[RGB_INFO_KEY] = rgb
+    return image
+
+
+def rgb_array(image: Image.Image) -> np.ndarray:
+    """(H, W, 3) uint8 RGB pixels: the shared decoded buffer when present, else one conversion."""
+    rgb = image.info.get(RGB_INFO_KEY)
+    if rgb is not None and rgb.shape[1::-1] == image.size:
+        return rgb
+    return np.asarray(image if image.mode == "RGB" else image.convert("RGB"))
+
+
+class PixelPreprocessor:
+    """
+    Vectorized replacement of the image processor's resize + rescale + normalize
+    (same size / mean / std / rescale factor, read from the processor config).
+    """
+
+    def __init__(self, image_processor):
+        size = image_processor.size
+        self.height = int(size.get("height") or size.get("shortest_edge"))
+        self.width = int(size.get("width") or size.get("shortest_edge"))
+
+        rescale = float(image_processor.rescale_factor) if getattr(image_processor, "do_rescale", True) else 1.0
+        if getattr(image_processor, "do_normalize", True):
+            mean = np.asarray(image_processor.image_mean, dtype=np.float32)
+            std = np.asarray(image_processor.image_std, dtype=np.float32)
+        else:
+            mean, std = np.zeros(3, np.float32), np.ones(3, np.float32)
+
+        # (x * rescale - mean) / std == x * scale - offset
+        self.scale = (rescale / std).astype(np.float32)
+        self.offset = (mean / std).astype(np.float32)
+
+    @classmethod
+    def from_processor(cls, processor) -> "PixelPreprocessor":
+        return cls(getattr(processor, "image_processor", processor))
+
+    def __call__(self, images: List[Image.Image]) -> torch.Tensor:
+        out = torch.empty((len(images), 3, self.height, self.width), dtype=torch.float32)
+        out_np = out.numpy()  # Same memory
+        resized = np.empty((self.height, self.width, 3), dtype=np.uint8)  # Scratch reused across the batch
+
+        for i, image in enumerate(images):
+            rgb = rgb_array(image)
+            if rgb.shape[:2] == (self.height, self.width):
+                src = rgb
+            else:
+                # INTER_AREA when shrinking (anti-aliased like PIL's bicubic), cubic when enlarging
+                shrinking = rgb.shape[0] > self.height or rgb.shape[1] > self.width
+                src = cv2.resize(rgb, (self.width, self.height), dst=resized,
+                                 interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_CUBIC)
+            for c in range(3):
+                np.multiply(src[:, :, c], self.scale[c], out=out_np[i, c], casting="unsafe")
+                out_np[i, c] -= self.offset[c]
+        return out
+
+
+def pixel_values_for(processor, images: List[Image.Image]) -> torch.Tensor:
+    """pixel_values from the fast preprocessor, or from a HF processor (reference path)."""
+    if isinstance(processor, PixelPreprocessor):
+        return processor(images)
+    return processor(images=images, return_tensors="pt")["pixel_values"]
+
+
+def check_preprocess_parity(fast: PixelPreprocessor, processor, backend, text_bank,
+                            images: List[Image.Image], tolerance: float) -> Dict[str, Any]:
+    """
+    Zero-shot logit drift between the fast preprocessor and the HF processor
+    (resampling filters differ slightly). Passes if drift <= tolerance.
+    """
+    _, ref_embeds = backend.encode(pixel_values_for(processor, images))
+    _, fast_embeds = backend.encode(fast(images))
+    ref_embeds = ref_embeds.float().cpu()
+    fast_embeds = fast_embeds.float().cpu()
+
+    drift = max(
+        (float((text_bank.logits(group, ref_embeds) - text_bank.logits(group, fast_embeds)).abs().max())
+         for group in text_bank.embeddings),
+        default=0.0
+    )
+    return {"samples": len(images), "max_abs_logit_diff": round(drift, 6), "tolerance": tolerance, "passed": drift <= tolerance}
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from image_pipeline import rgb_array
+
+logger = logging.getLogger("ElephMind-Cache")
+
+# =========================================================================
+# CONTENT-HASH INFERENCE CACHE
+# =========================================================================
+# Re-uploads of the same image (browser refresh, other workstation) get a new
+# IMG_ id but the same pixels. Results are keyed by SHA-256 of the DECODED
+# pixels + the model/prompt version, so a re-encoded file with identical
+# content also hits, and any model or prompt change invalidates everything.
+#
+# Only the model output is cached (domain, specific, heatmap, QC...) plus the
+# pooled image embedding. Per-user fields (similar cases, DICOM patient
+# metadata, timings) are never stored and are recomputed by the caller.
+#
+# Tier 1: in-memory LRU (max_entries).
+# Tier 2: on-disk  <disk_dir>/<key[:2]>/<key>.json (+ .npy embedding),
+#         oldest files pruned beyond max_disk_entries.
+
+
+def image_content_hash(image: Image.Image) -> str:
+    """SHA-256 of the decoded pixels (mode + size + raw bytes)."""
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    # RGB: hash the shared decoded buffer in place (same bytes as tobytes(), no copy)
+    digest.update(np.ascontiguousarray(rgb_array(image)).data if image.mode == "RGB" else image.tobytes())
+    return digest.hexdigest()
+
+
+def cache_key(image: Image.Image, model_version: str) -> str:
+    return hashlib.sha256(f"{model_version}:{image_content_hash(image)}".encode()).hexdigest()
+
+
+class InferenceCache:
+    """Bounded two-tier (memory LRU + disk) cache of model outputs."""
+
+    def __init__(self, max_entries: int = 64, disk_dir: Optional[str] = None, max_disk_entries: int = 5000):
+        self.max_entries = max(1, max_entries)
+        self.max_disk_entries = max_disk_entries
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], Optional[np.ndarray]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.disk_dir:
+            try:
+                self.disk_dir.mkdir(parents=True, exist_ok=True)
+            except OSError as e:
+                logger.warning(f"Inference cache disk tier disabled ({self.disk_dir}): {e}")
+                self.disk_dir = None
+
+    # --- Memory tier ---
+
+    def _remember(self, key: str, value: Tuple[Dict[str, Any], Optional[np.ndarray]]):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # --- Disk tier ---
+
+    def _paths(self, key: str) -> Tuple[Path, Path]:
+        shard = self.disk_dir / key[:2]
+        return shard / f"{key}.json", shard / f"{key}.npy"
+
+    def _read_disk(self, key: str) -> Optional[Tuple[Dict[str, Any], Optional[np.ndarray]]]:
+        result_path, embed_path = self._paths(key)
+        if not result_path.exists():
+            return None
+        try:
+            with open(result_path, "r", encoding="utf-8") as f:
+                result = json.load(f)
+            embedding = np.load(embed_path) if embed_path.exists() else None
+            os.utime(result_path)  # Recency for pruning
+            return result, embedding
+        except (OSError, ValueError) as e:
+            logger.warning(f"Corrupt inference cache entry {key[:12]} dropped: {e}")
+            self._delete_disk(key)
+            return None
+
+    def _write_disk(self, key: str, result: Dict[str, Any], embedding: Optional[np.ndarray]):
+        result_path, embed_path = self._paths(key)
+        try:
+            result_path.parent.mkdir(parents=True, exist_ok=True)
+            # Embedding first, result last: a result file is only visible once complete
+            if embedding is not None:
+                tmp_embed = embed_path.with_name(embed_path.name + f".{os.getpid()}.tmp")
+                with open(tmp_embed, "wb") as f:
+                    np.save(f, embedding)
+                os.replace(tmp_embed, embed_path)
+            tmp_result = result_path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_result, "w", encoding="utf-8") as f:
+                json.dump(result, f)
+            os.replace(tmp_result, result_path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Inference cache disk write failed: {e}")
+            return
+
+        self._disk_writes += 1
+        if self._disk_writes % 100 == 0:
+            self._prune_disk()
+
+    def _delete_disk(self, key: str):
+        for path in self._paths(key):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def _prune_disk(self):
+        """Drop the least recently used entries beyond max_disk_entries."""
+        files = list(self.disk_dir.glob("*/*.json"))
+        excess = len(files) - self.max_disk_entries
+        if excess <= 0:
+            return
+        files.sort(key=lambda p: p.stat().st_mtime)
+        for path in files[:excess]:
+            self._delete_disk(path.stem)
+        logger.info(f"🧹 Inference cache pruned {excess} disk entries")
+
+    # --- Public API ---
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], Optional[np.ndarray]]]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        if self.disk_dir:
+            value = self._read_disk(key)
+            if value is not None:
+                self._remember(key, value)
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, result: Dict[str, Any], embedding: Optional[np.ndarray] = None):
+        self._remember(key, (result, embedding))
+        if self.disk_dir:
+            self._write_disk(key, result, embedding)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "memory_entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,149 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, Callable, List, Optional, Tuple
+
+logger = logging.getLogger("ElephMind-Scheduler")
+
+# =========================================================================
+# DYNAMIC MICRO-BATCHING SCHEDULER
+# =========================================================================
+# Concurrent jobs each used to run a batch-1 vision forward from their own
+# executor thread, all fighting over the same torch intra-op pool.
+# The scheduler sits in front of the vision tower: it collects queued images
+# for up to `window_ms` (or `max_batch` images), runs ONE batched forward on
+# a single dedicated thread, and scatters the results back to the callers.
+#
+# Callers never wait forever: run() gives up after `timeout_s` (its item is
+# cancelled if not picked up yet), and stop() fails whatever is still queued.
+
+_STOP = object()
+
+
+class MicroBatchScheduler:
+    """Coalesces concurrent single-image encodes into batched forwards."""
+
+    def __init__(self, encode_batch: Callable[[List[Any]], List[Any]], window_ms: float = 20.0, max_batch: int = 8,
+                 timeout_s: float = 120.0):
+        self.encode_batch = encode_batch
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.timeout = timeout_s
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self.batches_run = 0
+        self.items_run = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+        self._thread.start()
+        logger.info(f"⏱️ Micro-batching scheduler started (window={self.window * 1000:.0f}ms, max_batch={self.max_batch})")
+
+    def stop(self, timeout: float = 5.0):
+        if not self.running:
+            return
+        with self._lock:
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join(timeout=timeout)
+
+        # Items queued behind _STOP (or not reached before the join timeout) would never resolve
+        dropped = 0
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                continue
+            _, future = entry
+            if future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError("Micro-batching scheduler stopped."))
+            dropped += 1
+        if self._thread.is_alive():
+            self._queue.put(_STOP)  # Still encoding: let it exit after the current batch
+        self._thread = None
+        logger.info(f"Micro-batching scheduler stopped ({self.items_run} images in {self.batches_run} batches, {dropped} dropped)")
+
+    def submit(self, item: Any) -> Future:
+        """Queue one item; the returned future resolves to its encoded result."""
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Micro-batching scheduler stopped.")
+            self._queue.put((item, future))
+        return future
+
+    def run(self, item: Any, timeout: Optional[float] = None) -> Any:
+        """Blocking helper for executor threads: submit and wait (at most `timeout_s` by default)."""
+        future = self.submit(item)
+        try:
+            return future.result(timeout=self.timeout if timeout is None else timeout)
+        except FutureTimeout:
+            future.cancel()  # Dropped from its batch unless already being encoded
+            raise
+
+    def _collect(self, first) -> Tuple[List, bool]:
+        """Gather a batch starting with `first` until the window or size limit."""
+        batch = [first]
+        stop = False
+        deadline = time.monotonic() + self.window
+
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                stop = True
+                break
+            batch.append(entry)
+
+        return batch, stop
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+
+            batch, stop = self._collect(first)
+            # Callers that timed out cancelled their future: skip those items
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            items = [item for item, _ in batch]
+            futures = [future for _, future in batch]
+            if not batch:
+                if stop:
+                    return
+                continue
+
+            try:
+                results = self.encode_batch(items)
+                for future, result in zip(futures, results):
+                    future.set_result(result)
+                self.batches_run += 1
+                self.items_run += len(items)
+                if len(items) > 1:
+                    logger.info(f"⏱️ Batched vision forward: {len(items)} images")
+            except Exception as e:
+                logger.error(f"Batched inference failed: {e}")
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+
+            if stop:
+                return
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import multiprocessing as mp
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("ElephMind-Workers")
+
+# =========================================================================
+# PROCESS-POOL INFERENCE WORKERS
+# =========================================================================
+# Inference used to run in the default asyncio thread pool, inside the
+# uvicorn process: GIL, torch thread oversubscription and Grad-CAM backward
+# passes all competed with request handling.
+#
+# Workers are FORKED from the API process after the model is loaded, so the
+# weights are shared copy-on-write (never written after load). Each worker
+# pins its own torch / OpenCV thread budget, and the pool is recycled after
+# `max_jobs_per_worker` jobs per worker to bound memory fragmentation.
+#
+# ProcessPoolExecutor only forks on the first submit: every generation is
+# forked and initialized up front (one no-op per worker, awaited) from the
+# startup thread, or from a recycle thread for later generations, never on
+# the event loop. /ready only turns 200 once the first generation exists.
+#
+# The deferred explainability stage (Grad-CAM++ heatmaps) gets its OWN pool
+# with a positive nice value, so heatmaps only use CPU that classifications
+# leave idle and never sit in front of them in a queue.
+
+_worker_wrapper = None
+
+
+def lower_thread_priority(niceness: int):
+    """
+    Raise the nice value of the CALLING thread (Linux schedules threads individually).
+    Threads torch spawns for its intra-op pool are NOT covered: they are shared with
+    classifications, so in-process (INFERENCE_WORKERS=0) only the Python-side work of
+    an explanation runs at low priority. A niced worker process covers all of it.
+    """
+    if niceness <= 0:
+        return
+    try:
+        tid = threading.get_native_id()
+        os.setpriority(os.PRIO_PROCESS, tid, os.getpriority(os.PRIO_PROCESS, tid) + niceness)
+    except (AttributeError, OSError) as e:
+        logger.warning(f"Could not lower thread priority: {e}")
+
+
+def _init_worker(wrapper, torch_threads: int, cv2_threads: int, niceness: int = 0):
+    """Runs once in every worker process right after fork."""
+    global _worker_wrapper
+    import torch
+    import cv2
+
+    torch.set_num_threads(torch_threads)
+    cv2.setNumThreads(cv2_threads)
+    if niceness > 0:
+        os.nice(niceness)  # Whole process, torch intra-op threads included
+
+    # The batching thread does not survive fork, and a worker only ever
+    # handles one job at a time: encode directly.
+    wrapper.scheduler = None
+    _worker_wrapper = wrapper
+    logger.info(f"🧵 Inference worker {os.getpid()} ready (torch={torch_threads} threads, cv2={cv2_threads} threads, nice=+{niceness})")
+
+
+def _worker_ready() -> int:
+    """No-op job: forces the worker to be forked and initialized."""
+    return os.getpid()
+
+
+def run_predict(image_bytes: bytes, username: Optional[str] = None, case_id: Optional[str] = None,
+                explain: bool = True) -> Dict[str, Any]:
+    """Entry point executed inside a worker process."""
+    if _worker_wrapper is None:
+        raise RuntimeError("Inference worker not initialized.")
+    return _worker_wrapper.predict(image_bytes, username=username, case_id=case_id, explain=explain)
+
+
+def run_explain(image_bytes: bytes, result: Dict[str, Any], username: Optional[str] = None,
+                case_id: Optional[str] = None) -> Dict[str, Any]:
+    """Deferred explainability stage executed inside a (low priority) worker process."""
+    if _worker_wrapper is None:
+        raise RuntimeError("Inference worker not initialized.")
+    return _worker_wrapper.explain(image_bytes, result, username=username, case_id=case_id)
+
+
+class InferenceWorkerPool:
+    """Pool of forked inference processes sharing the loaded model weights."""
+
+    def __init__(self, wrapper, workers: int, torch_threads: int = 0, cv2_threads: int = 1, max_jobs_per_worker: int = 200,
+                 niceness: int = 0, name: str = "Inference"):
+        self.wrapper = wrapper
+        self.workers = max(1, workers)
+        self.torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // self.workers)
+        self.cv2_threads = max(1, cv2_threads)
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.niceness = max(0, niceness)
+        self.name = name
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._jobs_in_generation = 0
+        self._recycling = False
+        self._lock = threading.Lock()
+        self.generation = 0
+
+    @staticmethod
+    def supported() -> bool:
+        """Copy-on-write sharing requires the 'fork' start method (Linux)."""
+        return "fork" in mp.get_all_start_methods()
+
+    def _spawn(self) -> ProcessPoolExecutor:
+        """Fork and initialize a full generation of workers before it takes any job."""
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=mp.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(self.wrapper, self.torch_threads, self.cv2_threads, self.niceness),
+        )
+        try:
+            for future in [executor.submit(_worker_ready) for _ in range(self.workers)]:
+                future.result()
+        except Exception:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        return executor
+
+    def start(self):
+        self._executor = self._spawn()
+        self.generation = 1
+        logger.info(
+            f"🏭 {self.name} pool started: {self.workers} workers x {self.torch_threads} torch threads "
+            f"(nice +{self.niceness}, recycled every {self.max_jobs_per_worker} jobs/worker)"
+        )
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _maybe_recycle(self):
+        """Start warming a fresh generation once this one has served its quota (called under the lock)."""
+        if self.max_jobs_per_worker <= 0 or self._recycling:
+            return
+        if self._jobs_in_generation < self.max_jobs_per_worker * self.workers:
+            return
+        self._recycling = True
+        threading.Thread(target=self._recycle, name=f"{self.name.lower()}-recycle", daemon=True).start()
+
+    def _recycle(self):
+        """Swap in a fresh, already forked generation; in-flight jobs finish on the old one."""
+        try:
+            fresh = self._spawn()
+        except Exception as e:
+            logger.error(f"❌ {self.name} pool recycle failed, keeping generation {self.generation}: {e}")
+            with self._lock:
+                self._recycling = False
+            return
+
+        with self._lock:
+            old, self._recycling = self._executor, False
+            if old is None:  # Shut down while the new generation was warming up
+                fresh.shutdown(wait=False)
+                return
+            self._executor = fresh
+            self._jobs_in_generation = 0
+            self.generation += 1
+        old.shutdown(wait=False)
+        logger.info(f"♻️ {self.name} pool recycled (generation {self.generation})")
+
+    async def _submit(self, fn, *args) -> Dict[str, Any]:
+        """Submit one job to the pool and await its result."""
+        with self._lock:
+            if self._executor is None:
+                raise RuntimeError(f"{self.name} pool not started.")
+            self._maybe_recycle()
+            self._jobs_in_generation += 1
+            future = self._executor.submit(fn, *args)
+        return await asyncio.wrap_future(future)
+
+    async def predict(self, image_bytes: bytes, username: Optional[str] = None, case_id: Optional[str] = None,
+                      explain: bool = True) -> Dict[str, Any]:
+        return await self._submit(run_predict, image_bytes, username, case_id, explain)
+
+    async def explain(self, image_bytes: bytes, result: Dict[str, Any], username: Optional[str] = None,
+                      case_id: Optional[str] = None) -> Dict[str, Any]:
+        return await self._submit(run_explain, image_bytes, result, username, case_id)
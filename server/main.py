@@ -33,7 +33,6 @@ import cv2
 import numpy as np
 from pytorch_grad_cam import GradCAMPlusPlus
 from pytorch_grad_cam.utils.image import show_cam_on_image
-from localization import localize_result
 import torch
 import torch.nn as nn
 # Local modules
@@ -42,11 +41,26 @@ import storage_manager  # NEW: Physical storage layout
 from database import JobStatus
 from storage import get_storage_provider
 import encryption
-import database
+from prompt_bank import TextEmbeddingBank, DOMAINS_GROUP, DEFAULT_TEXT_BANK_FILENAME, group_key, drop_text_tower, load_vision_only
+from image_context import ImageContext, build_image_context, build_image_contexts, context_from_embeddings
+from inference_scheduler import MicroBatchScheduler
+from inference_workers import InferenceWorkerPool, lower_thread_priority
+from vision_backends import create_vision_backend, load_sample_folder, DEFAULT_ONNX_FILENAME
+from model_quantization import quantize_int8
+from warmup import run_warmup
+from inference_cache import InferenceCache, cache_key
+from embedding_store import EmbeddingStoreRegistry
+from similar_cases import SimilarCaseIndex
+from prior_studies import find_prior_studies
+from vector_codecs import make_codec
+from rescoring import calibrated_confidence, penalty_applies, rescore_jobs
+from explainability import ANATOMICAL_CONTEXTS, DEFAULT_ANATOMICAL_CONTEXT, display_rgb, explainability_prompts
+from image_pipeline import PixelPreprocessor, attach_rgb, check_preprocess_parity, rgb_array
 # algorithms imported directly above
 
 import math
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from PIL import Image
 import io
@@ -97,13 +111,18 @@ def detect_blur(image: np.ndarray) -> float:
     # Normalize to 0-1 (empirical thresholds for medical images)
     return min(1.0, laplacian_var / 500.0)
 
-def assess_image_quality(image: np.ndarray) -> Dict[str, Any]:
-    """Assess image quality metrics."""
+def assess_image_quality(image: np.ndarray, original_size: Optional[Tuple[int, int]] = None,
+                         sharpness: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Assess image quality metrics. If decoded at reduced resolution: original_size (w, h) is the
+    upload size and sharpness the full-resolution one (Laplacian variance grows as the image shrinks).
+    """
     score = 0
     metrics = []
     
     # Blur detection
-    sharpness = detect_blur(image)
+    if sharpness is None:
+        sharpness = detect_blur(image)
     metrics.append({"metric": "Netteté", "value": int(sharpness * 100)})
     
     if sharpness > 0.6: score += 40
@@ -119,13 +138,16 @@ def assess_image_quality(image: np.ndarray) -> Dict[str, Any]:
     metrics.append({"metric": "Contraste", "value": int(min(100, contrast * 2))})
     if contrast > 40: score += 30
     
-    # Resolution check
-    h, w = image.shape[:2]
+    # Resolution check (of the upload, not of the reduced decode)
+    w, h = original_size or (image.shape[1], image.shape[0])
     metrics.append({"metric": "Résolution", "value": int(min(100, (h*w)/(1024*1024)*100))})
     if h*w > 512*512: score += 30
     
     return {
         "quality_score": min(100, score),
+        "overall_score": min(100, score) / 100.0,  # 0-1, what the QC gate and confidence calibration read
+        "sharpness": sharpness,
+        "contrast": min(1.0, contrast / 50.0),
         "metrics": metrics
     }
 
@@ -194,78 +216,27 @@ def generate_clinical_report(analysis_result: Dict[str, Any], patient_info: Opti
         
     return report
 
-# 5. SIMILAR CASE DETECTION (Vector DB Mockup)
-@dataclass
-class CaseRecord:
-    id: str
-    embedding: np.ndarray
-    diagnosis: str
-    domain: str
-    probability: float
-    username: str  # Added for isolation
-
-class SimilarCaseDatabase:
-    def __init__(self):
-        self.cases: List[CaseRecord] = []
-        
-    def add_case(self, case_id: str, embedding: np.ndarray, diagnosis: str, domain: str, probability: float, username: str):
-        self.cases.append(CaseRecord(case_id, embedding, diagnosis, domain, probability, username))
-        # Keep manageable size
-        if len(self.cases) > 1000:
-            self.cases.pop(0)
-            
-    def find_similar(self, query_embedding: np.ndarray, username: str, top_k: int = 3, same_domain_only: bool = True, query_domain: str = None) -> List[Dict]:
-        if not self.cases:
-            return []
-            
-        scores = []
-        for case in self.cases:
-            # STRICT ISOLATION: Only compare with own cases
-            if case.username != username:
-                continue
-
-            if same_domain_only and query_domain and case.domain != query_domain:
-                continue
-                
-            # Cosine similarity
-            dot_product = np.dot(query_embedding, case.embedding)
-            norm_a = np.linalg.norm(query_embedding)
-            norm_b = np.linalg.norm(case.embedding)
-            similarity = dot_product / (norm_a * norm_b) if norm_a > 0 and norm_b > 0 else 0
-            
-            scores.append((similarity, case))
-            
-        scores.sort(key=lambda x: x[0], reverse=True)
-        return [
-            {
-                "case_id": c.id, 
-                "diagnosis": c.diagnosis, 
-                "similarity": round(float(s * 100), 1)
-            } 
-            for s, c in scores[:top_k]
-        ]
-
-# Global instance
-similar_case_db = SimilarCaseDatabase()
-
-def find_similar_cases(embedding: np.ndarray, domain: str, username: str, top_k: int = 5) -> Dict[str, Any]:
+# 5. SIMILAR CASE DETECTION (per-user/domain vector index, see similar_cases.py)
+def find_similar_cases(embedding: np.ndarray, domain: str, username: str, top_k: int = 5,
+                       exclude_case_id: Optional[str] = None) -> Dict[str, Any]:
     """Find similar cases based on embedding, strictly isolated by user."""
     similar = similar_case_db.find_similar(
         query_embedding=embedding,
         username=username,
         top_k=top_k,
         same_domain_only=True,
-        query_domain=domain
+        query_domain=domain,
+        exclude_case_id=exclude_case_id  # Re-analysis of the same image is not "similar"
     )
     
     return {
         "similar_cases": similar,
-        "cases_searched": len(similar_case_db.cases),
+        "cases_searched": similar_case_db.partition_size(username, domain),
         "message": f"Trouvé {len(similar)} cas similaires" if similar else "Aucun cas similaire trouvé"
     }
 
 def store_case_for_similarity(case_id: str, embedding: np.ndarray, diagnosis: str, domain: str, probability: float, username: str):
-    """Store a case for fiture similarity searches, isolated by user."""
+    """Store a case for future similarity searches, isolated by user (durable append when persisted)."""
     similar_case_db.add_case(
         case_id=case_id,
         embedding=embedding,
@@ -512,6 +483,78 @@ CORS_ORIGINS = [origin.strip() for origin in CORS_ORIGINS_STR.split(",")]
 MAX_CONCURRENT_USERS = int(os.getenv("MAX_CONCURRENT_USERS", "200"))
 concurrency_semaphore = asyncio.Semaphore(MAX_CONCURRENT_USERS)
 
+# Inference Micro-Batching (vision forward coalescing across concurrent jobs)
+INFERENCE_BATCHING = os.getenv("INFERENCE_BATCHING", "true").lower() == "true"
+INFERENCE_BATCH_WINDOW_MS = float(os.getenv("INFERENCE_BATCH_WINDOW_MS", "20"))
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "8"))
+
+# Inference Worker Processes (0 = run in the API process thread pool)
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+INFERENCE_WORKER_THREADS = int(os.getenv("INFERENCE_WORKER_THREADS", "0"))  # 0 = cpu_count / workers
+INFERENCE_WORKER_CV2_THREADS = int(os.getenv("INFERENCE_WORKER_CV2_THREADS", "1"))
+INFERENCE_WORKER_MAX_JOBS = int(os.getenv("INFERENCE_WORKER_MAX_JOBS", "200"))
+
+# Vision Backend: torch (reference) | onnx (ONNX Runtime CPU, see export_onnx.py)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch").lower()
+ONNX_VISION_PATH = os.getenv("ONNX_VISION_PATH")  # Default: <model_dir>/onnx/vision_encoder.onnx
+ONNX_PARITY_TOLERANCE = float(os.getenv("ONNX_PARITY_TOLERANCE", "0.05"))
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))
+
+# Graph Mode (opt-in): off | trace (frozen TorchScript) | compile (torch.compile)
+INFERENCE_COMPILE = os.getenv("INFERENCE_COMPILE", "off").lower()
+
+# Startup Warmup: synthetic images through every domain path before /ready
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() == "true"
+MODEL_WARMUP_ROUNDS = int(os.getenv("MODEL_WARMUP_ROUNDS", "2"))
+
+# Vision-Only Mode: load prompt vectors from an offline text bank file and free the text tower
+INFERENCE_VISION_ONLY = os.getenv("INFERENCE_VISION_ONLY", "false").lower() == "true"
+TEXT_BANK_PATH = os.getenv("TEXT_BANK_PATH")  # Default: <model_dir>/text_bank.pt (export_text_bank.py)
+
+# Quantized Inference (opt-in): "int8" = dynamic int8 quantization of Linear layers
+INFERENCE_QUANTIZE = os.getenv("INFERENCE_QUANTIZE", "").lower() or None
+
+# Fast Preprocessing (opt-in): vectorized resize + normalize into a preallocated tensor (replaces the HF
+# image processor on the request path only if zero-shot logits on REAL sample images stay within the tolerance)
+FAST_PREPROCESS = os.getenv("FAST_PREPROCESS", "false").lower() == "true"
+FAST_PREPROCESS_SAMPLES = os.getenv("FAST_PREPROCESS_SAMPLES")  # Folder of representative PNG/JPEG uploads
+FAST_PREPROCESS_TOLERANCE = float(os.getenv("FAST_PREPROCESS_TOLERANCE", str(ONNX_PARITY_TOLERANCE)))
+
+# Reduced-Resolution Decode: JPEG/PNG decoded at 1/2, 1/4 or 1/8 while the long side stays >= this
+# (largest consumer = visuals display cap; processor/CAM grids need less). QC sharpness (Laplacian
+# variance, scale-dependent) is still measured on a full-resolution grayscale decode. 0 = full resolution
+DECODE_MIN_LONG_SIDE = int(os.getenv("DECODE_MIN_LONG_SIDE", "1024"))
+
+# Inference Result Cache: SHA-256(decoded pixels) + model/prompt version -> model output
+INFERENCE_CACHE = os.getenv("INFERENCE_CACHE", "true").lower() == "true"
+INFERENCE_CACHE_MAX_ENTRIES = int(os.getenv("INFERENCE_CACHE_MAX_ENTRIES", "64"))  # In-memory LRU
+INFERENCE_CACHE_DISK_ENTRIES = int(os.getenv("INFERENCE_CACHE_DISK_ENTRIES", "5000"))
+INFERENCE_CACHE_DIR = os.getenv("INFERENCE_CACHE_DIR") or str(storage_manager.BASE_STORAGE_DIR / "cache" / "inference")
+
+# Embedding Store: per-user memory-mapped float16 vision outputs (pooled + patch states) by image_id
+EMBEDDING_STORE = os.getenv("EMBEDDING_STORE", "true").lower() == "true"
+EMBEDDING_STORE_MAX_MB = int(os.getenv("EMBEDDING_STORE_MAX_MB", "2048"))            # Per user, 0 = unbounded
+EMBEDDING_STORE_MAX_AGE_DAYS = float(os.getenv("EMBEDDING_STORE_MAX_AGE_DAYS", "0"))  # Patch states, 0 = size bound only
+
+# Similar Cases: newest past cases per (user, domain) partition
+SIMILAR_CASES_PER_PARTITION = int(os.getenv("SIMILAR_CASES_PER_PARTITION", "1000"))
+SIMILAR_CASES_PERSIST = os.getenv("SIMILAR_CASES_PERSIST", "true").lower() == "true"  # Memory-mapped files per user/domain
+SIMILAR_CASES_SEARCH = os.getenv("SIMILAR_CASES_SEARCH", "exact").lower()  # "exact" | "ivf" (approximate, large partitions)
+SIMILAR_CASES_IVF_NPROBE = int(os.getenv("SIMILAR_CASES_IVF_NPROBE", "8"))
+SIMILAR_CASES_IVF_MIN_CASES = int(os.getenv("SIMILAR_CASES_IVF_MIN_CASES", "4096"))
+SIMILAR_CASES_CODEC = os.getenv("SIMILAR_CASES_CODEC", "float32").lower()  # float32 | float16 | int8 | pq
+SIMILAR_CASES_PQ_SUBVECTORS = int(os.getenv("SIMILAR_CASES_PQ_SUBVECTORS", "0"))  # 0 = dim / 4 (16x smaller than float32)
+SIMILAR_CASES_PQ_TRAIN_CASES = int(os.getenv("SIMILAR_CASES_PQ_TRAIN_CASES", "4096"))
+
+# Deferred Explainability: jobs are 'classified' first, heatmaps come from a low-priority queue
+EXPLAIN_DEFERRED = os.getenv("EXPLAIN_DEFERRED", "true").lower() == "true"
+EXPLAIN_WORKERS = int(os.getenv("EXPLAIN_WORKERS", "1"))
+EXPLAIN_NICENESS = int(os.getenv("EXPLAIN_NICENESS", "10"))
+
+# Analysis Visuals: heatmap/original stored once as compressed files, results only carry URLs
+VISUAL_FORMAT = os.getenv("VISUAL_FORMAT", "webp").lower()  # webp | jpeg
+VISUAL_QUALITY = int(os.getenv("VISUAL_QUALITY", "80"))
+
 # =========================================================================
 # MODEL PATH CONFIGURATION (HuggingFace Hub or Local)
 # =========================================================================
@@ -727,6 +770,7 @@ DOMAIN_TRANSLATIONS_FR = {
 class JobStatus(str, Enum):
     PENDING = "pending"
     PROCESSING = "processing"
+    CLASSIFIED = "classified"  # Result available, heatmap still queued
     COMPLETED = "completed"
     FAILED = "failed"
 
@@ -775,34 +819,37 @@ class FeedbackModel(BaseModel):
     rating: int
     comment: str
 
+class RescoreRequest(BaseModel):
+    username: Optional[str] = None  # None = every user
+    limit: Optional[int] = None
+
 # =========================================================================
 # GLOBAL STATE
 # =========================================================================
 jobs: Dict[str, Job] = {}  # REMOVED: Now using SQLite persistence
 storage_provider = get_storage_provider(os.getenv("STORAGE_MODE", "LOCAL"))
 
-# Initialize Database
-database.init_db()
-
 # --- SEED DEFAULT USER ---
-# Ensure admin user exists for immediate login
-try:
-    if not database.get_user_by_username("admin"):
-        logging.info("👤 Creating default admin user...")
-        # Hash "secret"
-        admin_pw = bcrypt.hashpw(b"secret", bcrypt.gensalt()).decode('utf-8')
-        security_ans = bcrypt.hashpw(b"admin", bcrypt.gensalt()).decode('utf-8') # Answer: admin
-        
-        database.create_user({
-            "username": "admin",
-            "hashed_password": admin_pw,
-            "email": "admin@elephmind.com",
-            "security_question": "Who is the admin?",
-            "security_answer": security_ans
-        })
-        logging.info("✅ Default Admin Created: admin / secret")
-except Exception as e:
-    logging.error(f"Failed to seed admin user: {e}")
+# Ensure admin user exists for immediate login.
+# Called from the startup task (NOT at import time: bcrypt hashing is slow).
+def seed_default_admin():
+    try:
+        if not database.get_user_by_username("admin"):
+            logging.info("👤 Creating default admin user...")
+            # Hash "secret"
+            admin_pw = bcrypt.hashpw(b"secret", bcrypt.gensalt()).decode('utf-8')
+            security_ans = bcrypt.hashpw(b"admin", bcrypt.gensalt()).decode('utf-8') # Answer: admin
+            
+            database.create_user({
+                "username": "admin",
+                "hashed_password": admin_pw,
+                "email": "admin@elephmind.com",
+                "security_question": "Who is the admin?",
+                "security_answer": security_ans
+            })
+            logging.info("✅ Default Admin Created: admin / secret")
+    except Exception as e:
+        logging.error(f"Failed to seed admin user: {e}")
 
 # =========================================================================
 # AUTHENTICATION HELPERS
@@ -865,54 +912,461 @@ async def get_current_active_user(current_user: UserInDB = Depends(get_current_u
 # =========================================================================
 # (Refactored to separate module for medical grade validation)
 
+# =========================================================================
+# IMAGE DECODING & LOCALIZATION
+# =========================================================================
+def localize_analysis_result(result_json: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Translate the analysis result to French using Canonical IDs.
+    This allows the Model to run in English and the UI to display in French.
+    """
+    localized = result_json.copy()
+
+    # 1. Translate Domain
+    domain_key = localized.get('domain', {}).get('label')
+    if domain_key in DOMAIN_TRANSLATIONS_FR:
+        localized['domain']['label_fr'] = DOMAIN_TRANSLATIONS_FR[domain_key]
+        localized['domain']['label'] = DOMAIN_TRANSLATIONS_FR[domain_key] # Override for simple UI
+
+    # 2. Translate Specific Results
+    if 'specific' in localized:
+        new_specific = []
+        for item in localized['specific']:
+            label_id = item.get('label_id')
+            translation = LABEL_TRANSLATIONS_FR.get(label_id)
+
+            if translation:
+                new_item = item.copy()
+                new_item['label'] = translation['short'] # Use Short Title for UI
+                new_item['description'] = translation['long'] # Use Long Description
+                new_item['severity'] = translation.get('severity', 'medium')
+                new_specific.append(new_item)
+            else:
+                # Fallback if ID missing (should not happen in strict mode)
+                new_specific.append(item)
+
+        localized['specific'] = new_specific
+
+    # 3. Set Diagnosis from top translated specific result
+    if 'specific' in localized and len(localized['specific']) > 0:
+        localized['diagnosis'] = localized['specific'][0].get('label', 'Inconnu')
+    elif 'diagnosis_id' in localized:
+        # Fallback: Translate diagnosis_id if present
+        translation = LABEL_TRANSLATIONS_FR.get(localized['diagnosis_id'])
+        if translation:
+            localized['diagnosis'] = translation['short']
+        else:
+            localized['diagnosis'] = 'Diagnostic Inconnu'
+
+    # 4. Handle QC failure case (already localized manually in rejection_result)
+    if 'diagnosis' in localized and "Analyse Refusée" in localized['diagnosis']:
+         pass # Already localized string
+
+    return localized
+
+def process_dicom(file_bytes: bytes) -> Tuple[Image.Image, Dict[str, Any]]:
+    """Convert DICOM bytes to PIL Image with tags."""
+    import pydicom
+    ds = pydicom.dcmread(io.BytesIO(file_bytes))
+    img = ds.pixel_array.astype(np.float32)
+
+    # Extract Metadata
+    metadata = {
+        "patient_id": str(ds.get("PatientID", "N/A")),
+        "patient_name": str(ds.get("PatientName", "N/A")),
+        "birth_date": str(ds.get("PatientBirthDate", "")),
+        "study_date": str(ds.get("StudyDate", "")),
+        "modality": str(ds.get("Modality", "UNKNOWN"))
+    }
+
+    if hasattr(ds, 'PhotometricInterpretation') and ds.PhotometricInterpretation == "MONOCHROME1":
+        img = img.max() - img
+
+    # Lung Window: WL=-600, WW=1500
+    wl, ww = -600, 1500
+    min_val, max_val = wl - ww/2, wl + ww/2
+    img = np.clip(img, min_val, max_val)
+    img = (img - min_val) / (max_val - min_val)
+    img = (img * 255).astype(np.uint8)
+
+    return Image.fromarray(img).convert("RGB"), metadata
+
+REDUCED_DECODE_FLAGS = {8: cv2.IMREAD_REDUCED_COLOR_8, 4: cv2.IMREAD_REDUCED_COLOR_4, 2: cv2.IMREAD_REDUCED_COLOR_2}
+
+def image_dimensions(image_bytes: bytes) -> Optional[Tuple[int, int]]:
+    """(width, height) read from the PNG/JPEG header without decoding. None if unknown."""
+    if image_bytes.startswith(b'\x89PNG\r\n\x1a\n') and len(image_bytes) >= 24:
+        # IHDR is always the first chunk
+        return int.from_bytes(image_bytes[16:20], 'big'), int.from_bytes(image_bytes[20:24], 'big')
+
+    if image_bytes.startswith(b'\xff\xd8'):
+        i, n = 2, len(image_bytes)
+        while i + 9 < n:
+            if image_bytes[i] != 0xFF:
+                i += 1
+                continue
+            marker = image_bytes[i + 1]
+            if marker == 0xFF or marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                i += 1 if marker == 0xFF else 2  # Fill byte / standalone markers
+                continue
+            # SOFn (not DHT/JPG/DAC): length(2) precision(1) height(2) width(2)
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                return int.from_bytes(image_bytes[i + 7:i + 9], 'big'), int.from_bytes(image_bytes[i + 5:i + 7], 'big')
+            i += 2 + int.from_bytes(image_bytes[i + 2:i + 4], 'big')
+    return None
+
+def decode_reduction(dimensions: Optional[Tuple[int, int]]) -> int:
+    """Largest 1/2, 1/4, 1/8 decode factor keeping the long side >= DECODE_MIN_LONG_SIDE (1 = full)."""
+    if not dimensions or DECODE_MIN_LONG_SIDE <= 0:
+        return 1
+    for factor in sorted(REDUCED_DECODE_FLAGS, reverse=True):
+        if max(dimensions) // factor >= DECODE_MIN_LONG_SIDE:
+            return factor
+    return 1
+
+def oriented_size(dimensions: Optional[Tuple[int, int]], decoded_size: Tuple[int, int], factor: int) -> Tuple[int, int]:
+    """
+    Upload size (w, h) in the orientation of the decoded image. The JPEG header is
+    pre-EXIF-rotation while cv2.imdecode applies the EXIF orientation (90/270 swap w/h).
+    """
+    if not dimensions:
+        return decoded_size
+    expected = (-(-dimensions[0] // factor), -(-dimensions[1] // factor))  # Reduced decode rounds up
+    if decoded_size == expected:
+        return dimensions
+    if decoded_size == expected[::-1]:
+        return dimensions[1], dimensions[0]
+    return decoded_size[0] * factor, decoded_size[1] * factor
+
+def process_standard_image(image_bytes: bytes, full_resolution: bool = False) -> Image.Image:
+    """Process standard images (PNG/JPG) - SIMPLIFIED like Colab.
+    Just load the image as RGB without aggressive preprocessing.
+    Large uploads are decoded at reduced resolution (JPEG: DCT scaling, nothing
+    above the needed size is ever decoded); image.info["original_size"] keeps
+    the upload size for the stages that report in original pixels (QC, CTR)."""
+    dimensions = image_dimensions(image_bytes)
+    factor = 1 if full_resolution else decode_reduction(dimensions)
+
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    img_cv = cv2.imdecode(nparr, REDUCED_DECODE_FLAGS.get(factor, cv2.IMREAD_COLOR))
+
+    if img_cv is None:
+        raise ValueError("Could not decode image")
+
+    # Convert BGR to RGB (OpenCV uses BGR)
+    img_rgb = cv2.cvtColor(img_cv, cv2.COLOR_BGR2RGB)
+
+    image = attach_rgb(Image.fromarray(img_rgb), img_rgb)  # Every later stage reads img_rgb
+    image.info["original_size"] = oriented_size(dimensions, image.size, factor)
+    if factor > 1:
+        image.info["source_bytes"] = image_bytes  # QC sharpness, decoded only if the model runs
+        logger.info(f"⚡ Reduced decode 1/{factor}: {dimensions[0]}x{dimensions[1]} -> {image.size[0]}x{image.size[1]}")
+    return image
+
+def full_resolution_sharpness(image: Image.Image) -> Optional[float]:
+    """Blur score of the full-resolution upload behind a reduced decode (None if decoded at full size)."""
+    image_bytes = image.info.get("source_bytes")
+    if image_bytes is None:
+        return None
+    gray = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+    return detect_blur(gray) if gray is not None else None
+
+def decode_image(image_bytes: bytes) -> Tuple[Image.Image, Optional[Dict[str, Any]]]:
+    """Decode an upload (PNG/JPEG/DICOM) to RGB. Returns (image, dicom_metadata)."""
+    # Detect image format
+    header = image_bytes[:32]
+    is_png = header.startswith(b'\x89PNG\r\n\x1a\n')
+    is_jpeg = header.startswith(b'\xff\xd8\xff')
+
+    image = None
+    dicom_metadata = None
+
+    if is_png or is_jpeg:
+        try:
+            image = process_standard_image(image_bytes)
+            logger.info(f"Processed as {'PNG' if is_png else 'JPEG'}")
+        except Exception as e:
+            raise ValueError(f"Corrupt Image File: {str(e)}")
+
+    if image is None:
+        try:
+            image, dicom_metadata = process_dicom(image_bytes)
+            logger.info("Processed as DICOM")
+        except Exception:
+            try:
+                image = process_standard_image(image_bytes)
+            except Exception as e:
+                raise ValueError(f"Unknown image format: {str(e)}")
+
+    if "rgb" not in image.info:
+        attach_rgb(image, np.asarray(image))  # DICOM: the one RGB conversion, shared from here on
+    return image, dicom_metadata
+
+# Per-request / per-user result fields: never cached
+PER_REQUEST_FIELDS = ("cache_hit", "patient_metadata", "similar_cases", "processing_time", "explanation_time",
+                      "heatmap_url", "original_image_url")
+
+# Stored visual name -> result URL field (served by /jobs/{id}/<name>)
+VISUAL_URL_FIELDS = {"heatmap": "heatmap_url", "original": "original_image_url"}
+
+def specific_label_en(domain_key: str, label_id: str) -> str:
+    """English label of a finding (results are localized, Grad-CAM++ targets the English prompt)."""
+    domain_config = MEDICAL_DOMAINS[domain_key]
+    items = domain_config['stage_2_diagnosis']['labels'] if 'stage_1_triage' in domain_config else domain_config['specific_labels']
+    return next((item['label_en'] for item in items if item['id'] == label_id), label_id)
+
+def encode_visual(rgb: np.ndarray) -> Tuple[bytes, str]:
+    """Compress an RGB uint8 visual (VISUAL_FORMAT, JPEG fallback if this OpenCV build lacks WebP)."""
+    bgr = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+    if VISUAL_FORMAT == "webp":
+        ok, buffer = cv2.imencode('.webp', bgr, [cv2.IMWRITE_WEBP_QUALITY, VISUAL_QUALITY])
+        if ok:
+            return buffer.tobytes(), "webp"
+    ok, buffer = cv2.imencode('.jpg', bgr, [cv2.IMWRITE_JPEG_QUALITY, VISUAL_QUALITY])
+    if not ok:
+        raise ValueError("Visual encoding failed")
+    return buffer.tobytes(), "jpeg"
+
+def attach_visual_urls(job_id: str, result: Dict[str, Any]) -> Dict[str, Any]:
+    """Per-job URLs of the stored visuals (the model result only knows the image they belong to)."""
+    for name in (result.get('visuals') or {}).get('names', []):
+        result[VISUAL_URL_FIELDS[name]] = f"/jobs/{job_id}/{name}"
+    return result
+
+def explanation_fields(anatomical_context: str, stage: str, reliability: float = 0,
+                       visuals: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Result fields owned by the explainability stage (stage 'classified' = heatmap still queued)."""
+    return {
+        "visuals": visuals,  # {"key", "image_id", "format", "names"} of the stored files, None if no heatmap
+        "explainability": {
+            "method": "Grad-CAM++ x MedSegCLIP (Proxy)",
+            "anatomical_context": anatomical_context,
+            "reliability": reliability
+        },
+        "stage": stage
+    }
+
 # =========================================================================
 # MODEL WRAPPER
 # =========================================================================
 class MedSigClipWrapper:
     """Wrapper for the SigLIP model with medical domain inference."""
     
-    def __init__(self, model_path: str):
+    def __init__(self, model_path: str, quantize: Optional[str] = INFERENCE_QUANTIZE, warmup: bool = MODEL_WARMUP):
         self.model_path = model_path
+        self.quantize = quantize
+        self.warmup = warmup
+        self.warmup_report: Dict[str, Any] = {}
         self.processor = None
+        self.pixel_processor = None  # PixelPreprocessor (fast path) or self.processor
         self.model = None
+        self.text_bank: Optional[TextEmbeddingBank] = None
+        self.scheduler: Optional[MicroBatchScheduler] = None
+        self.vision_backend = None
+        self.result_cache: Optional[InferenceCache] = None
+        self.embedding_store: Optional[EmbeddingStoreRegistry] = None
         self.loaded = False
         self.load_error = None
+        # Readiness: pending -> downloading -> loading_weights -> warming_up -> ready | failed
+        self.load_state = "pending"
+        self.load_state_since = time.time()
+
+    def set_load_state(self, state: str):
+        """Record startup progress (reported by /ready)."""
+        self.load_state = state
+        self.load_state_since = time.time()
+        logger.info(f"🚦 Model state: {state}")
 
     def load(self):
         """Load the SigLIP model from the specified directory."""
         logger.info(f"Initiating model load from: {self.model_path}")
         
-        if not os.path.exists(self.model_path):
+        if not self.model_path or not os.path.exists(self.model_path):
             self.load_error = f"Model directory not found: {self.model_path}"
             logger.critical(self.load_error)
+            self.set_load_state("failed")
             return
 
         try:
             from transformers import AutoProcessor, AutoModel
             import torch
             
+            self.set_load_state("loading_weights")
             self.processor = AutoProcessor.from_pretrained(self.model_path, local_files_only=True)
-            self.model = AutoModel.from_pretrained(self.model_path, local_files_only=True)
+            text_bank_path = TEXT_BANK_PATH or os.path.join(self.model_path, DEFAULT_TEXT_BANK_FILENAME)
+            # Vision-only mode with an exported bank: the text tower is never loaded (peak RSS and load time)
+            self.model = None
+            if INFERENCE_VISION_ONLY and os.path.exists(text_bank_path):
+                self.model = load_vision_only(self.model_path)
+                if self.model is None:
+                    logger.warning("Vision-only load unsupported for this checkpoint: loading the full model")
+                else:
+                    logger.info("✂️ Vision-only mode: vision tower + logit parameters loaded (no text tower)")
+            if self.model is None:
+                self.model = AutoModel.from_pretrained(self.model_path, local_files_only=True)
             self.model.eval()
+            self.model.requires_grad_(False)  # Inference only: Grad-CAM tracks its own activations
             
             # Calibrate logit scale for better probability distribution
             if hasattr(self.model, 'logit_scale'):
                 with torch.no_grad():
                     self.model.logit_scale.data.fill_(3.80666)  # ln(45)
             
+            # Opt-in INT8 dynamic quantization (before anything caches weights)
+            if self.quantize == "int8":
+                self.model = quantize_int8(self.model)
+            elif self.quantize:
+                logger.warning(f"Unknown INFERENCE_QUANTIZE '{self.quantize}', running fp32")
+            
+            # Encode every MEDICAL_DOMAINS + explainability prompt once (text tower off the request path)
+            self.text_bank = TextEmbeddingBank(self.model, self.processor)
+            if INFERENCE_VISION_ONLY and os.path.exists(text_bank_path):
+                self.text_bank.load_file(text_bank_path)
+            elif INFERENCE_VISION_ONLY:
+                logger.warning(f"No text bank file at {text_bank_path}: encoding at startup (run export_text_bank.py)")
+            self.text_bank.build(MEDICAL_DOMAINS, extra_prompts=explainability_prompts())
+            
+            # Vision-only mode fallback (full checkpoint loaded): the text tower is dead weight now
+            if INFERENCE_VISION_ONLY and self.text_bank.text_tower_loaded:
+                released = drop_text_tower(self.model)
+                logger.info(f"✂️ Vision-only mode: text tower released ({released / 1e6:.0f}M parameters)")
+            
+            # Vision backend (ONNX must pass a logit parity check, else torch is kept)
+            self.set_load_state("warming_up")
+            self.vision_backend = create_vision_backend(
+                INFERENCE_BACKEND,
+                self.model,
+                processor=self.processor,
+                text_bank=self.text_bank,
+                onnx_path=ONNX_VISION_PATH or os.path.join(self.model_path, DEFAULT_ONNX_FILENAME),
+                parity_tolerance=ONNX_PARITY_TOLERANCE,
+                threads=ONNX_THREADS,
+                compile_mode=INFERENCE_COMPILE,
+                max_batch=INFERENCE_MAX_BATCH if INFERENCE_BATCHING else 1
+            )
+            self.pixel_processor = self._select_pixel_processor()
+            
             self.loaded = True
-            logger.info("✅ MedSigClip Model Loaded Successfully (448x448 SigLIP architecture)")
+            logger.info(f"✅ MedSigClip Model Loaded Successfully (448x448 SigLIP architecture, {self.quantize or 'fp32'})")
+            
+            # Pay cold-start costs now, not on the first patient
+            if self.warmup:
+                self.warmup_report = run_warmup(self, MEDICAL_DOMAINS, rounds=MODEL_WARMUP_ROUNDS)
+            
+            # Enabled after warmup so synthetic images are never cached (nor timed as hits)
+            if INFERENCE_CACHE:
+                self.result_cache = InferenceCache(
+                    max_entries=INFERENCE_CACHE_MAX_ENTRIES,
+                    disk_dir=INFERENCE_CACHE_DIR,
+                    max_disk_entries=INFERENCE_CACHE_DISK_ENTRIES
+                )
+            if EMBEDDING_STORE:
+                self.embedding_store = EmbeddingStoreRegistry(
+                    self.vision_version(),
+                    max_bytes=EMBEDDING_STORE_MAX_MB * 1024 * 1024,
+                    max_age_s=EMBEDDING_STORE_MAX_AGE_DAYS * 86400
+                )
+            if SIMILAR_CASES_PERSIST:
+                similar_case_db.persist(self.vision_version())
+            self.set_load_state("ready")
         except Exception as e:
             self.load_error = f"Exception during load: {str(e)}"
+            self.set_load_state("failed")
             logger.error(f"Failed to load model: {str(e)}")
 
-    def predict(self, image_bytes: bytes, username: str = None) -> Dict[str, Any]:
-        """Run hierarchical inference using SigLIP Zero-Shot."""
-    # ... (rest of function until line 1094) ...
-        # I need to match the indentation and context. 
-        # Since I can't see "inside" the dots in a replace, I have to be careful.
-        # It's better to update just the definition line and the call to enhance_analysis_result.
-        pass # Placeholder, will use multiple chunks below
+    def _select_pixel_processor(self):
+        """Fast vectorized preprocessing if it passes a logit parity check against the HF processor on real samples."""
+        if not FAST_PREPROCESS:
+            return self.processor
+        try:
+            samples = load_sample_folder(FAST_PREPROCESS_SAMPLES) if FAST_PREPROCESS_SAMPLES else []
+            if not samples:
+                logger.warning("⚠️ Fast preprocessing REFUSED: FAST_PREPROCESS_SAMPLES has no PNG/JPEG images to validate on")
+                return self.processor
+            fast = PixelPreprocessor.from_processor(self.processor)
+            # Uploads at their own size so the resize path is exercised
+            with torch.no_grad():
+                report = check_preprocess_parity(fast, self.processor, self.vision_backend, self.text_bank,
+                                                 samples, FAST_PREPROCESS_TOLERANCE)
+            if not report["passed"]:
+                logger.warning(f"⚠️ Fast preprocessing REFUSED: logit drift {report['max_abs_logit_diff']} > {FAST_PREPROCESS_TOLERANCE}")
+                return self.processor
+            logger.info(f"✅ Fast preprocessing active (logit drift {report['max_abs_logit_diff']})")
+            return fast
+        except Exception as e:
+            logger.warning(f"Fast preprocessing unavailable, using the image processor: {e}")
+            return self.processor
+
+    def start_scheduler(self, window_ms: float, max_batch: int):
+        """Route vision forwards through the micro-batching scheduler."""
+        self.scheduler = MicroBatchScheduler(self.build_contexts, window_ms=window_ms, max_batch=max_batch)
+        self.scheduler.start()
+
+    def stop_scheduler(self):
+        if self.scheduler:
+            self.scheduler.stop()
+            self.scheduler = None
+
+    def build_contexts(self, images: List[Image.Image]) -> List[ImageContext]:
+        """One batched preprocessing + vision pass for several images."""
+        return build_image_contexts(self.vision_backend, self.pixel_processor, images)
+
+    def build_context(self, image: Image.Image) -> ImageContext:
+        """Single preprocessing + vision pass shared by every predict stage."""
+        if self.scheduler and self.scheduler.running:
+            return self.scheduler.run(image)
+        return build_image_context(self.vision_backend, self.pixel_processor, image)
+
+    def zero_shot_probs(self, group: str, image_embeds: torch.Tensor) -> torch.Tensor:
+        """Softmax over one prompt group of the text bank (first image of the batch)."""
+        logits = self.text_bank.logits(group, image_embeds)
+        return torch.softmax(logits, dim=1)[0]
+
+    def vision_version(self) -> str:
+        """Identity of the vision side (embedding store key component)."""
+        return "|".join([
+            os.path.basename(os.path.normpath(self.model_path or "")),
+            self.quantize or "fp32",
+            self.vision_backend.label if self.vision_backend else "none",
+            f"decode{max(0, DECODE_MIN_LONG_SIDE)}",  # Reduced decodes see different pixels
+            "fastprep" if isinstance(self.pixel_processor, PixelPreprocessor) else "hfprep",
+        ])
+
+    def model_version(self) -> str:
+        """Model + prompt configuration identity (inference cache key component)."""
+        return "|".join([
+            self.vision_version(),
+            self.text_bank.version if self.text_bank else "no-text-bank",
+        ])
+
+    def image_context(self, image: Image.Image, username: str = None, image_id: str = None) -> ImageContext:
+        """Vision outputs for one analyzed image: embedding store first, vision tower on a miss."""
+        store = self.embedding_store if (username and image_id) else None
+        if store:
+            stored = store.get(username, image_id)
+            if stored is not None and 'last_hidden_state' in stored:
+                logger.info(f"💾 Embedding store hit ({image_id}): vision tower skipped")
+                to_tensor = lambda a: torch.from_numpy(np.asarray(a, dtype=np.float32)).to(self.model.device)
+                return context_from_embeddings(
+                    self.pixel_processor, image,
+                    to_tensor(stored['image_embeds']),
+                    to_tensor(stored['last_hidden_state'])
+                )
+
+        ctx = self.build_context(image)
+        if store:
+            store.put(username, image_id, {
+                "image_embeds": ctx.image_embeds[0].detach().float().cpu().numpy(),
+                "last_hidden_state": ctx.last_hidden_state[0].detach().float().cpu().numpy(),
+            })
+        return ctx
+
+    def predict(self, image_bytes: bytes, username: str = None, case_id: str = None, explain: bool = True) -> Dict[str, Any]:
+        """
+        Run hierarchical inference using SigLIP Zero-Shot.
+        explain=False stops after classification (stage 'classified'): the heatmap is
+        attached later by explain() from the low-priority queue.
+        """
         if not self.loaded:
             msg = "MedSigClip Model is NOT loaded. Cannot perform inference."
             if self.load_error:
@@ -923,539 +1377,560 @@ class MedSigClipWrapper:
         start_time = time.time()
         
         try:
-            from PIL import Image
-            import io
-            import torch
-            import pydicom
-
-            # ========================================================
-            # LOCALIZATION HELPER
-            # ========================================================
-            def localize_result(result_json: Dict[str, Any]) -> Dict[str, Any]:
-                """
-                Translate the analysis result to French using Canonical IDs.
-                This allows the Model to run in English and the UI to display in French.
-                """
-                localized = result_json.copy()
-                
-                # 1. Translate Domain
-                domain_key = localized.get('domain', {}).get('label')
-                if domain_key in DOMAIN_TRANSLATIONS_FR:
-                    localized['domain']['label_fr'] = DOMAIN_TRANSLATIONS_FR[domain_key]
-                    localized['domain']['label'] = DOMAIN_TRANSLATIONS_FR[domain_key] # Override for simple UI
-                
-                # 2. Translate Specific Results
-                if 'specific' in localized:
-                    new_specific = []
-                    for item in localized['specific']:
-                        label_id = item.get('label_id')
-                        translation = LABEL_TRANSLATIONS_FR.get(label_id)
-                        
-                        if translation:
-                            new_item = item.copy()
-                            new_item['label'] = translation['short'] # Use Short Title for UI
-                            new_item['description'] = translation['long'] # Use Long Description
-                            new_item['severity'] = translation.get('severity', 'medium')
-                            new_specific.append(new_item)
-                        else:
-                            # Fallback if ID missing (should not happen in strict mode)
-                            new_specific.append(item)
-                    
-                    localized['specific'] = new_specific
-                
-                # 3. Set Diagnosis from top translated specific result
-                if 'specific' in localized and len(localized['specific']) > 0:
-                    localized['diagnosis'] = localized['specific'][0].get('label', 'Inconnu')
-                elif 'diagnosis_id' in localized:
-                    # Fallback: Translate diagnosis_id if present
-                    translation = LABEL_TRANSLATIONS_FR.get(localized['diagnosis_id'])
-                    if translation:
-                        localized['diagnosis'] = translation['short']
-                    else:
-                        localized['diagnosis'] = 'Diagnostic Inconnu'
-                
-                # 4. Handle QC failure case (already localized manually in rejection_result)
-                if 'diagnosis' in localized and "Analyse Refusée" in localized['diagnosis']:
-                     pass # Already localized string
-                
-                return localized
+            image, dicom_metadata = decode_image(image_bytes)
+
+            # --- CONTENT-HASH CACHE (model output only) ---
+            cached = None
+            key = None
+            if self.result_cache:
+                key = cache_key(image, self.model_version())
+                cached = self.result_cache.get(key)
+
+            if cached is not None:
+                model_result, embedding = cached
+                logger.info(f"⚡ Inference cache hit ({key[:12]}): model skipped")
+                model_result = self._own_visuals(model_result, username, case_id)
+                # New image_id, same pixels: keep its pooled embedding for re-scoring. Not when the
+                # heatmap is still to come: that pass stores the full vision outputs once.
+                if (embedding is not None and self.embedding_store and username and case_id
+                        and model_result.get('stage') != 'classified'):
+                    self.embedding_store.put(username, case_id, {"image_embeds": embedding})
+            else:
+                model_result, embedding = self._run_pipeline(image, username=username, image_id=case_id, explain=explain)
+                if self.result_cache:
+                    self.result_cache.put(key, model_result, embedding)
+
+            if explain and model_result.get('stage') == 'classified':
+                # Cached classification whose heatmap was never attached
+                model_result, embedding = self._complete_explanation(image, model_result, username, case_id)
+                if self.result_cache:
+                    self.result_cache.put(key, model_result, embedding)
+
+            # --- PER-REQUEST FIELDS (never cached) ---
+            result = dict(model_result)
+            result['cache_hit'] = cached is not None
+            if dicom_metadata:
+                result['patient_metadata'] = dicom_metadata
+            if embedding is not None and username and case_id:
+                result.update(self.similar_cases(case_id, embedding, result, username))
+            result['processing_time'] = round(time.time() - start_time, 3)
+            
+            return result
 
-            # Image preprocessing functions
-            def process_dicom(file_bytes: bytes) -> Tuple[Image.Image, Dict[str, Any]]:
-                """Convert DICOM bytes to PIL Image with tags."""
-                ds = pydicom.dcmread(io.BytesIO(file_bytes))
-                img = ds.pixel_array.astype(np.float32)
-                
-                # Extract Metadata
-                metadata = {
-                    "patient_id": str(ds.get("PatientID", "N/A")),
-                    "patient_name": str(ds.get("PatientName", "N/A")),
-                    "birth_date": str(ds.get("PatientBirthDate", "")),
-                    "study_date": str(ds.get("StudyDate", "")),
-                    "modality": str(ds.get("Modality", "UNKNOWN"))
-                }
-                
-                if hasattr(ds, 'PhotometricInterpretation') and ds.PhotometricInterpretation == "MONOCHROME1":
-                    img = img.max() - img
-                
-                # Lung Window: WL=-600, WW=1500
-                wl, ww = -600, 1500
-                min_val, max_val = wl - ww/2, wl + ww/2
-                img = np.clip(img, min_val, max_val)
-                img = (img - min_val) / (max_val - min_val)
-                img = (img * 255).astype(np.uint8)
-                
-                return Image.fromarray(img).convert("RGB"), metadata
+        except Exception as e:
+            logger.error(f"Inference Error: {str(e)}")
+            raise e
 
-            def process_standard_image(image_bytes: bytes) -> Image.Image:
-                """Process standard images (PNG/JPG) - SIMPLIFIED like Colab.
-                Just load the image as RGB without aggressive preprocessing."""
-                nparr = np.frombuffer(image_bytes, np.uint8)
-                img_cv = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                
-                if img_cv is None:
-                    raise ValueError("Could not decode image")
+    def explain(self, image_bytes: bytes, result: Dict[str, Any], username: str = None, case_id: str = None) -> Dict[str, Any]:
+        """Deferred STEP 3 for a 'classified' result: heatmap + confidence recalibrated with its reliability."""
+        if not self.loaded:
+            raise RuntimeError("MedSigClip Model is NOT loaded. Cannot generate explanation.")
 
-                # Convert BGR to RGB (OpenCV uses BGR)
-                img_rgb = cv2.cvtColor(img_cv, cv2.COLOR_BGR2RGB)
-                
-                return Image.fromarray(img_rgb)
+        start_time = time.time()
+        image, _ = decode_image(image_bytes)
+        explained, embedding = self._complete_explanation(image, result, username, case_id)
+
+        # Later re-uploads of the same pixels get the full result
+        if self.result_cache and embedding is not None:
+            model_result = {k: v for k, v in explained.items() if k not in PER_REQUEST_FIELDS}
+            self.result_cache.put(cache_key(image, self.model_version()), model_result, embedding)
+
+        explained['explanation_time'] = round(time.time() - start_time, 3)
+        return explained
+
+    def _own_visuals(self, model_result: Dict[str, Any], username: str = None, image_id: str = None) -> Dict[str, Any]:
+        """
+        Visuals of a cache hit belong to the image they were computed for: hard-link them
+        to this image when that one is the same user's, otherwise the heatmap is redone.
+        """
+        visuals = model_result.get('visuals')
+        if not visuals or visuals.get('image_id') == image_id:
+            return model_result
+        if not (username and image_id):
+            return dict(model_result, visuals=None)
+        if storage_manager.link_visuals(username, visuals['image_id'], image_id, visuals['names'], visuals['format']):
+            return dict(model_result, visuals=dict(visuals, image_id=image_id))
+        return dict(model_result, visuals=None, stage='classified')
+
+    def _complete_explanation(self, image: Image.Image, result: Dict[str, Any], username: str = None,
+                              image_id: str = None) -> Tuple[Dict[str, Any], Optional[np.ndarray]]:
+        """Attach STEP 3 to a classified result. Vision outputs come from the embedding store when possible."""
+        domain_key = result.get('domain', {}).get('key')
+        explained = dict(result)
+        if not domain_key or not result.get('specific'):
+            explained['stage'] = 'explained'
+            return explained, None
+
+        top = result['specific'][0]
+        image_ctx = self.image_context(image, username=username, image_id=image_id)
+        explained.update(self._explanation(image, image_ctx, specific_label_en(domain_key, top['label_id']), domain_key,
+                                           username=username, image_id=image_id))
+
+        qc_score = float(result.get('image_quality', {}).get('overall_score', 0))
+        explained.update(calibrated_confidence(top['probability'], qc_score, explained['explainability']['reliability']))
+        return explained, image_ctx.image_embeds[0].detach().float().cpu().numpy()
+
+    def _explanation(self, image: Image.Image, image_ctx: ImageContext, target_text: str, domain_key: str,
+                     username: str = None, image_id: str = None) -> Dict[str, Any]:
+        """
+        STEP 3: HEATMAP GENERATION (Grad-CAM++ x MedSegCLIP) for the top finding.
+        Visuals are written (capped, compressed) to the user's storage next to the image,
+        unless there is no stored image (anonymous predict: no job could ever serve them).
+        """
+        from explainability import ExplainabilityEngine
+
+        anatomical_context = ANATOMICAL_CONTEXTS.get(domain_key, DEFAULT_ANATOMICAL_CONTEXT)
+        visuals = None
+        explanation = {}
 
-            # Detect image format
-            header = image_bytes[:32]
-            is_png = header.startswith(b'\x89PNG\r\n\x1a\n')
-            is_jpeg = header.startswith(b'\xff\xd8\xff')
-            
-            image = None
-            dicom_metadata = None
-            
-            if is_png or is_jpeg:
-                try:
-                    image = process_standard_image(image_bytes)
-                    logger.info(f"Processed as {'PNG' if is_png else 'JPEG'}")
-                except Exception as e:
-                    raise ValueError(f"Corrupt Image File: {str(e)}")
-            
-            if image is None:
-                try:
-                    image, dicom_metadata = process_dicom(image_bytes)
-                    logger.info("Processed as DICOM")
-                except Exception:
-                    try:
-                        image = process_standard_image(image_bytes)
-                    except Exception as e:
-                        raise ValueError(f"Unknown image format: {str(e)}")
-
-            # =========================================================
-            # ADAPTIVE PREPROCESSING - DISABLED to match Colab behavior
-            # The model was trained on raw images, not preprocessed ones
-            # =========================================================
-            preprocessing_log = {"message": "Preprocessing disabled for accuracy", "transformation_count": 0}
-            # NOTE: Uncomment below to re-enable if needed
-            # try:
-            #     import io as io_module
-            #     buffer = io_module.BytesIO()
-            #     image.save(buffer, format='PNG')
-            #     image_bytes_for_preprocessing = buffer.getvalue()
-            #     image, preprocessing_log = adaptive_preprocessing(image_bytes_for_preprocessing)
-            #     logger.info(f"🔧 Adaptive preprocessing applied: {preprocessing_log.get('transformation_count', 0)} transformations")
-            # except Exception as e_preproc:
-            #     logger.warning(f"Adaptive preprocessing skipped: {e_preproc}")
-
-            # =========================================================
-            # ✅ V5 QC GATE: Quality Check BEFORE Model Inference
-            # =========================================================
-            image_array = np.array(image)
-            qc_result = assess_image_quality(image_array)
-            quality_score = qc_result.get('overall_score', 0)
-            
-            logger.info(f"📊 QC Gate: Quality Score = {quality_score:.2f}")
-            
-            # Define QC threshold (configurable)
-            QC_THRESHOLD = 0.35  # Images below this are rejected
-            
-            if quality_score < QC_THRESHOLD:
-                # ❌ EARLY REJECTION: Don't call model
-                logger.warning(f"❌ QC Gate REJECTED: Quality {quality_score:.2f} < {QC_THRESHOLD}")
-                
-                rejection_result = {
-                    "domain": {"label": "QC Failed"},
-                    "diagnosis": f"Analyse Refusée - Qualité Image Insuffisante ({int(quality_score*100)}%)",
-                    "specific": [{
-                        "label": "Qualité Insuffisante",
-                        "label_id": "QC_FAILED",
-                        "probability": 0,
-                        "description": f"L'image ne répond pas aux critères de qualité minimale. Score: {int(quality_score*100)}%"
-                    }],
-                    "priority": "Normale",
-                    "confidence": 0,
-                    "quality_metrics": [
-                        {"metric": "Score Global", "value": int(quality_score * 100)},
-                        {"metric": "Netteté", "value": int(qc_result.get('sharpness', 0) * 100)},
-                        {"metric": "Contraste", "value": int(qc_result.get('contrast', 0) * 100)},
-                        {"metric": "Bruit", "value": int(qc_result.get('noise', 0) * 100)},
-                    ],
-                    "qc_issues": qc_result.get('issues', []),
-                    "qc_passed": False
-                }
-                
-                return localize_result(rejection_result)
+        try:
+            explanation = ExplainabilityEngine(self).explain(
+                image=image,
+                target_text=target_text,
+                anatomical_context=anatomical_context,
+                context=image_ctx
+            )
 
-            logger.info(f"✅ QC Gate PASSED: Quality {quality_score:.2f} >= {QC_THRESHOLD}")
+            if explanation.get('heatmap_array') is not None and username and image_id:
+                # Heatmap is already display-capped; original gets the same cap
+                originals = display_rgb(image)
+                names = []
+                for name, rgb in (("heatmap", explanation['heatmap_array']), ("original", originals)):
+                    data, fmt = encode_visual(rgb)
+                    storage_manager.save_visual(username, image_id, name, fmt, data)
+                    names.append(name)
+                visuals = {"key": cache_key(image, self.model_version()), "image_id": image_id, "format": fmt, "names": names}
+
+        except Exception as e_cam:
+            import traceback
+            logger.error(f"Explainability Pipeline Failed: {traceback.format_exc()}")
+
+        return explanation_fields(
+            anatomical_context, "explained",
+            reliability=explanation.get("reliability_score", 0),
+            visuals=visuals
+        )
 
-            # STEP 1: DOMAIN IDENTIFICATION
-            domain_keys = list(MEDICAL_DOMAINS.keys())
-            domain_prompts = [d['domain_prompt'] for d in MEDICAL_DOMAINS.values()]
-            
-            inputs_domain = self.processor(
-                text=domain_prompts, 
-                images=image, 
-                padding="max_length", 
-                return_tensors="pt"
-            )
-            
-            with torch.no_grad():
-                outputs_domain = self.model(**inputs_domain)
+    def similar_cases(self, case_id: str, embedding: np.ndarray, result: Dict[str, Any], username: str) -> Dict[str, Any]:
+        """Previous cases of THIS user in the same domain, then register this one."""
+        domain_key = result.get('domain', {}).get('key')
+        if not domain_key or not result.get('specific'):
+            return {}
+        similar = find_similar_cases(embedding, domain_key, username, exclude_case_id=case_id)
+        top = result['specific'][0]
+        store_case_for_similarity(case_id, embedding, top.get('label'), domain_key, top.get('probability', 0), username)
+        return {"similar_cases": similar}
+
+    def _run_pipeline(self, image: Image.Image, username: str = None, image_id: str = None,
+                      explain: bool = True) -> Tuple[Dict[str, Any], Optional[np.ndarray]]:
+        """
+        Model part of predict: QC gate, zero-shot stages, explainability (unless explain=False).
+        Returns (localized result, pooled embedding or None if QC rejected).
+        """
+        # =========================================================
+        # ADAPTIVE PREPROCESSING - DISABLED to match Colab behavior
+        # The model was trained on raw images, not preprocessed ones
+        # =========================================================
+        preprocessing_log = {"message": "Preprocessing disabled for accuracy", "transformation_count": 0}
+        # NOTE: Uncomment below to re-enable if needed
+        # try:
+        #     import io as io_module
+        #     buffer = io_module.BytesIO()
+        #     image.save(buffer, format='PNG')
+        #     image_bytes_for_preprocessing = buffer.getvalue()
+        #     image, preprocessing_log = adaptive_preprocessing(image_bytes_for_preprocessing)
+        #     logger.info(f"🔧 Adaptive preprocessing applied: {preprocessing_log.get('transformation_count', 0)} transformations")
+        # except Exception as e_preproc:
+        #     logger.warning(f"Adaptive preprocessing skipped: {e_preproc}")
+
+        # =========================================================
+        # ✅ V5 QC GATE: Quality Check BEFORE Model Inference
+        # =========================================================
+        image_array = rgb_array(image)  # Shared decoded buffer (read-only), no copy
+        qc_result = assess_image_quality(image_array, original_size=image.info.get("original_size"),
+                                         sharpness=full_resolution_sharpness(image))
+        quality_score = qc_result.get('overall_score', 0)
+        
+        logger.info(f"📊 QC Gate: Quality Score = {quality_score:.2f}")
+        
+        # Define QC threshold (configurable)
+        QC_THRESHOLD = 0.35  # Images below this are rejected
+        
+        if quality_score < QC_THRESHOLD:
+            # ❌ EARLY REJECTION: Don't call model
+            logger.warning(f"❌ QC Gate REJECTED: Quality {quality_score:.2f} < {QC_THRESHOLD}")
             
-            probs_domain = torch.softmax(outputs_domain.logits_per_image, dim=1)[0]
-            best_domain_idx = torch.argmax(probs_domain).item()
-            best_domain_key = domain_keys[best_domain_idx]
-            best_domain_prob = float(probs_domain[best_domain_idx] * 100)
+            rejection_result = {
+                "domain": {"label": "QC Failed"},
+                "diagnosis": f"Analyse Refusée - Qualité Image Insuffisante ({int(quality_score*100)}%)",
+                "specific": [{
+                    "label": "Qualité Insuffisante",
+                    "label_id": "QC_FAILED",
+                    "probability": 0,
+                    "description": f"L'image ne répond pas aux critères de qualité minimale. Score: {int(quality_score*100)}%"
+                }],
+                "priority": "Normale",
+                "confidence": 0,
+                "quality_metrics": [
+                    {"metric": "Score Global", "value": int(quality_score * 100)},
+                    {"metric": "Netteté", "value": int(qc_result.get('sharpness', 0) * 100)},
+                    {"metric": "Contraste", "value": int(qc_result.get('contrast', 0) * 100)},
+                    {"metric": "Bruit", "value": int(qc_result.get('noise', 0) * 100)},
+                ],
+                "qc_issues": qc_result.get('issues', []),
+                "qc_passed": False
+            }
             
-            logger.info(f"Identified Domain: {best_domain_key} ({best_domain_prob:.2f}%)")
+            return localize_analysis_result(rejection_result), None
 
-            # STEP 2: SPECIFIC ANALYSIS
-            domain_config = MEDICAL_DOMAINS[best_domain_key]
-            specific_results = []
-            
-            # --- LOGIC GATE CHECK (GENERIC) ---
-            logic_penalty_factor = 1.0
-            logic_gate_info = None
-            logic_penalty_target = None
-            
-            if 'logic_gate' in domain_config:
-                gate_config = domain_config['logic_gate']
-                logger.info(f"🧠 Running Generic Logic Gate for {best_domain_key}: {gate_config['prompt']}")
-                
-                gate_labels = gate_config['labels']
-                inputs_gate = self.processor(text=gate_labels, images=image, padding="max_length", return_tensors="pt")
-                with torch.no_grad():
-                    out_gate = self.model(**inputs_gate)
-                
-                probs_gate = torch.softmax(out_gate.logits_per_image, dim=1)[0]
-                
-                # Default Logic: Index 1 is "Abnormal/Blocker" (e.g. "Enlarged", "Implant", "Poor Quality")
-                # Unless 'abnormal_index' is specified
-                abn_idx = gate_config.get('abnormal_index', 1)
-                p_abnormal = float(probs_gate[abn_idx])
-                
-                logger.info(f"Logic Gate Result: Abnormal/Blocker Probability = {p_abnormal:.2f}")
-                
-                if p_abnormal > 0.5: # Threshold for logic switch
-                    logger.warning(f"⚠️ Logic Gate Triggered: {gate_labels[abn_idx]} (p={p_abnormal:.2f})")
-                    logic_penalty_factor = 0.15 # Strong penalty
-                    logic_gate_info = f"Logic Gate Rejected: {gate_labels[abn_idx]}"
-                    logic_penalty_target = gate_config.get('penalty_target', 'Normal')
-            
-            if 'stage_1_triage' in domain_config:
-                # Hierarchical Logic (e.g., Orthopedics)
-                logger.info(f"Engaging Level 2 Hierarchical Logic for: {best_domain_key}")
-                
-                triage_labels = domain_config['stage_1_triage']['labels']
-                inputs_triage = self.processor(text=triage_labels, images=image, padding="max_length", return_tensors="pt")
-                
-                with torch.no_grad():
-                    out_triage = self.model(**inputs_triage)
-                
-                probs_triage = torch.softmax(out_triage.logits_per_image, dim=1)[0]
-                prob_abnormal = float(probs_triage[-1])
-                prob_normal = 1.0 - prob_abnormal
-                
-                logger.info(f"Triage: Normal={prob_normal*100:.2f}%, Abnormal={prob_abnormal*100:.2f}%")
-                
-                if prob_abnormal > prob_normal:
-                    logger.info("Running Stage 2 Diagnosis...")
-                    diag_labels = domain_config['stage_2_diagnosis']['labels']
-                    inputs_diag = self.processor(text=diag_labels, images=image, padding="max_length", return_tensors="pt")
-                    
-                    with torch.no_grad():
-                        out_diag = self.model(**inputs_diag)
-                    
-                    probs_diag = torch.softmax(out_diag.logits_per_image, dim=1)[0]
-                    
-                    for i, label in enumerate(diag_labels):
-                        specific_results.append({
-                            "label": label,
-                            "probability": round(float(probs_diag[i] * 100), 2)
-                        })
-                else:
-                    logger.info("Triage indicates Normal/Healthy. Skipping Stage 2.")
-            else:
-                # Flat Mode (Thoracic, Dermato, etc.)
-                specific_items = domain_config['specific_labels']
-                # Extract text prompts for CLIP
-                labels_en = [item['label_en'] for item in specific_items]
-                
-                inputs_specific = self.processor(
-                    text=labels_en, 
-                    images=image, 
-                    padding="max_length", 
-                    return_tensors="pt"
-                )
-                
-            # --- LOGIC GATE & MORPHOLOGY ENGINE (V3) ---
-            from explainability import ExplainabilityEngine
-            explain_engine = ExplainabilityEngine(self)
-            
-            # Morphology Analysis (Thoracic Only for now)
-            morphology_result = None
-            if best_domain_key == 'Thoracic':
-                 logger.info("📐 Running Morphology Engine (CTR)...")
-                 morphology_result = explain_engine.calculate_cardiothoracic_ratio(image)
-                 
-                 # Logic Rule: If CTR > 0.55 (Cardiomegaly), penalize NORMAL heavily
-                 if morphology_result['valid'] and morphology_result['ctr'] > 0.55:
-                     logger.warning(f"⚠️ Cardiomegaly Detected (CTR={morphology_result['ctr']}). Penalizing 'Normal'.")
-                     logic_penalty_target = 'TH_NORMAL'
-                     logic_penalty_factor = 0.1 # Very strict penalty
-
-            # --- MODEL INFERENCE (Pathology) ---
-            with torch.no_grad():
-                outputs_specific = self.model(**inputs_specific)
-            
-            probs_specific = torch.softmax(outputs_specific.logits_per_image, dim=1)[0]
-            
-            for i, item in enumerate(specific_items):
-                    specific_results.append({
-                        "label_id": item['id'],
-                        "label": item['label_en'], # Keep EN for internal logic
-                        "probability": round(float(probs_specific[i] * 100), 2)
-                    })
-            
-            specific_results.sort(key=lambda x: x['probability'], reverse=True)
-
-            # --- APPLY LOGICAL CONSTRAINTS (POST-PROCESSING) ---
-            if logic_penalty_factor < 1.0 and logic_penalty_target:
-                 logger.info(f"📉 Applying Logic Penalty ({logic_penalty_factor}x) to target: {logic_penalty_target}")
-                 
-                 for res in specific_results:
-                      should_penalize = False
-                      label_text = res['label'] 
-                      label_id = res['label_id']
-                      
-                      if logic_penalty_target == 'ALL_DIAGNOSIS':
-                          if "Artifact" in label_text or "Quality" in label_text or "Partial" in label_text or "Empty" in label_text:
-                              pass 
-                          else:
-                              should_penalize = True
-
-                      elif logic_penalty_target == 'ALL_PATHOLOGY':
-                          is_benign = "Normal" in label_text or "Healthy" in label_text or "Non-specific" in label_text or "Benign" in label_text
-                          if not is_benign:
-                              should_penalize = True
-                              
-                      else:
-                          if logic_penalty_target == label_id:
-                              should_penalize = True
-                          elif logic_penalty_target in label_text:
-                              should_penalize = True
-                      
-                      if should_penalize:
-                           old_prob = res['probability']
-                           res['probability'] = round(old_prob * logic_penalty_factor, 2)
-                           logger.warning(f"   -> Penalized '{label_text}': {old_prob}% -> {res['probability']}%")
-                 
-                 specific_results.sort(key=lambda x: x['probability'], reverse=True)
-            
-            # --- CALIBRATED CONFIDENCE (MARGINAL) ---
-            confidence_level = "Low"
-            margin = 0.0
-            
-            if len(specific_results) >= 2:
-                top_prob = specific_results[0]['probability']
-                second_prob = specific_results[1]['probability']
-                margin = top_prob - second_prob
-                
-                if margin >= 15.0:
-                    confidence_level = "High"
-                elif margin >= 5.0:
-                    confidence_level = "Moderate"
-                else:
-                    confidence_level = "Low"
-                
-                confidence_metadata = {
-                    "margin": round(margin, 2),
-                    "uncertainty_flag": margin < 10.0,
-                    "level": confidence_level
-                }
-                logger.info(f"📊 Confidence: {confidence_level} (Margin: {margin:.2f}%)")
-            else:
-                confidence_metadata = {"margin": 100.0, "uncertainty_flag": False, "level": "High"}
+        logger.info(f"✅ QC Gate PASSED: Quality {quality_score:.2f} >= {QC_THRESHOLD}")
 
+        # Single vision pass: every stage below reuses this context
+        image_ctx = self.image_context(image, username=username, image_id=image_id)
+        image_embeds = image_ctx.image_embeds
 
-            # STEP 3: HEATMAP GENERATION (Grad-CAM++ x MedSegCLIP)
-            heatmap_base64 = None
-            original_base64 = None
-            explanation = {} 
-            
-            try:
-                if specific_results:
-                    top_label_text = specific_results[0]['label']
-                    
-                    # FIX: Reuse engine from above
-                    # engine = explainability.ExplainabilityEngine(self) -> Already instantiated
-                    
-                    anatomical_context = "body part"
-                    if best_domain_key == 'Thoracic': anatomical_context = "lung parenchyma"
-                    elif best_domain_key == 'Orthopedics': anatomical_context = "bone structure"
-                    elif best_domain_key == 'Dermatology': anatomical_context = "skin lesion"
-                    elif best_domain_key == 'Ophthalmology': anatomical_context = "retina"
-                    
-                    explanation = explain_engine.explain(
-                        image=image, 
-                        target_text=top_label_text,
-                        anatomical_context=anatomical_context
-                    )
-                    
-                    if explanation.get('heatmap_array') is not None:
-                        vis_img = explanation['heatmap_array']
-                        _, buffer = cv2.imencode('.png', cv2.cvtColor(vis_img, cv2.COLOR_RGB2BGR))
-                        heatmap_base64 = base64.b64encode(buffer).decode('utf-8')
-
-                        # Original Image
-                        img_tensor = np.array(image).astype(np.float32) / 255.0
-                        original_uint8 = (img_tensor * 255).astype(np.uint8)
-                        _, buffer_orig = cv2.imencode('.png', cv2.cvtColor(original_uint8, cv2.COLOR_RGB2BGR))
-                        original_base64 = base64.b64encode(buffer_orig).decode('utf-8')
-                        
-            except Exception as e_cam:
-                import traceback
-                logger.error(f"Explainability Pipeline Failed: {traceback.format_exc()}")
-
-            # FINAL RESULT (Base)
-            enhanced_result = {
-                "domain": {
-                    "label": best_domain_key,
-                    "description": MEDICAL_DOMAINS[best_domain_key]['domain_prompt'],
-                    "probability": round(best_domain_prob, 2)
-                },
-                "specific": specific_results,
-                "heatmap": heatmap_base64,
-                "original_image": original_base64,
-                "preprocessing": preprocessing_log,
-                "morphology": morphology_result, # NEW
-                "confidence_metadata": confidence_metadata, # NEW
-                "explainability": { 
-                    "method": "Grad-CAM++ x MedSegCLIP (Proxy)",
-                    "anatomical_context": anatomical_context if 'anatomical_context' in locals() else "Unknown",
-                    "reliability": explanation.get("reliability_score", 0)
-                }
-            }
-            
-            # ... (Rest of function) ...
-            
-            # ✅ V5: QC already assessed in QC Gate before model inference
-  # qc_result already available from QC Gate above
-            logger.info(f"📊 Final Quality Score (from QC Gate): {qc_result['overall_score']*100:.1f}%")
-            
-            # --- MAP TO FRONTEND EXPECTATIONS ---
-            # ...
-            # 2. STRICT CONFIDENCE CALIBRATION (V4 Backend Authority)
-            # Formula: Final = Model_Prob * QC_Score * Reliability_Score
-            # This prevents "high confidence" on garbage images or when Grad-CAM disagrees.
-            
-            top_finding = enhanced_result['specific'][0] if enhanced_result['specific'] else {"label": "Inconnu", "probability": 0, "label_id": "UNKNOWN"}
+        # STEP 1: DOMAIN IDENTIFICATION
+        domain_keys = list(MEDICAL_DOMAINS.keys())
+        probs_domain = self.zero_shot_probs(DOMAINS_GROUP, image_embeds)
+        best_domain_idx = torch.argmax(probs_domain).item()
+        best_domain_key = domain_keys[best_domain_idx]
+        best_domain_prob = float(probs_domain[best_domain_idx] * 100)
+        
+        logger.info(f"Identified Domain: {best_domain_key} ({best_domain_prob:.2f}%)")
+
+        # STEP 2: SPECIFIC ANALYSIS
+        domain_config = MEDICAL_DOMAINS[best_domain_key]
+        specific_results = []
+        
+        # --- LOGIC GATE CHECK (GENERIC) ---
+        logic_penalty_factor = 1.0
+        logic_gate_info = None
+        logic_penalty_target = None
+        
+        if 'logic_gate' in domain_config:
+            gate_config = domain_config['logic_gate']
+            logger.info(f"🧠 Running Generic Logic Gate for {best_domain_key}: {gate_config['prompt']}")
             
-            # Don't set diagnosis yet - let localize_result() handle translation
-            # Just store the label_id for localization
-            if 'label_id' in top_finding:
-                enhanced_result['diagnosis_id'] = top_finding['label_id']
+            gate_labels = gate_config['labels']
+            probs_gate = self.zero_shot_probs(group_key(best_domain_key, 'logic_gate'), image_embeds)
             
-            # Get model confidence from top finding probability
-            model_conf = float(top_finding['probability']) / 100.0
-            qc_score = float(qc_result.get('overall_score', 0))  # ✅ V5: Use overall_score from QC Gate
+            # Default Logic: Index 1 is "Abnormal/Blocker" (e.g. "Enlarged", "Implant", "Poor Quality")
+            # Unless 'abnormal_index' is specified
+            abn_idx = gate_config.get('abnormal_index', 1)
+            p_abnormal = float(probs_gate[abn_idx])
             
-            # Reliability: If missing (e.g. QC failed), default to 1.0
-            reliability_score = float(enhanced_result['explainability'].get('reliability', 1.0))
-            if reliability_score == 0: reliability_score = 1.0 # Fallback if method not applicable
+            logger.info(f"Logic Gate Result: Abnormal/Blocker Probability = {p_abnormal:.2f}")
             
-            # ✅ V5 CALIBRATED CONFIDENCE: Model × QC × Explainability
-            # This prevents high conf on low quality images
-            final_confidence_score = model_conf * qc_score * reliability_score
-            final_confidence_percent = round(final_confidence_score * 100, 2)
+            if p_abnormal > 0.5: # Threshold for logic switch
+                logger.warning(f"⚠️ Logic Gate Triggered: {gate_labels[abn_idx]} (p={p_abnormal:.2f})")
+                logic_penalty_factor = 0.15 # Strong penalty
+                logic_gate_info = f"Logic Gate Rejected: {gate_labels[abn_idx]}"
+                logic_penalty_target = gate_config.get('penalty_target', 'Normal')
+        
+        if 'stage_1_triage' in domain_config:
+            # Hierarchical Logic (e.g., Orthopedics)
+            logger.info(f"Engaging Level 2 Hierarchical Logic for: {best_domain_key}")
             
-            logger.info(f"⚖️ Confidence Calibration: Model({model_conf:.2f}) × QC({qc_score:.2f}) × Reliability({reliability_score:.2f}) = {final_confidence_score:.2f}")
+            probs_triage = self.zero_shot_probs(group_key(best_domain_key, 'stage_1_triage'), image_embeds)
+            prob_abnormal = float(probs_triage[-1])
+            prob_normal = 1.0 - prob_abnormal
             
-            enhanced_result['calibrated_confidence'] = final_confidence_percent
-            enhanced_result['confidence'] = final_confidence_percent # Override raw confidence
+            logger.info(f"Triage: Normal={prob_normal*100:.2f}%, Abnormal={prob_abnormal*100:.2f}%")
             
-            # Update Level based on Calibrated Score
-            if final_confidence_percent > 85:
-                 enhanced_result['confidence_level'] = "High"
-            elif final_confidence_percent > 50:
-                 enhanced_result['confidence_level'] = "Moderate"
+            if prob_abnormal > prob_normal:
+                logger.info("Running Stage 2 Diagnosis...")
+                specific_items = domain_config['stage_2_diagnosis']['labels']
+                probs_specific = self.zero_shot_probs(group_key(best_domain_key, 'stage_2_diagnosis'), image_embeds)
             else:
-                 enhanced_result['confidence_level'] = "Low"
-            
-            # 3. Processing Time (Real Measurement)
-            enhanced_result['processing_time'] = round(time.time() - start_time, 3) 
-            
-            # 4. Predictions (Alias for specific)
-            enhanced_result['predictions'] = [
-                {"name": item['label'], "probability": item['probability']} 
-                for item in enhanced_result['specific']
-            ]
-            
-            # 5. Quality Metrics (Flatten structure for frontend)
-            enhanced_result['quality_score'] = int(qc_result['overall_score'] * 100)  # ✅ V5: Convert to percentage
-            enhanced_result['quality_metrics'] = qc_result['metrics']
-            enhanced_result['image_quality'] = qc_result # Keep full structure too
+                logger.info("Triage indicates Normal/Healthy. Skipping Stage 2.")
+                specific_items = []
+                probs_specific = None
+        else:
+            # Flat Mode (Thoracic, Dermato, etc.)
+            specific_items = domain_config['specific_labels']
+            probs_specific = self.zero_shot_probs(group_key(best_domain_key, 'specific_labels'), image_embeds)
             
-            # 6. Priority
-            # If priority is a dict (from new algo), extract just the level/score for simple display, or keep object
-            # Frontend expects string 'priority' sometimes, or maybe object. Let's provide string for badge.
-            if isinstance(enhanced_result.get('priority'), str):
-                 pass 
-            elif isinstance(enhanced_result.get('priority'), dict):
-                 # Flatten for frontend simple badge
-                 enhanced_result['priority'] = enhanced_result['priority'].get('level', 'Normale')
-
-            # 7. DICOM Metadata (if available)
-            if dicom_metadata:
-                enhanced_result['patient_metadata'] = dicom_metadata
-
-            logger.info("✅ Intelligence Algorithms applied successfully")
+        # --- LOGIC GATE & MORPHOLOGY ENGINE (V3) ---
+        from explainability import ExplainabilityEngine
+        explain_engine = ExplainabilityEngine(self)
+        
+        # Morphology Analysis (Thoracic Only for now)
+        morphology_result = None
+        if best_domain_key == 'Thoracic':
+             logger.info("📐 Running Morphology Engine (CTR)...")
+             morphology_result = explain_engine.calculate_cardiothoracic_ratio(image, context=image_ctx)
+             
+             # Logic Rule: If CTR > 0.55 (Cardiomegaly), penalize NORMAL heavily
+             if morphology_result['valid'] and morphology_result['ctr'] > 0.55:
+                 logger.warning(f"⚠️ Cardiomegaly Detected (CTR={morphology_result['ctr']}). Penalizing 'Normal'.")
+                 logic_penalty_target = 'TH_NORMAL'
+                 logic_penalty_factor = 0.1 # Very strict penalty
+
+        # --- PATHOLOGY SCORES (already computed from the text bank) ---
+        for i, item in enumerate(specific_items):
+                specific_results.append({
+                    "label_id": item['id'],
+                    "label": item['label_en'], # Keep EN for internal logic
+                    "probability": round(float(probs_specific[i] * 100), 2)
+                })
+        
+        specific_results.sort(key=lambda x: x['probability'], reverse=True)
+
+        # --- APPLY LOGICAL CONSTRAINTS (POST-PROCESSING) ---
+        if logic_penalty_factor < 1.0 and logic_penalty_target:
+             logger.info(f"📉 Applying Logic Penalty ({logic_penalty_factor}x) to target: {logic_penalty_target}")
+             
+             for res in specific_results:
+                  label_text = res['label'] 
+                  
+                  # Same rule as retroactive re-scoring (rescoring.py)
+                  if penalty_applies(logic_penalty_target, label_text, res['label_id']):
+                       old_prob = res['probability']
+                       res['probability'] = round(old_prob * logic_penalty_factor, 2)
+                       logger.warning(f"   -> Penalized '{label_text}': {old_prob}% -> {res['probability']}%")
+             
+             specific_results.sort(key=lambda x: x['probability'], reverse=True)
+        
+        # --- CALIBRATED CONFIDENCE (MARGINAL) ---
+        confidence_level = "Low"
+        margin = 0.0
+        
+        if len(specific_results) >= 2:
+            top_prob = specific_results[0]['probability']
+            second_prob = specific_results[1]['probability']
+            margin = top_prob - second_prob
             
-            # --- LOCALIZATION (Translate to French) ---
-            localized_result = localize_result(enhanced_result)
+            if margin >= 15.0:
+                confidence_level = "High"
+            elif margin >= 5.0:
+                confidence_level = "Moderate"
+            else:
+                confidence_level = "Low"
             
-            return localized_result
-
-        except Exception as e:
-            logger.error(f"Inference Error: {str(e)}")
-            raise e
+            confidence_metadata = {
+                "margin": round(margin, 2),
+                "uncertainty_flag": margin < 10.0,
+                "level": confidence_level
+            }
+            logger.info(f"📊 Confidence: {confidence_level} (Margin: {margin:.2f}%)")
+        else:
+            confidence_metadata = {"margin": 100.0, "uncertainty_flag": False, "level": "High"}
+
+
+        # STEP 3: HEATMAP GENERATION (Grad-CAM++ x MedSegCLIP) - inline, or deferred to the explain queue
+        if not specific_results:
+            explanation = explanation_fields("Unknown", "explained")
+        elif explain:
+            explanation = self._explanation(image, image_ctx, specific_results[0]['label'], best_domain_key,
+                                            username=username, image_id=image_id)
+        else:
+            anatomical_context = ANATOMICAL_CONTEXTS.get(best_domain_key, DEFAULT_ANATOMICAL_CONTEXT)
+            explanation = explanation_fields(anatomical_context, "classified")
+
+        # FINAL RESULT (Base)
+        enhanced_result = {
+            "domain": {
+                "label": best_domain_key,
+                "key": best_domain_key,  # Stays English after localization
+                "description": MEDICAL_DOMAINS[best_domain_key]['domain_prompt'],
+                "probability": round(best_domain_prob, 2)
+            },
+            "specific": specific_results,
+            "preprocessing": preprocessing_log,
+            "morphology": morphology_result, # NEW
+            "confidence_metadata": confidence_metadata, # NEW
+            **explanation  # visuals, explainability, stage
+        }
+        
+        # ... (Rest of function) ...
+        
+        # ✅ V5: QC already assessed in QC Gate before model inference
+  # qc_result already available from QC Gate above
+        logger.info(f"📊 Final Quality Score (from QC Gate): {qc_result['overall_score']*100:.1f}%")
+        
+        # --- MAP TO FRONTEND EXPECTATIONS ---
+        # ...
+        # 2. STRICT CONFIDENCE CALIBRATION (V4 Backend Authority)
+        # Formula: Final = Model_Prob * QC_Score * Reliability_Score
+        # This prevents "high confidence" on garbage images or when Grad-CAM disagrees.
+        
+        top_finding = enhanced_result['specific'][0] if enhanced_result['specific'] else {"label": "Inconnu", "probability": 0, "label_id": "UNKNOWN"}
+        
+        # Don't set diagnosis yet - let localize_analysis_result() handle translation
+        # Just store the label_id for localization
+        if 'label_id' in top_finding:
+            enhanced_result['diagnosis_id'] = top_finding['label_id']
+        
+        # Get model confidence from top finding probability
+        model_conf = float(top_finding['probability']) / 100.0
+        qc_score = float(qc_result.get('overall_score', 0))  # ✅ V5: Use overall_score from QC Gate
+        
+        # Reliability: If missing (e.g. QC failed), default to 1.0
+        reliability_score = float(enhanced_result['explainability'].get('reliability', 1.0))
+        if reliability_score == 0: reliability_score = 1.0 # Fallback if method not applicable
+        
+        # ✅ V5 CALIBRATED CONFIDENCE: Model × QC × Explainability
+        # This prevents high conf on low quality images
+        final_confidence_score = model_conf * qc_score * reliability_score
+        final_confidence_percent = round(final_confidence_score * 100, 2)
+        
+        logger.info(f"⚖️ Confidence Calibration: Model({model_conf:.2f}) × QC({qc_score:.2f}) × Reliability({reliability_score:.2f}) = {final_confidence_score:.2f}")
+        
+        enhanced_result['calibrated_confidence'] = final_confidence_percent
+        enhanced_result['confidence'] = final_confidence_percent # Override raw confidence
+        
+        # Update Level based on Calibrated Score
+        if final_confidence_percent > 85:
+             enhanced_result['confidence_level'] = "High"
+        elif final_confidence_percent > 50:
+             enhanced_result['confidence_level'] = "Moderate"
+        else:
+             enhanced_result['confidence_level'] = "Low"
+        
+        # 3. Inference Backend (processing_time is set per request in predict)
+        enhanced_result['inference_backend'] = self.vision_backend.label  # e.g. torch / torch-trace / onnx
+        enhanced_result['prompt_version'] = self.text_bank.version  # Re-scoring skips results already on this version
+        
+        # 4. Predictions (Alias for specific)
+        enhanced_result['predictions'] = [
+            {"name": item['label'], "probability": item['probability']} 
+            for item in enhanced_result['specific']
+        ]
+        
+        # 5. Quality Metrics (Flatten structure for frontend)
+        enhanced_result['quality_score'] = int(qc_result['overall_score'] * 100)  # ✅ V5: Convert to percentage
+        enhanced_result['quality_metrics'] = qc_result['metrics']
+        enhanced_result['image_quality'] = qc_result # Keep full structure too
+        
+        # 6. Priority (triage from the English top finding, same as re-scoring)
+        enhanced_result['priority'] = calculate_priority_score(enhanced_result['specific'], best_domain_key)
+        # If priority is a dict (from new algo), extract just the level/score for simple display, or keep object
+        # Frontend expects string 'priority' sometimes, or maybe object. Let's provide string for badge.
+        if isinstance(enhanced_result.get('priority'), str):
+             pass 
+        elif isinstance(enhanced_result.get('priority'), dict):
+             # Flatten for frontend simple badge
+             enhanced_result['priority'] = enhanced_result['priority'].get('level', 'Normale')
+
+        logger.info("✅ Intelligence Algorithms applied successfully")
+        
+        # --- LOCALIZATION (Translate to French) ---
+        localized_result = localize_analysis_result(enhanced_result)
+        
+        # Pooled embedding (similar cases, cache)
+        embedding = image_embeds[0].detach().float().cpu().numpy()
+        return localized_result, embedding
 
 # =========================================================================
 # GLOBAL MODEL INSTANCE
 # =========================================================================
 model_wrapper: Optional[MedSigClipWrapper] = None
+inference_pool: Optional[InferenceWorkerPool] = None
+similar_case_db = SimilarCaseIndex(
+    SIMILAR_CASES_PER_PARTITION,
+    search_mode=SIMILAR_CASES_SEARCH,
+    nprobe=SIMILAR_CASES_IVF_NPROBE,
+    ann_min_rows=SIMILAR_CASES_IVF_MIN_CASES,
+    codec_factory=lambda dim: make_codec(SIMILAR_CASES_CODEC, dim, SIMILAR_CASES_PQ_SUBVECTORS, SIMILAR_CASES_PQ_TRAIN_CASES)
+)
+
+# Deferred explainability queue: niced process pool (with INFERENCE_WORKERS) or niced threads
+explain_pool: Optional[InferenceWorkerPool] = None
+explain_executor: Optional[ThreadPoolExecutor] = None
 
 # =========================================================================
 # FASTAPI LIFECYCLE
 # =========================================================================
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    global model_wrapper, MODEL_DIR  # CRITICAL: Use global variables
-    database.init_db()
-    database.init_analysis_registry()
+def start_model_runtime():
+    """
+    Background startup: resolve/download the model, load it, then start the
+    inference runtime. Runs off the event loop so the port opens immediately
+    (/health = liveness, /ready = readiness).
+    """
+    global inference_pool, explain_pool, explain_executor, MODEL_DIR
     
     # Get model path (downloads from HuggingFace Hub if needed)
-    MODEL_DIR = get_model_path()
+    model_wrapper.set_load_state("downloading")
+    try:
+        MODEL_DIR = get_model_path()
+    except Exception as e:
+        model_wrapper.load_error = str(e)
+        model_wrapper.set_load_state("failed")
+        return
     
-    model_wrapper = MedSigClipWrapper(MODEL_DIR)
+    model_wrapper.model_path = MODEL_DIR
     model_wrapper.load()
-    logger.info("ElephMind Backend Started")
+    if not model_wrapper.loaded:
+        return
+    
+    if INFERENCE_WORKERS > 0:
+        if InferenceWorkerPool.supported():
+            # Fork AFTER load so workers share the weights copy-on-write
+            inference_pool = InferenceWorkerPool(
+                model_wrapper,
+                workers=INFERENCE_WORKERS,
+                torch_threads=INFERENCE_WORKER_THREADS,
+                cv2_threads=INFERENCE_WORKER_CV2_THREADS,
+                max_jobs_per_worker=INFERENCE_WORKER_MAX_JOBS
+            )
+            inference_pool.start()
+        else:
+            logger.warning("⚠️ INFERENCE_WORKERS requires the 'fork' start method. Falling back to in-process inference.")
+    
+    # Micro-batching only applies to in-process inference (worker processes run one job each)
+    if inference_pool is None and INFERENCE_BATCHING:
+        model_wrapper.start_scheduler(INFERENCE_BATCH_WINDOW_MS, INFERENCE_MAX_BATCH)
+
+    # Low-priority explainability queue: separate from classification, never in front of it
+    if EXPLAIN_DEFERRED:
+        if inference_pool:
+            explain_pool = InferenceWorkerPool(
+                model_wrapper,
+                workers=EXPLAIN_WORKERS,
+                torch_threads=INFERENCE_WORKER_THREADS,
+                cv2_threads=INFERENCE_WORKER_CV2_THREADS,
+                max_jobs_per_worker=INFERENCE_WORKER_MAX_JOBS,
+                niceness=EXPLAIN_NICENESS,
+                name="Explainability"
+            )
+            explain_pool.start()
+        else:
+            explain_executor = ThreadPoolExecutor(
+                max_workers=max(1, EXPLAIN_WORKERS),
+                thread_name_prefix="explain",
+                initializer=lower_thread_priority,
+                initargs=(EXPLAIN_NICENESS,)
+            )
+            logger.info(f"🎨 Explainability queue started: {max(1, EXPLAIN_WORKERS)} threads (nice +{EXPLAIN_NICENESS})")
+            if EXPLAIN_NICENESS > 0:
+                # torch's intra-op threads are shared and not niced: heatmaps still compete with classifications
+                logger.warning("⚠️ In-process explainability: only the queue threads are niced, not torch's compute "
+                               "threads. Use INFERENCE_WORKERS > 0 for a low-priority explainability process.")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global model_wrapper  # CRITICAL: Use global variables
+    database.init_db()
+    database.init_analysis_registry()
+    # Before the port opens: /register must never be able to claim "admin" first
+    seed_default_admin()
+    
+    # Model path is resolved in the background (may download from the Hub)
+    model_wrapper = MedSigClipWrapper(None)
+    loop = asyncio.get_event_loop()
+    startup_future = loop.run_in_executor(None, start_model_runtime)
+    startup_future.add_done_callback(requeue_classified_jobs)
+    logger.info("ElephMind Backend Started (model loading in background)")
     yield
+    if not startup_future.done():
+        logger.warning("Shutting down while the model is still loading")
+    if inference_pool:
+        inference_pool.shutdown()
+    if explain_pool:
+        explain_pool.shutdown()
+    if explain_executor:
+        explain_executor.shutdown(wait=False, cancel_futures=True)
+    model_wrapper.stop_scheduler()
     logger.info("ElephMind Backend Shutting Down")
 
 app = FastAPI(
@@ -1475,7 +1950,7 @@ app.add_middleware(
 )
 
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, FileResponse, Response
 from fastapi.encoders import jsonable_encoder
 
 @app.exception_handler(RequestValidationError)
@@ -1506,7 +1981,7 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 @app.middleware("http")
 async def limit_concurrency(request: Request, call_next):
     """Limit concurrent requests to MAX_CONCURRENT_USERS."""
-    if request.url.path == "/health" or request.method == "OPTIONS":
+    if request.url.path in ("/health", "/ready") or request.method == "OPTIONS":
         return await call_next(request)
 
     if concurrency_semaphore.locked():
@@ -1544,16 +2019,26 @@ async def process_analysis_job(job_id: str, image_id: str, username: str):
         # LOAD IMAGE FROM DISK (Physical Read)
         image_bytes, file_path = storage_manager.load_image(username, image_id)
         
-        loop = asyncio.get_event_loop()
-        # Pass username to predict for isolation
-        import functools
-        result = await loop.run_in_executor(None, functools.partial(model_wrapper.predict, image_bytes, username=username))
+        # Pass username to predict for isolation (image_id keys the user's similar cases)
+        explain_now = not (EXPLAIN_DEFERRED and (explain_pool or explain_executor))
+        if inference_pool:
+            result = await inference_pool.predict(image_bytes, username=username, case_id=image_id, explain=explain_now)
+        else:
+            loop = asyncio.get_event_loop()
+            import functools
+            result = await loop.run_in_executor(None, functools.partial(model_wrapper.predict, image_bytes, username=username, case_id=image_id, explain=explain_now))
         
         # Calculate computation time
         computation_time_ms = int((time.time() - start_time) * 1000)
         
-        # Update Job in DB
-        database.update_job_status(job_id, JobStatus.COMPLETED.value, result=result)
+        # Update Job in DB: 'classified' results are visible now, the heatmap follows
+        if result.get('stage') == 'classified':
+            database.update_job_status(job_id, JobStatus.CLASSIFIED.value, result=result)
+            task = asyncio.create_task(explain_analysis_job(job_id, image_id, username, result))
+            explain_tasks.add(task)
+            task.add_done_callback(explain_tasks.discard)
+        else:
+            database.update_job_status(job_id, JobStatus.COMPLETED.value, result=attach_visual_urls(job_id, result))
         
         # Log to registry (REAL DATA)
         if username and result:
@@ -1573,12 +2058,54 @@ async def process_analysis_job(job_id: str, image_id: str, username: str):
             )
             logger.info(f"✅ Job {job_id} logged to registry")
         
-        logger.info(f"✅ Job {job_id} completed in {computation_time_ms}ms")
+        logger.info(f"✅ Job {job_id} {result.get('stage', 'completed')} in {computation_time_ms}ms")
         
     except Exception as e:
         logger.error(f"❌ Job {job_id} failed: {str(e)}")
         database.update_job_status(job_id, JobStatus.FAILED.value, error=str(e))
 
+# Strong references to in-flight explanation tasks (asyncio only keeps weak ones)
+explain_tasks = set()
+
+async def explain_analysis_job(job_id: str, image_id: str, username: str, result: Dict[str, Any]):
+    """
+    Low-priority stage: attach the heatmap to a 'classified' job, then mark it completed.
+    A failure here never fails the job: the classification stays valid without a heatmap.
+    """
+    start_time = time.time()
+    try:
+        image_bytes, _ = storage_manager.load_image(username, image_id)
+        if explain_pool:
+            explained = await explain_pool.explain(image_bytes, result, username=username, case_id=image_id)
+        else:
+            loop = asyncio.get_event_loop()
+            import functools
+            explained = await loop.run_in_executor(explain_executor, functools.partial(model_wrapper.explain, image_bytes, result, username=username, case_id=image_id))
+        logger.info(f"🎨 Job {job_id} explained in {int((time.time() - start_time) * 1000)}ms")
+    except Exception as e:
+        logger.error(f"⚠️ Job {job_id} explanation failed: {str(e)}")
+        explained = dict(result)
+        explained['stage'] = 'explained'
+        explained['explainability'] = dict(result.get('explainability') or {}, error=str(e))
+
+    database.update_job_status(job_id, JobStatus.COMPLETED.value, result=attach_visual_urls(job_id, explained))
+
+def requeue_classified_jobs(startup_future):
+    """
+    Heatmaps queued before a restart or crash only existed as in-memory tasks: queue every job
+    still 'classified' again once the model runtime is up (else /analyze keeps answering
+    "Job already running" for it forever). Runs on the event loop (startup future callback).
+    """
+    if startup_future.cancelled() or startup_future.exception() or not model_wrapper.loaded:
+        return
+    jobs = database.get_classified_jobs()
+    for job in jobs:
+        task = asyncio.create_task(explain_analysis_job(job['id'], job['storage_path'], job['username'], job['result'] or {}))
+        explain_tasks.add(task)
+        task.add_done_callback(explain_tasks.discard)
+    if jobs:
+        logger.info(f"🎨 Requeued {len(jobs)} classified jobs for explanation")
+
 # =========================================================================
 # API ENDPOINTS
 # =========================================================================
@@ -1605,6 +2132,10 @@ class AnalysisRequest(BaseModel):
     image_id: str
     domain: str = "Triage"
     priority: str = "Normale"
+    patient_id: Optional[int] = None  # patients.id (prior-study comparison)
+
+class PatientLink(BaseModel):
+    patient_id: Optional[int] = None  # patients.id, None unlinks
     
 @app.post("/register", status_code=status.HTTP_201_CREATED)
 async def register_user(user: UserRegister):
@@ -1751,17 +2282,22 @@ async def analyze_image(
     except Exception:
         raise HTTPException(status_code=404, detail="Image ID not found. Upload first.")
 
+    if request.patient_id is not None and not database.get_patient(current_user.username, request.patient_id):
+        raise HTTPException(status_code=404, detail="Patient not found")
+
     # --- IDEMPOTENCE CHECK (V4 Backend Authority) ---
     # Check if a job already exists for this image/user
     existing_job = database.get_active_job_by_image(current_user.username, request.image_id)
     
     if existing_job:
         status_val = existing_job.get('status')
+        if request.patient_id is not None and existing_job.get('patient_id') != request.patient_id:
+            database.link_job_patient(existing_job['id'], current_user.username, request.patient_id)
         job_age = time.time() - existing_job.get('created_at', 0)
         
         # If job is running or completed recently (< 24h), return it.
         # This solves the "Refresh = Duplicate Analysis" bug.
-        if status_val in [JobStatus.PENDING.value, JobStatus.PROCESSING.value]:
+        if status_val in [JobStatus.PENDING.value, JobStatus.PROCESSING.value, JobStatus.CLASSIFIED.value]:
              logger.info(f"♻️ Returning EXISTING running job {existing_job['id']} for image {request.image_id}")
              return {
                 "task_id": existing_job['id'], 
@@ -1790,7 +2326,8 @@ async def analyze_image(
         'error': None,
         'storage_path': request.image_id, # Link to storage
         'username': current_user.username,
-        'file_type': 'Unknown'
+        'file_type': 'Unknown',
+        'patient_id': request.patient_id
     }
     database.create_job(job_data)
     
@@ -1861,13 +2398,14 @@ async def get_current_state(current_user: User = Depends(get_current_user)):
     if created_at and (time.time() - created_at) > 86400:  # 24 hours
         return {"state": "IDLE", "message": "Dernière analyse trop ancienne"}
     
-    if job_status in ['pending', 'processing']:
+    if job_status in ['pending', 'processing', 'classified']:
         return {
             "state": "ANALYZING",
             "job_id": job_id,
             "task_id": job_id,  # Alias for frontend compatibility
             "image_id": latest_job.get('storage_path'),
             "started_at": created_at,
+            "result": latest_job.get('result'),  # Classification already available when 'classified'
             "message": "Analyse en cours..."
         }
     elif job_status == 'completed':
@@ -1920,9 +2458,105 @@ async def get_result(task_id: str, current_user: User = Depends(get_current_user
     logger.info(f"Polling Job {task_id}: Status={job.get('status')}")
     return job
 
+@app.get("/result/{task_id}/versions")
+async def get_result_versions(task_id: str, current_user: User = Depends(get_current_user)):
+    """
+    Re-scored versions of a result (newest first). Version 1 is the original /result.
+    
+    - **Requires authentication**
+    """
+    job = database.get_job(task_id, username=current_user.username)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found or access denied")
+    return {"job_id": task_id, "versions": database.get_result_versions(task_id)}
+
+@app.put("/result/{task_id}/patient")
+async def link_result_patient(task_id: str, link: PatientLink, current_user: User = Depends(get_current_user)):
+    """
+    Link an analysis to a patient (or unlink it with null).
+    
+    - **Requires authentication**
+    """
+    if not database.link_job_patient(task_id, current_user.username, link.patient_id):
+        raise HTTPException(status_code=404, detail="Job or patient not found")
+    return {"job_id": task_id, "patient_id": link.patient_id}
+
+@app.get("/result/{task_id}/priors")
+async def get_prior_studies(task_id: str, limit: int = 3, current_user: User = Depends(get_current_user)):
+    """
+    Nearest prior studies of the same patient and domain, with probability deltas per label_id.
+    Uses stored embeddings and findings (no vision pass).
+    
+    - **Requires authentication**
+    """
+    job = database.get_job(task_id, username=current_user.username)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found or access denied")
+    if not job.get('patient_id'):
+        raise HTTPException(status_code=400, detail="Job is not linked to a patient")
+    if not job.get('domain'):
+        raise HTTPException(status_code=409, detail="Job has no classified result")
+
+    import functools
+    loop = asyncio.get_event_loop()
+    store = model_wrapper.embedding_store if model_wrapper else None
+    return await loop.run_in_executor(None, functools.partial(
+        find_prior_studies, job, current_user.username, store, top_k=max(1, min(limit, 20))
+    ))
+
+def serve_job_visual(task_id: str, name: str, request: Request, username: str):
+    """Stored visual of an owned job. Content never changes for a key: ETag + long private cache."""
+    job = database.get_job(task_id, username=username)
+    visuals = ((job or {}).get('result') or {}).get('visuals') or {}
+    if name not in visuals.get('names', []):
+        raise HTTPException(status_code=404, detail="Visual not found or access denied")
+
+    fmt = visuals['format']
+    etag = f'"{visuals["key"][:32]}-{name}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=31536000, immutable"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    file_path = storage_manager.get_visual_path(username, visuals['image_id'], name, fmt)
+    if not file_path.exists():
+        raise HTTPException(status_code=404, detail="Visual file missing")
+    return FileResponse(file_path, media_type=f"image/{fmt}", headers=headers)
+
+@app.get("/jobs/{task_id}/heatmap")
+async def get_job_heatmap(task_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    """Grad-CAM++ overlay of a job (WebP/JPEG). **Requires authentication**"""
+    return serve_job_visual(task_id, "heatmap", request, current_user.username)
+
+@app.get("/jobs/{task_id}/original")
+async def get_job_original(task_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    """Display-size original image of a job (WebP/JPEG). **Requires authentication**"""
+    return serve_job_visual(task_id, "original", request, current_user.username)
+
+@app.post("/admin/rescore")
+async def admin_rescore(request: RescoreRequest, current_user: User = Depends(get_current_user)):
+    """
+    Re-score stored analyses after a MEDICAL_DOMAINS prompt/label change.
+    Uses the stored pooled embeddings (no vision pass) and writes new result versions.
+    
+    - **Requires admin**
+    """
+    if current_user.username != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    if not model_wrapper or not model_wrapper.loaded:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    
+    import functools
+    loop = asyncio.get_event_loop()
+    summary = await loop.run_in_executor(None, functools.partial(
+        rescore_jobs, model_wrapper, MEDICAL_DOMAINS, localize_analysis_result, calculate_priority_score,
+        username=request.username, limit=request.limit
+    ))
+    database.log_audit(current_user.username, "RESCORE", resource=request.username or "ALL")
+    return summary
+
 @app.get("/health")
 def health_check():
-    """Health check endpoint."""
+    """Liveness probe: answers immediately, even while the model is loading."""
     loaded = model_wrapper.loaded if model_wrapper else False
     return {
         "status": "running", 
@@ -1930,6 +2564,21 @@ def health_check():
         "version": "2.0.0"
     }
 
+@app.get("/ready")
+def readiness_check():
+    """Readiness probe: 200 once the model can serve /analyze, 503 with load progress otherwise."""
+    if not model_wrapper:
+        return JSONResponse(status_code=503, content={"ready": False, "state": "pending"})
+    
+    body = {
+        "ready": model_wrapper.loaded and model_wrapper.load_state == "ready",
+        "state": model_wrapper.load_state,
+        "state_elapsed_s": round(time.time() - model_wrapper.load_state_since, 1),
+        "error": model_wrapper.load_error,
+        "warmup": model_wrapper.warmup_report
+    }
+    return JSONResponse(status_code=200 if body["ready"] else 503, content=body)
+
 @app.get("/", include_in_schema=False)
 async def root():
     """Redirect root to docs."""
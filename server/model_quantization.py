@@ -0,0 +1,64 @@
+import logging
+import os
+from typing import Dict, List
+
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger("ElephMind-Quantization")
+
+# =========================================================================
+# INT8 DYNAMIC QUANTIZATION
+# =========================================================================
+# Dynamic int8 quantization of the SigLIP Linear layers (weights int8,
+# activations quantized on the fly). ~4x smaller Linear weights on CPU.
+#
+# Dynamic quantized Linear layers have no autograd. Grad-CAM++ back-propagates
+# from the logits down to encoder layer -2, so the last two vision encoder
+# layers and the pooling head stay fp32 to keep explainability working.
+
+GRADCAM_FP32_TAIL_LAYERS = 2
+
+
+def _fp32_prefixes(model) -> List[str]:
+    """Module name prefixes kept in fp32 (Grad-CAM backward path)."""
+    prefixes = ["vision_model.head"]
+    try:
+        num_layers = len(model.vision_model.encoder.layers)
+        for i in range(max(0, num_layers - GRADCAM_FP32_TAIL_LAYERS), num_layers):
+            prefixes.append(f"vision_model.encoder.layers.{i}.")
+    except AttributeError:
+        pass
+    return prefixes
+
+
+def quantize_int8(model):
+    """Apply dynamic int8 quantization to every eligible nn.Linear of the model."""
+    keep_fp32 = _fp32_prefixes(model)
+    qconfig_spec: Dict[str, object] = {}
+    skipped = 0
+
+    for name, module in model.named_modules():
+        if not isinstance(module, nn.Linear):
+            continue
+        if any(name.startswith(prefix) for prefix in keep_fp32):
+            skipped += 1
+            continue
+        qconfig_spec[name] = torch.ao.quantization.default_dynamic_qconfig
+
+    quantized = torch.ao.quantization.quantize_dynamic(model, qconfig_spec=qconfig_spec, dtype=torch.qint8, inplace=True)
+    logger.info(f"🗜️ INT8 dynamic quantization: {len(qconfig_spec)} Linear layers quantized, {skipped} kept fp32 for Grad-CAM")
+    return quantized
+
+
+def current_rss_mb() -> float:
+    """Resident set size of this process in MB (Linux /proc, fallback to peak RSS)."""
+    try:
+        with open(f"/proc/{os.getpid()}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
@@ -0,0 +1,79 @@
+import logging
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+import database
+from similar_cases import normalize
+
+logger = logging.getLogger("ElephMind-PriorStudies")
+
+# =========================================================================
+# PRIOR STUDIES
+# =========================================================================
+# Compares a study with the same patient's previous ones WITHOUT any vision
+# pass. Jobs are linked to patients.id and carry their domain key and
+# per-label probabilities (jobs.findings, latest scoring), looked up through
+# the (patient_id, domain, created_at) index. Pooled embeddings come from the
+# embedding store (jobs.storage_path is the image_id).
+#
+# Priors are ranked by cosine similarity to the current study (the same
+# view / projection ranks first); priors without a stored embedding follow,
+# newest first.
+
+
+def pooled_embedding(store, username: str, image_id: str) -> Optional[np.ndarray]:
+    if store is None or not image_id:
+        return None
+    stored = store.get(username, image_id)
+    if not stored or 'image_embeds' not in stored:
+        return None
+    return normalize(stored['image_embeds'])
+
+
+def probability_deltas(current: Dict[str, float], prior: Dict[str, float]) -> List[Dict[str, Any]]:
+    """current - prior per label_id present in both, largest change first."""
+    deltas = [
+        {
+            "label_id": label_id,
+            "current": round(float(current[label_id]), 2),
+            "prior": round(float(prior[label_id]), 2),
+            "delta": round(float(current[label_id]) - float(prior[label_id]), 2)
+        }
+        for label_id in current if label_id in prior
+    ]
+    deltas.sort(key=lambda d: abs(d['delta']), reverse=True)
+    return deltas
+
+
+def find_prior_studies(job: Dict[str, Any], username: str, store, top_k: int = 3, search_limit: int = 50) -> Dict[str, Any]:
+    """Nearest prior studies of the job's patient in the job's domain, with probability deltas."""
+    studies = database.get_patient_studies(username, job['patient_id'], job['domain'],
+                                           before=job['created_at'], limit=search_limit)
+    current_findings = job.get('findings') or {}
+    query = pooled_embedding(store, username, job.get('storage_path'))
+
+    priors = []
+    for study in studies:
+        unit = pooled_embedding(store, username, study['storage_path']) if query is not None else None
+        findings = study.get('findings') or {}
+        top_label = max(findings, key=findings.get) if findings else None
+        priors.append({
+            "job_id": study['id'],
+            "image_id": study['storage_path'],
+            "created_at": study['created_at'],
+            "interval_days": round((job['created_at'] - study['created_at']) / 86400, 1),
+            "similarity": round(float(unit @ query) * 100, 1) if unit is not None else None,
+            "top_finding": {"label_id": top_label, "probability": findings[top_label]} if top_label else None,
+            "deltas": probability_deltas(current_findings, findings)
+        })
+
+    priors.sort(key=lambda p: (p['similarity'] is not None, p['similarity'] or 0.0, p['created_at']), reverse=True)
+    logger.info(f"🗂️ Prior studies for job {job['id']}: {len(studies)} searched, {min(top_k, len(priors))} returned")
+    return {
+        "job_id": job['id'],
+        "patient_id": job['patient_id'],
+        "domain": job['domain'],
+        "priors_searched": len(studies),
+        "priors": priors[:top_k]
+    }
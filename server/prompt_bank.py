@@ -0,0 +1,257 @@
+import gc
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger("ElephMind-PromptBank")
+
+# =========================================================================
+# TEXT EMBEDDING BANK
+# =========================================================================
+# The prompts in MEDICAL_DOMAINS are fixed English strings. Encoding them
+# through the text tower on every request is pure waste: we encode them once
+# at load() and every zero-shot stage becomes a single matmul.
+
+DOMAINS_GROUP = "domains"
+DEFAULT_TEXT_BANK_FILENAME = "text_bank.pt"  # Offline export (export_text_bank.py), inside the model dir
+
+
+def prompt_config_hash(domains: Dict[str, Any]) -> str:
+    """Stable short hash of a prompt configuration (MEDICAL_DOMAINS)."""
+    payload = json.dumps(domains, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def bank_version(domains: Dict[str, Any], extra_prompts: Sequence[str] = ()) -> str:
+    """Version of everything the bank encodes (MEDICAL_DOMAINS + explainability prompts)."""
+    if not extra_prompts:
+        return prompt_config_hash(domains)
+    return prompt_config_hash({"domains": domains, "extra_prompts": sorted(extra_prompts)})
+
+
+def group_key(domain_key: str, stage: str) -> str:
+    """Bank key for one stage of one domain, e.g. 'Thoracic/logic_gate'."""
+    return f"{domain_key}/{stage}"
+
+
+def collect_prompt_groups(domains: Dict[str, Any]) -> Dict[str, List[str]]:
+    """
+    Flatten MEDICAL_DOMAINS into ordered prompt groups.
+    Order inside a group matches the order used to index probabilities.
+    """
+    groups = {DOMAINS_GROUP: [cfg['domain_prompt'] for cfg in domains.values()]}
+
+    for key, cfg in domains.items():
+        if 'logic_gate' in cfg:
+            groups[group_key(key, 'logic_gate')] = list(cfg['logic_gate']['labels'])
+        if 'stage_1_triage' in cfg:
+            groups[group_key(key, 'stage_1_triage')] = list(cfg['stage_1_triage']['labels'])
+        if 'stage_2_diagnosis' in cfg:
+            groups[group_key(key, 'stage_2_diagnosis')] = [l['label_en'] for l in cfg['stage_2_diagnosis']['labels']]
+        if 'specific_labels' in cfg:
+            groups[group_key(key, 'specific_labels')] = [l['label_en'] for l in cfg['specific_labels']]
+
+    return groups
+
+
+class TextEmbeddingBank:
+    """
+    Normalized text embeddings for every prompt group, plus the model's
+    logit scale/bias so that logits can be reproduced without the text tower.
+    """
+
+    def __init__(self, model, processor):
+        self.model = model
+        self.processor = processor
+        self.version: Optional[str] = None
+        self.prompts: Dict[str, List[str]] = {}
+        self.embeddings: Dict[str, torch.Tensor] = {}
+        self._encoded: Dict[str, torch.Tensor] = {}  # prompt -> (D,), survives rebuilds
+        self.extra_prompts: List[str] = []  # Not scored, looked up by text (explainability)
+        self.logit_scale = 1.0
+        self.logit_bias = 0.0
+        self._lock = threading.RLock()  # build() / ensure_current() / vectors() mutate the bank
+
+    @property
+    def text_tower_loaded(self) -> bool:
+        return getattr(self.model, 'text_model', None) is not None
+
+    def encode_texts(self, prompts: List[str]) -> torch.Tensor:
+        """Encode prompts through the text tower -> (N, D) L2-normalized."""
+        if not self.text_tower_loaded:
+            raise RuntimeError(
+                f"Text tower not loaded (vision-only mode) and {len(prompts)} prompt(s) missing from the text bank file, "
+                f"e.g. {prompts[0]!r}. Re-run export_text_bank.py."
+            )
+        inputs = self.processor(text=prompts, padding="max_length", return_tensors="pt")
+        inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
+        with torch.no_grad():
+            text_embeds = self.model.get_text_features(**inputs)
+        return text_embeds / text_embeds.norm(p=2, dim=-1, keepdim=True)
+
+    def build(self, domains: Dict[str, Any], extra_prompts: Optional[Sequence[str]] = None):
+        """Encode every prompt of the configuration once (deduplicated). On rebuilds only new/changed prompts are encoded."""
+        with self._lock:
+            self._build(domains, extra_prompts)
+
+    def _build(self, domains: Dict[str, Any], extra_prompts: Optional[Sequence[str]]):
+        groups = collect_prompt_groups(domains)
+        if extra_prompts is not None:
+            self.extra_prompts = list(dict.fromkeys(extra_prompts))
+
+        unique_prompts = list(dict.fromkeys([p for prompts in groups.values() for p in prompts] + self.extra_prompts))
+        missing = [p for p in unique_prompts if p not in self._encoded]
+        if missing:
+            for prompt, row in zip(missing, self.encode_texts(missing)):
+                self._encoded[prompt] = row
+        self._encoded = {p: self._encoded[p] for p in unique_prompts}  # Drop removed prompts
+
+        self.prompts = groups
+        self.embeddings = {
+            name: torch.stack([self._encoded[p] for p in prompts])
+            for name, prompts in groups.items()
+        }
+
+        with torch.no_grad():
+            if hasattr(self.model, 'logit_scale'):
+                self.logit_scale = float(self.model.logit_scale.exp())
+            if getattr(self.model, 'logit_bias', None) is not None:
+                self.logit_bias = float(self.model.logit_bias)
+
+        self.version = bank_version(domains, self.extra_prompts)
+        logger.info(f"🧾 Text bank built: {len(unique_prompts)} prompts in {len(groups)} groups, {len(missing)} encoded (version {self.version})")
+
+    def ensure_current(self, domains: Dict[str, Any]):
+        """
+        Rebuild the bank if the prompt configuration changed since load(). Hashes the whole
+        configuration: for explicit checks (re-scoring), never per request.
+        """
+        with self._lock:
+            if self.version != bank_version(domains, self.extra_prompts):
+                logger.info("Prompt configuration changed, rebuilding text bank...")
+                self._build(domains, None)
+
+    def vectors(self, prompts: Sequence[str]) -> torch.Tensor:
+        """(N, D) normalized embeddings of arbitrary prompts (encoded on first use if the text tower is loaded)."""
+        with self._lock:
+            missing = [p for p in dict.fromkeys(prompts) if p not in self._encoded]
+            if missing:
+                for prompt, row in zip(missing, self.encode_texts(missing)):
+                    self._encoded[prompt] = row
+            return torch.stack([self._encoded[p] for p in prompts])
+
+    # --- Offline file (vision-only workers) ---
+
+    def save(self, path: str):
+        prompts = list(self._encoded)
+        torch.save({
+            "prompts": prompts,
+            "embeddings": torch.stack([self._encoded[p] for p in prompts]).float().cpu(),
+            "version": self.version,
+        }, path)
+        logger.info(f"💾 Text bank saved: {len(prompts)} prompts -> {path}")
+
+    def load_file(self, path: str):
+        """Seed the bank with an offline export; build() then needs no text tower."""
+        payload = torch.load(path, map_location="cpu")
+        device = self.model.device if self.model is not None else "cpu"
+        embeddings = payload["embeddings"].to(device)
+        self._encoded = {prompt: embeddings[i] for i, prompt in enumerate(payload["prompts"])}
+        logger.info(f"🧾 Text bank file loaded: {len(self._encoded)} prompts (version {payload.get('version')})")
+
+    def logits(self, group: str, image_embeds: torch.Tensor) -> torch.Tensor:
+        """(B, D) normalized image embeddings -> (B, N) logits_per_image for a group."""
+        text_embeds = self.embeddings[group]
+        return image_embeds @ text_embeds.t() * self.logit_scale + self.logit_bias
+
+
+def drop_text_tower(model) -> int:
+    """
+    Free the text tower (and CLIP text projection) once every prompt is in the bank.
+    Returns the number of parameters released.
+    """
+    released = 0
+    for name in ("text_model", "text_projection"):
+        module = getattr(model, name, None)
+        if isinstance(module, nn.Module):
+            released += sum(p.numel() for p in module.parameters())
+            setattr(model, name, None)
+    gc.collect()
+    return released
+
+
+# --- Vision-only load (no text tower ever materialized) ---
+
+# Checkpoint tensors kept next to the vision tower (logits + CLIP-style projection)
+VISION_HEAD_TENSORS = ("logit_scale", "logit_bias", "visual_projection.weight")
+
+
+class VisionOnlyModel(nn.Module):
+    """vision_model + logit parameters of a SigLIP/CLIP checkpoint, with the attribute names the full model has."""
+
+    def __init__(self, vision_model: nn.Module, tensors: Dict[str, torch.Tensor]):
+        super(VisionOnlyModel, self).__init__()
+        self.vision_model = vision_model
+        self.logit_scale = nn.Parameter(tensors.get("logit_scale", torch.tensor(0.0)).float(), requires_grad=False)
+        if "logit_bias" in tensors:
+            self.logit_bias = nn.Parameter(tensors["logit_bias"].float(), requires_grad=False)
+        else:
+            self.logit_bias = None
+        if "visual_projection.weight" in tensors:
+            weight = tensors["visual_projection.weight"].float()
+            self.visual_projection = nn.Linear(weight.shape[1], weight.shape[0], bias=False)
+            self.visual_projection.weight.data.copy_(weight)
+        self.text_model = None
+
+    @property
+    def device(self) -> torch.device:
+        return next(self.parameters()).device
+
+
+def _checkpoint_tensors(model_path: str, names: Sequence[str]) -> Optional[Dict[str, torch.Tensor]]:
+    """Read single tensors from the safetensors checkpoint (None without safetensors files)."""
+    try:
+        from safetensors import safe_open
+    except ImportError:
+        return None
+    index_path = os.path.join(model_path, "model.safetensors.index.json")
+    if os.path.exists(index_path):
+        with open(index_path, "r") as f:
+            weight_map = json.load(f)["weight_map"]
+    elif os.path.exists(os.path.join(model_path, "model.safetensors")):
+        weight_map = {name: "model.safetensors" for name in names}
+    else:
+        return None
+
+    tensors = {}
+    for name in names:
+        if name not in weight_map:
+            continue
+        with safe_open(os.path.join(model_path, weight_map[name]), framework="pt") as f:
+            if name in f.keys():
+                tensors[name] = f.get_tensor(name)
+    return tensors
+
+
+def load_vision_only(model_path: str) -> Optional[nn.Module]:
+    """
+    Vision tower + logit parameters only: text weights are never read from disk.
+    None if the checkpoint type / format is not supported (caller loads the full model).
+    """
+    from transformers import AutoConfig, CLIPVisionModel, SiglipVisionModel
+
+    model_type = AutoConfig.from_pretrained(model_path, local_files_only=True).model_type
+    vision_classes = {"siglip": SiglipVisionModel, "clip": CLIPVisionModel}
+    tensors = _checkpoint_tensors(model_path, VISION_HEAD_TENSORS)
+    if model_type not in vision_classes or tensors is None:
+        return None
+
+    # Loads the vision_model.* keys of the full checkpoint, text keys are skipped unread
+    vision = vision_classes[model_type].from_pretrained(model_path, local_files_only=True)
+    return VisionOnlyModel(vision.vision_model, tensors)
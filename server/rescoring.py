@@ -0,0 +1,228 @@
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+import database
+from prompt_bank import DOMAINS_GROUP, group_key
+
+logger = logging.getLogger("ElephMind-Rescoring")
+
+# =========================================================================
+# RETROACTIVE RE-SCORING
+# =========================================================================
+# When a label_en prompt changes or a label is added to MEDICAL_DOMAINS,
+# stored results go stale. Re-running the model is not needed: the zero-shot
+# stages only depend on the pooled image embedding (kept in the embedding
+# store) and the text bank. We rebuild the bank (only changed prompts are
+# re-encoded) and replay the predict rules with one matmul per prompt group
+# for ALL images of a domain at once.
+#
+# The rules below mirror MedSigClipWrapper._run_pipeline: domain argmax,
+# logic gate, orthopedic triage -> stage 2, CTR penalty (from the stored
+# morphology), calibrated confidence, priority. Vision-dependent parts
+# (heatmap, morphology, QC) are carried over from the previous result.
+#
+# Results are written as NEW versions (result_versions table). jobs.result
+# (version 1) is never overwritten.
+
+GATE_THRESHOLD = 0.5
+RESCORE_BATCH_SIZE = 200  # Jobs per page: bounds memory (old results may hold base64 images)
+CTR_CARDIOMEGALY = 0.55
+CTR_PENALTY_FACTOR = 0.1
+GATE_PENALTY_FACTOR = 0.15
+
+
+def penalty_applies(target: str, label_text: str, label_id: str) -> bool:
+    """Does a logic penalty target hit this label? (shared with predict)"""
+    if target == 'ALL_DIAGNOSIS':
+        return not ("Artifact" in label_text or "Quality" in label_text or "Partial" in label_text or "Empty" in label_text)
+    if target == 'ALL_PATHOLOGY':
+        is_benign = "Normal" in label_text or "Healthy" in label_text or "Non-specific" in label_text or "Benign" in label_text
+        return not is_benign
+    return target == label_id or target in label_text
+
+
+def confidence_metadata(sorted_probs: List[float]) -> Dict[str, Any]:
+    """Margin-based confidence of a sorted (desc) probability list (predict's CALIBRATED CONFIDENCE block)."""
+    if len(sorted_probs) < 2:
+        return {"margin": 100.0, "uncertainty_flag": False, "level": "High"}
+    margin = sorted_probs[0] - sorted_probs[1]
+    level = "High" if margin >= 15.0 else "Moderate" if margin >= 5.0 else "Low"
+    return {"margin": round(margin, 2), "uncertainty_flag": margin < 10.0, "level": level}
+
+
+def calibrated_confidence(top_probability: float, qc_score: float, reliability: float) -> Dict[str, Any]:
+    """Model x QC x Explainability (predict's STRICT CONFIDENCE CALIBRATION); reliability 0 = not applicable."""
+    calibrated = round(float(top_probability) / 100.0 * qc_score * (reliability or 1.0) * 100, 2)
+    level = "High" if calibrated > 85 else "Moderate" if calibrated > 50 else "Low"
+    return {"calibrated_confidence": calibrated, "confidence": calibrated, "confidence_level": level}
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class BankScorer:
+    """NumPy view of a TextEmbeddingBank: (N, D) embeddings -> (N, labels) probabilities per group."""
+
+    def __init__(self, text_bank):
+        self.scale = text_bank.logit_scale
+        self.bias = text_bank.logit_bias
+        self.text = {name: emb.detach().float().cpu().numpy() for name, emb in text_bank.embeddings.items()}
+
+    def probs(self, group: str, embeds: np.ndarray) -> np.ndarray:
+        return _softmax(embeds @ self.text[group].T * self.scale + self.bias)
+
+
+def rescore_embeddings(embeds: np.ndarray, previous: List[Dict[str, Any]], scorer: BankScorer,
+                       domains: Dict[str, Any], priority_fn: Callable[[List[Dict], str], str]) -> List[Dict[str, Any]]:
+    """
+    Vectorized replay of the zero-shot stages.
+    embeds: (N, D) normalized pooled embeddings; previous: the N previous results.
+    Returns N un-localized results (English labels, like predict before localization).
+    """
+    domain_keys = list(domains.keys())
+    probs_domain = scorer.probs(DOMAINS_GROUP, embeds)
+    best = probs_domain.argmax(axis=1)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(embeds)
+
+    for d, domain_key in enumerate(domain_keys):
+        rows = np.flatnonzero(best == d)
+        if rows.size == 0:
+            continue
+        cfg = domains[domain_key]
+        sub = embeds[rows]
+
+        # Stage selection (triage rows without abnormality get no specific labels)
+        if 'stage_1_triage' in cfg:
+            items = cfg['stage_2_diagnosis']['labels']
+            has_specific = scorer.probs(group_key(domain_key, 'stage_1_triage'), sub)[:, -1] > 0.5
+            probs = scorer.probs(group_key(domain_key, 'stage_2_diagnosis'), sub)
+        else:
+            items = cfg['specific_labels']
+            has_specific = np.ones(rows.size, dtype=bool)
+            probs = scorer.probs(group_key(domain_key, 'specific_labels'), sub)
+        pct = np.round(probs * 100, 2)
+
+        # Logic penalties: factor per row, label mask per target
+        factor = np.ones(rows.size)
+        targets = np.full(rows.size, None, dtype=object)
+        if 'logic_gate' in cfg:
+            gate = cfg['logic_gate']
+            p_gate = scorer.probs(group_key(domain_key, 'logic_gate'), sub)[:, gate.get('abnormal_index', 1)]
+            triggered = p_gate > GATE_THRESHOLD
+            factor[triggered] = GATE_PENALTY_FACTOR
+            targets[triggered] = gate.get('penalty_target', 'Normal')
+        if domain_key == 'Thoracic':
+            for j, row in enumerate(rows):
+                morphology = previous[row].get('morphology') or {}
+                if morphology.get('valid') and (morphology.get('ctr') or 0) > CTR_CARDIOMEGALY:
+                    factor[j] = CTR_PENALTY_FACTOR
+                    targets[j] = 'TH_NORMAL'
+
+        for target in set(t for t in targets if t):
+            mask = np.array([penalty_applies(target, item['label_en'], item['id']) for item in items])
+            hit = (targets == target)[:, None] & mask[None, :]
+            pct = np.where(hit, np.round(pct * factor[:, None], 2), pct)
+
+        order = np.argsort(-pct, axis=1, kind='stable')
+
+        for j, row in enumerate(rows):
+            specific = []
+            if has_specific[j]:
+                specific = [
+                    {"label_id": items[k]['id'], "label": items[k]['label_en'], "probability": float(pct[j, k])}
+                    for k in order[j]
+                ]
+            results[row] = _assemble(previous[row], domain_key, domains, float(probs_domain[row, d] * 100), specific, priority_fn)
+
+    return results
+
+
+def _assemble(previous: Dict[str, Any], domain_key: str, domains: Dict[str, Any], domain_prob: float,
+              specific: List[Dict[str, Any]], priority_fn: Callable[[List[Dict], str], str]) -> Dict[str, Any]:
+    """New result = previous vision-side fields + re-scored zero-shot fields (predict's formulas)."""
+    result = dict(previous)
+    result['domain'] = {
+        "label": domain_key,
+        "key": domain_key,
+        "description": domains[domain_key]['domain_prompt'],
+        "probability": round(domain_prob, 2),
+    }
+    result['specific'] = specific
+    result['confidence_metadata'] = confidence_metadata([s['probability'] for s in specific])
+    result.pop('diagnosis', None)
+
+    top = specific[0] if specific else {"label": "Inconnu", "probability": 0, "label_id": "UNKNOWN"}
+    result['diagnosis_id'] = top['label_id']
+
+    qc_score = float((previous.get('image_quality') or {}).get('overall_score', 0))
+    reliability = float((previous.get('explainability') or {}).get('reliability', 1.0))
+    result.update(calibrated_confidence(top['probability'], qc_score, reliability))
+
+    result['predictions'] = [{"name": s['label'], "probability": s['probability']} for s in specific]
+    result['priority'] = priority_fn(specific, domain_key)
+    return result
+
+
+def rescore_jobs(wrapper, domains: Dict[str, Any], localize_fn: Callable[[Dict], Dict],
+                 priority_fn: Callable[[List[Dict], str], str], username: Optional[str] = None,
+                 limit: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Re-score completed jobs from their stored pooled embeddings and write new result versions.
+    Jobs without a stored embedding (QC rejected, analyzed before the store existed) are skipped.
+    """
+    started = time.time()
+    wrapper.text_bank.ensure_current(domains)  # Re-encodes only the changed prompts
+    prompt_version = wrapper.text_bank.version
+    scorer = BankScorer(wrapper.text_bank)
+
+    jobs_seen, rescored, skipped, changed = 0, 0, 0, 0
+    after = None
+    while limit is None or jobs_seen < limit:
+        batch_size = RESCORE_BATCH_SIZE if limit is None else min(RESCORE_BATCH_SIZE, limit - jobs_seen)
+        jobs = database.get_completed_jobs_page(username=username, after=after, batch_size=batch_size)
+        if not jobs:
+            break
+        jobs_seen += len(jobs)
+        after = (jobs[-1]['created_at'], jobs[-1]['id'])
+        latest_versions = database.get_latest_prompt_versions([job['id'] for job in jobs])
+
+        selected, embeds = [], []
+        for job in jobs:
+            result = job.get('result') or {}
+            stored = wrapper.embedding_store.get(job['username'], job['storage_path']) if wrapper.embedding_store else None
+            if stored is None or 'image_embeds' not in stored or result.get('qc_passed') is False:
+                skipped += 1
+                continue
+            scored_with = latest_versions[job['id']] if job['id'] in latest_versions else result.get('prompt_version')
+            if scored_with == prompt_version:
+                skipped += 1  # Already scored with this prompt configuration
+                continue
+            selected.append(job)
+            embeds.append(np.asarray(stored['image_embeds'], dtype=np.float32))
+
+        if selected:
+            previous = [job['result'] for job in selected]
+            rescored_batch = rescore_embeddings(np.stack(embeds), previous, scorer, domains, priority_fn)
+            for job, prev, new in zip(selected, previous, rescored_batch):
+                new['rescore'] = {"prompt_version": prompt_version, "rescored_at": time.time()}
+                new = localize_fn(new)
+                changed += int((new.get('specific') or [{}])[0].get('label_id') != (prev.get('specific') or [{}])[0].get('label_id'))
+                database.add_result_version(job['id'], new, prompt_version)
+            rescored += len(selected)
+
+    summary = {
+        "prompt_version": prompt_version,
+        "jobs_seen": jobs_seen,
+        "rescored": rescored,
+        "skipped": skipped,
+        "top_label_changed": changed,
+        "elapsed_s": round(time.time() - started, 2),
+    }
+    logger.info(f"🔁 Re-scoring done: {summary}")
+    return summary
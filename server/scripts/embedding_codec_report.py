@@ -0,0 +1,72 @@
+# Recall / memory trade-off of the similar-case embedding codecs against float32.
+#
+#   PYTHONPATH=.. python embedding_codec_report.py                          # synthetic clustered embeddings
+#   PYTHONPATH=.. python embedding_codec_report.py --embeddings pooled.npy  # real (n, dim) pooled embeddings
+#   PYTHONPATH=.. python embedding_codec_report.py --pq-subvectors 144 288 576
+#
+# For each codec: bytes per case, compression vs float32, recall@k and top-1
+# agreement of the ranking against exact float32 search, mean |cosine error|
+# of the returned scores, p50 scan latency.
+
+import argparse
+import time
+
+import numpy as np
+
+from similar_cases import top_k_rows
+from similar_cases_benchmark import make_queries, synthetic_embeddings
+from vector_codecs import make_codec
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Similar-case embedding codecs: recall vs memory.")
+    parser.add_argument("--embeddings", default=None, help=".npy (n, dim) embeddings (default: synthetic)")
+    parser.add_argument("--cases", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1152)
+    parser.add_argument("--clusters", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--pq-subvectors", nargs="+", type=int, default=[0], help="0 = dim / 4")
+    parser.add_argument("--pq-train", type=int, default=4096, help="Cases used to train PQ codebooks")
+    args = parser.parse_args()
+
+    if args.embeddings:
+        vectors = np.load(args.embeddings).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    else:
+        vectors = synthetic_embeddings(args.cases, args.dim, args.clusters)
+    n, dim = vectors.shape
+    queries = make_queries(vectors, args.queries)
+    exact = [top_k_rows(vectors @ q, args.top_k) for q in queries]
+
+    codecs = [make_codec(name, dim) for name in ("float32", "float16", "int8")]
+    codecs += [make_codec("pq", dim, pq_subvectors=m, pq_train_rows=args.pq_train) for m in args.pq_subvectors]
+
+    print(f"{n} cases x {dim} dims, {args.queries} queries, top-{args.top_k}")
+    print(f"{'codec':<10} {'B/case':>7} {'ratio':>6} {'total MB':>9} {f'recall@{args.top_k}':>9} {'top-1':>6} {'|cos err|':>10} {'p50 ms':>7}")
+    for codec in codecs:
+        if codec.needs_training:
+            start = time.perf_counter()
+            codec.train(vectors[np.random.default_rng(0).choice(n, min(n, args.pq_train), replace=False)])
+            train_s = time.perf_counter() - start
+        codes = codec.encode(vectors)
+
+        recalls, top1, errors, timings = [], [], [], []
+        for q, truth in zip(queries, exact):
+            start = time.perf_counter()
+            scores = codec.scores(codes, q)
+            found = top_k_rows(scores, args.top_k)
+            timings.append((time.perf_counter() - start) * 1000)
+            recalls.append(len(set(found.tolist()) & set(truth.tolist())) / len(truth))
+            top1.append(found[0] == truth[0])
+            errors.append(float(np.abs(scores[found] - vectors[found] @ q).mean()))
+
+        label = codec.name if not codec.needs_training else f"pq/{codec.m}"
+        print(f"{label:<10} {codec.row_bytes:>7} {4 * dim / codec.row_bytes:>5.1f}x {codes.nbytes / 1e6:>9.1f}"
+              f" {np.mean(recalls):>9.3f} {np.mean(top1):>6.3f} {np.mean(errors):>10.4f} {np.median(timings):>7.2f}")
+        if codec.needs_training:
+            print(f"{'':<10} codebooks: {codec.codebooks.nbytes / 1e6:.1f} MB per partition, trained in {train_s:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
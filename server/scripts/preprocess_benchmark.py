@@ -0,0 +1,112 @@
+# Microbenchmark: upload bytes -> QC -> pixel_values -> overlay inputs, legacy vs zero-copy pipeline.
+#
+#   PYTHONPATH=.. python preprocess_benchmark.py                       # synthetic JPEGs (1024, 2048, 4000 px)
+#   PYTHONPATH=.. python preprocess_benchmark.py photo1.jpg photo2.png --model-dir "/path/to/oeil d'elephant"
+#
+# Allocations are measured with tracemalloc (NumPy buffers are traced; PIL and torch
+# internal buffers are not, so the legacy figures are lower bounds).
+
+import argparse
+import hashlib
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from explainability import display_rgb
+from image_pipeline import PixelPreprocessor, rgb_array
+from inference_cache import image_content_hash
+from main import assess_image_quality, full_resolution_sharpness, process_standard_image
+
+
+def synthetic_jpeg(long_side):
+    """Smooth gradients + mild noise, 4:3, encoded like a camera JPEG."""
+    h, w = long_side * 3 // 4, long_side
+    rng = np.random.default_rng(long_side)
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    base = 128 + 60 * np.sin(xx / 97.0) * np.cos(yy / 131.0)
+    img = np.clip(np.stack([base, base * 0.8, base * 0.6], axis=-1) + rng.normal(0, 6, (h, w, 3)), 0, 255).astype(np.uint8)
+    ok, buffer = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 92])
+    return f"synthetic {w}x{h}", buffer.tobytes()
+
+
+def legacy_path(image_bytes, processor):
+    """The previous request path: PIL round trips and np.array copies at every stage."""
+    img_cv = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    image = Image.fromarray(cv2.cvtColor(img_cv, cv2.COLOR_BGR2RGB))
+    assess_image_quality(np.array(image))                                          # QC copy
+    hashlib.sha256(image.tobytes()).hexdigest()                                    # Cache key copy
+    pixel_values = processor(images=[image], return_tensors="pt")["pixel_values"]  # PIL resize + float copies
+    overlay = np.asarray(image.convert("RGB")).astype(np.float32) / 255.0           # Explanation overlay
+    original = (np.array(image).astype(np.float32) / 255.0 * 255).astype(np.uint8)  # Original image PNG
+    return pixel_values, overlay, original
+
+
+def zero_copy_path(image_bytes, preprocessor, full_resolution):
+    """Current path: one decoded buffer shared by every stage."""
+    image = process_standard_image(image_bytes, full_resolution=full_resolution)
+    assess_image_quality(rgb_array(image), original_size=image.info.get("original_size"),
+                         sharpness=full_resolution_sharpness(image))
+    image_content_hash(image)
+    pixel_values = preprocessor([image])
+    overlay = display_rgb(image).astype(np.float32) / 255.0
+    original = display_rgb(image)
+    return pixel_values, overlay, original
+
+
+def measure(fn, repeat):
+    fn()  # Warm caches / lazy imports
+    tracemalloc.start()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"ms_p50": float(np.median(timings)), "peak_mb": peak / 1e6}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Allocation / latency of the image preprocessing pipeline.")
+    parser.add_argument("images", nargs="*", help="PNG/JPEG files (default: synthetic JPEGs)")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1024, 2048, 4000], help="Synthetic long sides")
+    parser.add_argument("--model-dir", default=None, help="Processor config source (default: SigLIP 448x448 defaults)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.model_dir:
+        from transformers import AutoProcessor
+        processor = AutoProcessor.from_pretrained(args.model_dir, local_files_only=True)
+    else:
+        from transformers import SiglipImageProcessor
+        processor = SiglipImageProcessor(size={"height": 448, "width": 448})
+    preprocessor = PixelPreprocessor.from_processor(processor)
+
+    if args.images:
+        inputs = []
+        for path in args.images:
+            with open(path, "rb") as f:
+                inputs.append((path, f.read()))
+    else:
+        inputs = [synthetic_jpeg(size) for size in args.sizes]
+
+    print(f"{'image':<28} {'path':<22} {'p50 ms':>8} {'peak MB':>9}")
+    for name, image_bytes in inputs:
+        legacy = measure(lambda: legacy_path(image_bytes, processor), args.repeat)
+        full = measure(lambda: zero_copy_path(image_bytes, preprocessor, True), args.repeat)
+        reduced = measure(lambda: zero_copy_path(image_bytes, preprocessor, False), args.repeat)
+        for label, stats in (("legacy", legacy), ("zero-copy", full), ("zero-copy + reduced", reduced)):
+            print(f"{name:<28} {label:<22} {stats['ms_p50']:>8.1f} {stats['peak_mb']:>9.1f}")
+        print(f"{'':<28} {'peak reduction':<22} {'':>8} {legacy['peak_mb'] / max(full['peak_mb'], 1e-6):>8.1f}x"
+              f" / {legacy['peak_mb'] / max(reduced['peak_mb'], 1e-6):.1f}x")
+
+        # Same model input up to resampling differences
+        drift = float((legacy_path(image_bytes, processor)[0] - zero_copy_path(image_bytes, preprocessor, True)[0]).abs().max())
+        print(f"{'':<28} {'max |pixel_values| diff':<22} {drift:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# Script to compare fp32 vs INT8 dynamic-quantized inference on a labeled folder.
+#
+# Folder layout: <folder>/<Domain>/<images>  (Domain = MEDICAL_DOMAINS key, e.g. Thoracic)
+#
+#   PYTHONPATH=.. python quantization_report.py /path/to/labeled_folder --model-dir "/path/to/oeil d'elephant"
+#
+# Each mode runs in its own subprocess so that RSS figures are not polluted by the other model.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+def list_labeled_images(folder, limit_per_domain):
+    items = []
+    for domain in sorted(os.listdir(folder)):
+        domain_dir = os.path.join(folder, domain)
+        if not os.path.isdir(domain_dir):
+            continue
+        files = sorted(f for f in os.listdir(domain_dir) if f.lower().endswith((".png", ".jpg", ".jpeg")))
+        for name in files[:limit_per_domain]:
+            items.append((domain, os.path.join(domain_dir, name)))
+    return items
+
+
+def run_mode(mode, folder, model_dir, limit_per_domain, out_path):
+    """Runs inside a subprocess: load one model variant and score every image."""
+    from PIL import Image
+    from main import MedSigClipWrapper, MEDICAL_DOMAINS
+    from prompt_bank import DOMAINS_GROUP, group_key
+    from model_quantization import current_rss_mb
+
+    rss_before = current_rss_mb()
+    wrapper = MedSigClipWrapper(model_dir, quantize="int8" if mode == "int8" else None)
+    wrapper.load()
+    if not wrapper.loaded:
+        raise RuntimeError(wrapper.load_error)
+    rss_loaded = current_rss_mb()
+
+    domain_keys = list(MEDICAL_DOMAINS.keys())
+    records = []
+    for domain, path in list_labeled_images(folder, limit_per_domain):
+        image = Image.open(path).convert("RGB")
+        start = time.perf_counter()
+        ctx = wrapper.build_context(image)
+        probs_domain = wrapper.zero_shot_probs(DOMAINS_GROUP, ctx.image_embeds)
+        # Specific labels of the folder's domain so both modes are compared on the same label set
+        specific = {}
+        if domain in MEDICAL_DOMAINS and 'specific_labels' in MEDICAL_DOMAINS[domain]:
+            probs = wrapper.zero_shot_probs(group_key(domain, 'specific_labels'), ctx.image_embeds)
+            specific = {item['id']: float(probs[i]) for i, item in enumerate(MEDICAL_DOMAINS[domain]['specific_labels'])}
+        latency_ms = (time.perf_counter() - start) * 1000
+
+        records.append({
+            "path": path,
+            "domain": domain,
+            "predicted_domain": domain_keys[int(probs_domain.argmax())],
+            "specific": specific,
+            "latency_ms": latency_ms,
+        })
+
+    with open(out_path, "w") as f:
+        json.dump({
+            "mode": mode,
+            "rss_mb_model": round(rss_loaded - rss_before, 1),
+            "rss_mb_peak": round(current_rss_mb(), 1),
+            "records": records,
+        }, f)
+
+
+def summarize(fp32, int8):
+    report = {"latency_ms": {}, "rss_mb": {}, "domains": {}}
+
+    for run in (fp32, int8):
+        lat = np.array([r["latency_ms"] for r in run["records"]]) if run["records"] else np.zeros(1)
+        report["latency_ms"][run["mode"]] = {"p50": round(float(np.percentile(lat, 50)), 1), "p95": round(float(np.percentile(lat, 95)), 1)}
+        report["rss_mb"][run["mode"]] = {"model": run["rss_mb_model"], "process": run["rss_mb_peak"]}
+
+    by_domain = {}
+    for a, b in zip(fp32["records"], int8["records"]):
+        stats = by_domain.setdefault(a["domain"], {"n": 0, "domain_agree": 0, "specific_agree": 0, "drifts": []})
+        stats["n"] += 1
+        stats["domain_agree"] += int(a["predicted_domain"] == b["predicted_domain"])
+        if a["specific"]:
+            stats["specific_agree"] += int(max(a["specific"], key=a["specific"].get) == max(b["specific"], key=b["specific"].get))
+            stats["drifts"].extend(abs(a["specific"][k] - b["specific"][k]) * 100 for k in a["specific"])
+
+    for domain, stats in by_domain.items():
+        drifts = np.array(stats["drifts"]) if stats["drifts"] else np.zeros(1)
+        report["domains"][domain] = {
+            "images": stats["n"],
+            "domain_top1_agreement": round(stats["domain_agree"] / stats["n"], 3),
+            "specific_top1_agreement": round(stats["specific_agree"] / stats["n"], 3),
+            "specific_prob_drift_mean_pts": round(float(drifts.mean()), 2),
+            "specific_prob_drift_max_pts": round(float(drifts.max()), 2),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fp32 vs INT8 accuracy/latency/memory report")
+    parser.add_argument("folder")
+    parser.add_argument("--model-dir", default=os.getenv("MODEL_DIR", os.path.join("..", "models", "oeil d'elephant")))
+    parser.add_argument("--limit-per-domain", type=int, default=50)
+    parser.add_argument("--mode", choices=["fp32", "int8"], help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.folder, args.model_dir, args.limit_per_domain, args.out)
+        return
+
+    runs = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("fp32", "int8"):
+            out = os.path.join(tmp, f"{mode}.json")
+            print(f"Running {mode}...")
+            subprocess.run([
+                sys.executable, os.path.abspath(__file__), args.folder,
+                "--model-dir", args.model_dir,
+                "--limit-per-domain", str(args.limit_per_domain),
+                "--mode", mode, "--out", out
+            ], check=True)
+            with open(out) as f:
+                runs[mode] = json.load(f)
+
+    print(json.dumps(summarize(runs["fp32"], runs["int8"]), indent=2))
+
+
+if __name__ == "__main__":
+    main()
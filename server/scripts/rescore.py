@@ -0,0 +1,44 @@
+# Script to re-score stored analyses after a MEDICAL_DOMAINS prompt/label change.
+#
+#   PYTHONPATH=.. python rescore.py                     # every user
+#   PYTHONPATH=.. python rescore.py --username dr_x --limit 500
+#
+# No vision pass: uses the pooled embeddings of the embedding store and writes
+# new result versions (jobs.result is never overwritten). Same as POST /admin/rescore.
+
+import argparse
+import json
+import os
+
+import database
+from main import (
+    MEDICAL_DOMAINS,
+    MedSigClipWrapper,
+    calculate_priority_score,
+    localize_analysis_result,
+)
+from rescoring import rescore_jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score stored analyses with the current prompts")
+    parser.add_argument("--model-dir", default=os.getenv("MODEL_DIR", os.path.join("..", "models", "oeil d'elephant")))
+    parser.add_argument("--username", default=None)
+    parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+
+    database.init_db()  # result_versions table
+    wrapper = MedSigClipWrapper(args.model_dir, warmup=False)
+    wrapper.load()
+    if not wrapper.loaded:
+        raise SystemExit(wrapper.load_error)
+
+    summary = rescore_jobs(
+        wrapper, MEDICAL_DOMAINS, localize_analysis_result, calculate_priority_score,
+        username=args.username, limit=args.limit
+    )
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# Recall@k / latency of the IVF similar-case search against exact search.
+#
+#   PYTHONPATH=.. python similar_cases_benchmark.py                          # synthetic clustered embeddings
+#   PYTHONPATH=.. python similar_cases_benchmark.py --sizes 20000 100000 --nprobe 4 8 16 32
+#   PYTHONPATH=.. python similar_cases_benchmark.py --embeddings pooled.npy  # real (n, dim) pooled embeddings
+#
+# Queries are perturbed copies of indexed vectors (a re-analysis / follow-up image
+# looks like that), so the exact top-k is meaningful.
+
+import argparse
+import time
+
+import numpy as np
+
+from ann_index import IVFIndex
+from similar_cases import top_k_rows
+
+
+def synthetic_embeddings(n, dim, clusters, seed=0):
+    """Unit vectors around `clusters` random centres (modalities / findings)."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim)).astype(np.float32)
+    x = centres[rng.integers(0, clusters, n)] + 0.6 * rng.normal(size=(n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def make_queries(vectors, count, seed=1):
+    rng = np.random.default_rng(seed)
+    q = vectors[rng.integers(0, vectors.shape[0], count)] + 0.05 * rng.normal(size=(count, vectors.shape[1])).astype(np.float32)
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def timed(fn, queries):
+    results, timings = [], []
+    for q in queries:
+        start = time.perf_counter()
+        results.append(fn(q))
+        timings.append((time.perf_counter() - start) * 1000)
+    return results, float(np.median(timings)), float(np.percentile(timings, 95))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IVF vs exact similar-case search.")
+    parser.add_argument("--embeddings", default=None, help=".npy (n, dim) embeddings (default: synthetic)")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10000, 50000])
+    parser.add_argument("--dim", type=int, default=1152, help="SigLIP pooled embedding size")
+    parser.add_argument("--clusters", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--nprobe", nargs="+", type=int, default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--inserts", type=float, default=0.2, help="Fraction inserted after training (incremental path)")
+    args = parser.parse_args()
+
+    if args.embeddings:
+        loaded = np.load(args.embeddings).astype(np.float32)
+        loaded /= np.linalg.norm(loaded, axis=1, keepdims=True)
+        datasets = [(f"{args.embeddings} ({loaded.shape[0]})", loaded)]
+    else:
+        datasets = [(f"synthetic {n}x{args.dim}", synthetic_embeddings(n, args.dim, args.clusters)) for n in args.sizes]
+
+    print(f"{'dataset':<26} {'mode':<12} {f'recall@{args.top_k}':>9} {'p50 ms':>8} {'p95 ms':>8} {'scored':>8}")
+    for name, vectors in datasets:
+        n = vectors.shape[0]
+        queries = make_queries(vectors, args.queries)
+
+        exact, p50, p95 = timed(lambda q: top_k_rows(vectors @ q, args.top_k), queries)
+        print(f"{name:<26} {'exact':<12} {1.0:>9.3f} {p50:>8.2f} {p95:>8.2f} {n:>8}")
+
+        trained = int(n * (1 - args.inserts))
+        index = IVFIndex(min_rows=0)
+        start = time.perf_counter()
+        index.build(vectors, np.arange(trained))
+        build_s = time.perf_counter() - start
+        for row in range(trained, n):
+            index.add(row, vectors[row])
+        print(f"{'':<26} {'build':<12} {len(index.lists)} lists in {build_s:.2f}s, {n - trained} incremental inserts")
+
+        for nprobe in args.nprobe:
+            def search(q):
+                rows = index.candidates(q, nprobe)
+                return rows[top_k_rows(vectors[rows] @ q, args.top_k)], rows.size
+
+            found, p50, p95 = timed(search, queries)
+            recall = np.mean([len(set(f.tolist()) & set(e.tolist())) / len(e) for (f, _), e in zip(found, exact)])
+            scored = int(np.mean([size for _, size in found]))
+            print(f"{'':<26} {f'ivf/{nprobe}':<12} {recall:>9.3f} {p50:>8.2f} {p95:>8.2f} {scored:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,512 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import storage_manager
+from ann_index import IVFIndex
+from embedding_store import version_hash
+from vector_codecs import DecodedRows, Float32Codec, load_codec, staging_codec
+
+try:
+    import fcntl  # POSIX only: cross-process append lock (inference workers, other replicas)
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger("ElephMind-SimilarCases")
+
+# =========================================================================
+# SIMILAR CASE INDEX
+# =========================================================================
+# Previous analyses of the SAME user in the SAME domain, ranked by cosine
+# similarity of the pooled image embeddings.
+#
+# One partition per (username, domain): a contiguous matrix of L2-normalized
+# rows (float32, or a compact codec from vector_codecs.py), so a query is one
+# scan of the encoded rows + argpartition top-k. Each partition keeps its
+# newest `capacity` cases: a heavy user only ever evicts their own oldest
+# cases, never anyone else's.
+#
+# Persistent mode (after persist(model_version)): partitions live next to the
+# user's images and survive restarts; every process maps the same files.
+#   <user_dir>/similar_cases/<vision_version_hash>/<domain>/
+#       manifest.json           {"model_version", "domain", "dim", "generation", "codec"}
+#       vectors.<gen>.<ext>     append-only encoded rows (memory-mapped read-only)
+#       codebook.<gen>.npz      PQ codebooks of that generation
+#       cases.<gen>.jsonl       one line per append: {"case_id", "diagnosis", "probability", "row"}
+# A store is a durable append (vector fsynced before its line). Once dead rows
+# (evicted / re-analyzed cases) reach `capacity`, or the configured codec can
+# replace the one on disk (PQ: trained once enough cases exist), live rows are
+# re-encoded into generation + 1 and the manifest is switched atomically.
+#
+# Search mode "ivf" (ann_index.py): partitions of >= ann_min_rows cases only
+# score the rows of the nprobe closest IVF lists instead of every row.
+
+
+def normalize(embedding: np.ndarray) -> Optional[np.ndarray]:
+    vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm > 0 else None
+
+
+def top_k_rows(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Indices of the top_k scores, best first (argpartition, then sort only k)."""
+    k = min(top_k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+CODEC_EXTENSIONS = {"float32": "f32", "float16": "f16", "int8": "i8", "pq": "pq"}
+
+
+@contextmanager
+def _file_lock(lock_path: Path):
+    with open(lock_path, "a") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _write_json_atomic(path: Path, data: Dict):
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class CasePartition:
+    """In-memory ring buffer of encoded normalized embeddings + array-backed metadata of one (user, domain)."""
+
+    __slots__ = ("capacity", "codes", "codec", "target_codec", "ids", "diagnoses", "probabilities",
+                 "count", "head", "slots", "lock", "ann")
+
+    INITIAL_ROWS = 64
+
+    def __init__(self, dim: int, capacity: int, ann: Optional[IVFIndex] = None, codec=None):
+        self.capacity = max(1, capacity)
+        self.target_codec = codec or Float32Codec(dim)
+        self.codec = staging_codec(self.target_codec)  # float16 until PQ can be trained
+        rows = min(self.INITIAL_ROWS, self.capacity)
+        self.codes = np.empty((rows, self.codec.row_bytes), dtype=np.uint8)
+        self.ids = np.empty(rows, dtype=object)
+        self.diagnoses = np.empty(rows, dtype=object)
+        self.probabilities = np.empty(rows, dtype=np.float32)
+        self.count = 0   # Filled rows
+        self.head = 0    # Next row to overwrite once full (oldest case)
+        self.slots: Dict[str, int] = {}  # case_id -> row
+        self.lock = threading.Lock()
+        self.ann = ann  # None: exact search
+
+    def __len__(self) -> int:
+        return self.count
+
+    def refresh(self):
+        """Nothing to reload: this process owns the only copy."""
+
+    def _grow(self):
+        """Double the backing arrays (amortized O(1) appends until capacity)."""
+        rows = min(self.capacity, 2 * self.codes.shape[0])
+        codes = np.empty((rows, self.codes.shape[1]), dtype=np.uint8)
+        codes[:self.count] = self.codes[:self.count]
+        self.codes = codes
+        for name in ("ids", "diagnoses", "probabilities"):
+            old = getattr(self, name)
+            new = np.empty(rows, dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def _switch_codec(self):
+        """Train the target codec on the staged rows and re-encode them."""
+        decoded = self.codec.decode(self.codes[:self.count])
+        if not self.target_codec.trained:
+            self.target_codec.train(decoded)
+        codes = np.empty((self.codes.shape[0], self.target_codec.row_bytes), dtype=np.uint8)
+        codes[:self.count] = self.target_codec.encode(decoded)
+        self.codes = codes
+        self.codec = self.target_codec
+
+    def add(self, case_id: str, unit_embedding: np.ndarray, diagnosis: str, probability: float):
+        row = self.slots.get(case_id)
+        if row is None:
+            if self.count < self.capacity:
+                if self.count == self.codes.shape[0]:
+                    self._grow()
+                row = self.count
+                self.count += 1
+            else:
+                row = self.head
+                self.head = (self.head + 1) % self.capacity
+                del self.slots[self.ids[row]]
+            self.slots[case_id] = row
+
+        self.codes[row] = self.codec.encode(unit_embedding)[0]
+        self.ids[row] = case_id
+        self.diagnoses[row] = diagnosis
+        self.probabilities[row] = probability
+        if self.ann is not None:
+            self.ann.add(row, unit_embedding)
+        if self.codec is not self.target_codec and self.count >= min(self.target_codec.train_rows, self.capacity):
+            self._switch_codec()
+
+    def search(self, unit_query: np.ndarray, top_k: int, exclude_id: Optional[str] = None) -> List[Tuple[str, str, float]]:
+        """[(case_id, diagnosis, cosine)] best first."""
+        if self.count == 0 or top_k <= 0:
+            return []
+
+        rows = None
+        if self.ann is not None:
+            if self.ann.needs_rebuild(self.count):
+                self.ann.build(DecodedRows(self.codec, self.codes), np.arange(self.count))
+            if self.ann.trained:
+                rows = self.ann.candidates(unit_query)
+        if rows is None:
+            rows = np.arange(self.count)
+            scores = self.codec.scores(self.codes[:self.count], unit_query)
+        else:
+            scores = self.codec.scores(self.codes[rows], unit_query)
+
+        excluded = self.slots.get(exclude_id) if exclude_id else None
+        if excluded is not None:
+            scores[rows == excluded] = -np.inf
+        return [(self.ids[rows[i]], self.diagnoses[rows[i]], float(scores[i]))
+                for i in top_k_rows(scores, top_k) if np.isfinite(scores[i])]
+
+
+class PersistentCasePartition:
+    """Append-only memory-mapped case store of one (user, domain), shared by every process."""
+
+    def __init__(self, root: Path, capacity: int, ann: Optional[IVFIndex] = None,
+                 codec_factory: Optional[Callable[[int], object]] = None):
+        self.root = Path(root)
+        self.capacity = max(1, capacity)
+        self.manifest_path = self.root / "manifest.json"
+        self.lock_path = self.root / ".lock"
+        self.lock = threading.Lock()
+        self.domain = None
+        self.dim = 0
+        self.generation = -1
+        self.codec = None          # Codec of the rows on disk (manifest)
+        self.target_codec = None   # Configured codec, applied at the next compaction
+        self.codec_factory = codec_factory or Float32Codec
+        self.total_rows = 0     # Rows referenced in this generation (dead ones included)
+        self._offset = 0        # Bytes of cases.<gen>.jsonl already applied
+        self._mmap: Optional[np.memmap] = None
+        # case_id -> (row, diagnosis, probability), oldest first, newest `capacity` only
+        self.live: "OrderedDict[str, Tuple[int, str, float]]" = OrderedDict()
+        self._live_rows: Optional[np.ndarray] = None  # Search caches, rebuilt after a refresh changed `live`
+        self._live_items: List[Tuple[str, Tuple[int, str, float]]] = []
+        self._positions: Dict[str, int] = {}
+        self._row_positions = np.empty(0, dtype=np.int64)  # File row -> position in _live_items (-1: dead)
+        self.ann = ann  # None: exact search
+        self._unindexed: List[int] = []  # Rows appended since the IVF index last saw the partition
+
+    @classmethod
+    def create(cls, root: Path, dim: int, capacity: int, model_version: str, domain: str,
+               ann: Optional[IVFIndex] = None, codec_factory: Optional[Callable[[int], object]] = None
+               ) -> "PersistentCasePartition":
+        root = Path(root)
+        root.mkdir(parents=True, exist_ok=True)
+        codec = staging_codec((codec_factory or Float32Codec)(dim))
+        with _file_lock(root / ".lock"):
+            if not (root / "manifest.json").exists():
+                _write_json_atomic(root / "manifest.json", {"model_version": model_version, "domain": domain,
+                                                            "dim": dim, "generation": 0, "codec": codec.name})
+        return cls(root, capacity, ann=ann, codec_factory=codec_factory)
+
+    def _paths(self, generation: int, codec_name: str) -> Tuple[Path, Path, Path]:
+        return (self.root / f"vectors.{generation}.{CODEC_EXTENSIONS[codec_name]}",
+                self.root / f"cases.{generation}.jsonl",
+                self.root / f"codebook.{generation}.npz")
+
+    def __len__(self) -> int:
+        return len(self.live)
+
+    # --- Reads (lazy rebuild + incremental refresh) ---
+
+    def refresh(self):
+        """Apply appends / compactions made by any process since the last call."""
+        with open(self.manifest_path, "r") as f:
+            manifest = json.load(f)
+        if manifest["generation"] != self.generation:
+            self.domain = manifest.get("domain")
+            self.dim = int(manifest["dim"])
+            generation = int(manifest["generation"])
+            codec_name = manifest.get("codec", "float32")
+            self.codec = load_codec(codec_name, self.dim, self._paths(generation, codec_name)[2])
+            if self.target_codec is None:
+                self.target_codec = self.codec_factory(self.dim)
+            self.generation = generation
+            self.total_rows = 0
+            self._offset = 0
+            self._mmap = None
+            self.live.clear()
+            self._live_rows = None
+            self._unindexed.clear()
+            if self.ann is not None:
+                self.ann.reset()  # Rows were renumbered by compaction
+
+        _, cases_path, _ = self._paths(self.generation, self.codec.name)
+        if not cases_path.exists() or cases_path.stat().st_size == self._offset:
+            return
+        with open(cases_path, "rb") as f:
+            f.seek(self._offset)
+            chunk = f.read()
+        # Only consume complete lines (a writer may be mid-append)
+        complete = chunk[:chunk.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            previous = self.live.pop(entry["case_id"], None)  # Re-analysis: newest row wins
+            self.live[entry["case_id"]] = (entry["row"], entry["diagnosis"], entry["probability"])
+            self.total_rows = max(self.total_rows, entry["row"] + 1)
+            self._unindexed.append(entry["row"])
+            if len(self.live) > self.capacity:
+                _, previous = self.live.popitem(last=False)
+            if previous is not None and self.ann is not None:
+                self.ann.remove(previous[0])
+        self._offset += len(complete)
+        self._live_rows = None
+
+    def _codes(self) -> np.memmap:
+        """(rows, row_bytes) read-only view of the encoded rows, remapped when other processes appended rows."""
+        if self._mmap is None or self._mmap.shape[0] < self.total_rows:
+            vectors_path, _, _ = self._paths(self.generation, self.codec.name)
+            rows = vectors_path.stat().st_size // self.codec.row_bytes
+            self._mmap = np.memmap(vectors_path, dtype=np.uint8, mode="r", shape=(rows, self.codec.row_bytes))
+        return self._mmap
+
+    def search(self, unit_query: np.ndarray, top_k: int, exclude_id: Optional[str] = None) -> List[Tuple[str, str, float]]:
+        """[(case_id, diagnosis, cosine)] best first. Call refresh() first."""
+        if not self.live or top_k <= 0:
+            return []
+        if self._live_rows is None:
+            self._live_items = list(self.live.items())
+            self._live_rows = np.fromiter((row for _, (row, _, _) in self._live_items), dtype=np.int64, count=len(self._live_items))
+            self._positions = {case_id: i for i, (case_id, _) in enumerate(self._live_items)}
+            self._row_positions = np.full(self.total_rows, -1, dtype=np.int64)
+            self._row_positions[self._live_rows] = np.arange(len(self._live_items))
+        items = self._live_items
+        codes = self._codes()
+        matrix = DecodedRows(self.codec, codes)
+
+        positions = None
+        if self.ann is not None:
+            if self.ann.needs_rebuild(len(items)):
+                self.ann.build(matrix, self._live_rows)
+            elif self.ann.trained:
+                for row in self._unindexed:
+                    self.ann.add(row, matrix[row])
+            self._unindexed.clear()
+            if self.ann.trained:
+                positions = self._row_positions[self.ann.candidates(unit_query)]
+                positions = positions[positions >= 0]
+        if positions is None:
+            positions = np.arange(len(items))
+            scores = self.codec.scores(codes[self._live_rows], unit_query)
+        else:
+            scores = self.codec.scores(codes[self._live_rows[positions]], unit_query)
+
+        excluded = self._positions.get(exclude_id) if exclude_id else None
+        if excluded is not None:
+            scores[positions == excluded] = -np.inf
+        return [(items[positions[i]][0], items[positions[i]][1][1], float(scores[i]))
+                for i in top_k_rows(scores, top_k) if np.isfinite(scores[i])]
+
+    # --- Durable append ---
+
+    def add(self, case_id: str, unit_embedding: np.ndarray, diagnosis: str, probability: float):
+        with _file_lock(self.lock_path):
+            self.refresh()  # Latest generation / rows of every process
+            vectors_path, cases_path, _ = self._paths(self.generation, self.codec.name)
+            row_bytes = self.codec.row_bytes
+            with open(vectors_path, "ab") as f:
+                size = f.tell()
+                if size % row_bytes:  # Torn write of a crashed process: drop the partial row
+                    size -= size % row_bytes
+                    f.truncate(size)
+                f.write(self.codec.encode(unit_embedding).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+            with open(cases_path, "a") as f:
+                f.write(json.dumps({"case_id": case_id, "diagnosis": diagnosis,
+                                    "probability": float(probability), "row": size // row_bytes}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+            self.refresh()
+            target = self.target_codec
+            if target.name != self.codec.name and (target.trained or len(self.live) >= min(target.train_rows, self.capacity)):
+                self._compact(target)
+            elif self.total_rows - len(self.live) >= self.capacity:
+                self._compact(self.codec)
+
+    def _compact(self, codec):
+        """Re-encode live rows with `codec` into generation + 1 (caller holds the file lock). Open maps of the old files stay valid."""
+        old_paths = self._paths(self.generation, self.codec.name)
+        new_generation = self.generation + 1
+        vectors_path, cases_path, codebook_path = self._paths(new_generation, codec.name)
+
+        items = list(self.live.items())
+        rows = np.fromiter((row for row, _, _ in self.live.values()), dtype=np.int64, count=len(items))
+        if codec is self.codec:
+            encoded = np.asarray(self._codes()[rows])
+        else:
+            decoded = self.codec.decode(np.asarray(self._codes()[rows]))
+            if not codec.trained:
+                codec.train(decoded)
+            encoded = codec.encode(decoded)
+        with open(vectors_path, "wb") as f:
+            f.write(np.ascontiguousarray(encoded).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        if codec.arrays():
+            with open(codebook_path, "wb") as f:
+                np.savez(f, **codec.arrays())
+                f.flush()
+                os.fsync(f.fileno())
+        with open(cases_path, "w") as f:
+            for i, (case_id, (_, diagnosis, probability)) in enumerate(items):
+                f.write(json.dumps({"case_id": case_id, "diagnosis": diagnosis, "probability": probability, "row": i}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        with open(self.manifest_path, "r") as f:
+            manifest = json.load(f)
+        manifest["generation"] = new_generation
+        manifest["codec"] = codec.name
+        _write_json_atomic(self.manifest_path, manifest)
+        for path in old_paths:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+        logger.info(f"🧹 Similar cases compacted: {self.root} (generation {new_generation}, {len(items)} cases, {codec.name})")
+        self.refresh()
+
+
+class SimilarCaseIndex:
+    """Per-(username, domain) partitions; strict user isolation by construction."""
+
+    def __init__(self, capacity_per_partition: int = 1000, search_mode: str = "exact",
+                 nprobe: int = 8, ann_min_rows: int = 4096, codec_factory: Optional[Callable[[int], object]] = None):
+        self.capacity_per_partition = capacity_per_partition
+        self.codec_factory = codec_factory or Float32Codec  # dim -> codec instance (one per partition: PQ codebooks)
+        self.search_mode = search_mode  # "exact" | "ivf"
+        self.nprobe = nprobe
+        self.ann_min_rows = ann_min_rows
+        self.model_version: Optional[str] = None  # Set by persist(): partitions are files from then on
+        self._partitions: Dict[Tuple[str, str], object] = {}
+        self._lock = threading.Lock()
+
+    def persist(self, model_version: str):
+        """Back every partition with files under the user's storage (embeddings of this vision model only)."""
+        with self._lock:
+            self.model_version = model_version
+            self._partitions.clear()
+
+    def _new_ann(self) -> Optional[IVFIndex]:
+        if self.search_mode == "ivf":
+            return IVFIndex(nprobe=self.nprobe, min_rows=self.ann_min_rows)
+        return None
+
+    def _user_root(self, username: str) -> Path:
+        return storage_manager.get_user_storage_path(username) / "similar_cases" / version_hash(self.model_version)
+
+    def _partition(self, username: str, domain: str, dim: Optional[int] = None):
+        """Partition of (username, domain), loaded lazily. Created only when dim is given (add)."""
+        key = (username, domain)
+        with self._lock:
+            partition = self._partitions.get(key)
+            if partition is not None:
+                return partition
+            if self.model_version is None:
+                if dim is None:
+                    return None
+                partition = CasePartition(dim, self.capacity_per_partition, ann=self._new_ann(), codec=self.codec_factory(dim))
+            else:
+                root = self._user_root(username) / "".join(c for c in domain if c.isalnum() or c in ("-", "_"))
+                if (root / "manifest.json").exists():
+                    partition = PersistentCasePartition(root, self.capacity_per_partition, ann=self._new_ann(),
+                                                        codec_factory=self.codec_factory)
+                elif dim is not None:
+                    partition = PersistentCasePartition.create(root, dim, self.capacity_per_partition, self.model_version,
+                                                               domain, ann=self._new_ann(), codec_factory=self.codec_factory)
+                else:
+                    return None
+            self._partitions[key] = partition
+            return partition
+
+    def _user_domains(self, username: str) -> List[str]:
+        if self.model_version is None:
+            return [domain for user, domain in self._partitions if user == username]
+        domains = []
+        root = self._user_root(username)
+        if root.exists():
+            for manifest_path in root.glob("*/manifest.json"):
+                with open(manifest_path, "r") as f:
+                    domains.append(json.load(f).get("domain"))
+        return [d for d in domains if d]
+
+    def partition_size(self, username: str, domain: str) -> int:
+        partition = self._partition(username, domain)
+        if partition is None:
+            return 0
+        with partition.lock:
+            partition.refresh()
+            return len(partition)
+
+    def add_case(self, case_id: str, embedding: np.ndarray, diagnosis: str, domain: str, probability: float, username: str):
+        unit = normalize(embedding)
+        if unit is None:
+            return
+        try:
+            partition = self._partition(username, domain, dim=unit.shape[0])
+            with partition.lock:
+                partition.add(case_id, unit, diagnosis, probability)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Similar case store failed ({username}/{domain}/{case_id}): {e}")
+
+    def find_similar(self, query_embedding: np.ndarray, username: str, top_k: int = 3, same_domain_only: bool = True,
+                     query_domain: str = None, exclude_case_id: Optional[str] = None) -> List[Dict]:
+        unit = normalize(query_embedding)
+        if unit is None:
+            return []
+
+        domains = [query_domain] if same_domain_only and query_domain else self._user_domains(username)
+        hits = []
+        for domain in domains:
+            try:
+                partition = self._partition(username, domain)
+                if partition is None:
+                    continue
+                with partition.lock:
+                    partition.refresh()
+                    hits.extend(partition.search(unit, top_k, exclude_id=exclude_case_id))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Similar case search failed ({username}/{domain}): {e}")
+
+        hits.sort(key=lambda hit: hit[2], reverse=True)
+        return [
+            {
+                "case_id": case_id,
+                "diagnosis": diagnosis,
+                "similarity": round(score * 100, 1)
+            }
+            for case_id, diagnosis, score in hits[:top_k]
+        ]
@@ -83,3 +83,48 @@ def get_image_absolute_path(username: str, image_id: str) -> Optional[str]:
     for file in user_path.glob(f"{image_id}.*"):
         return str(file)
     return None
+
+# --- Analysis visuals (heatmap / original) ---
+# Stored in the user's directory next to the image they were computed from
+# (visuals/<image_id>/<name>.<fmt>) and served by /jobs/{id}/<name>, so they
+# follow the image's lifecycle. Re-uploads of the same pixels (inference
+# cache hits) hard-link the files of the earlier image of the same user.
+
+def get_visual_path(username: str, image_id: str, name: str, fmt: str) -> Path:
+    """Path of a stored visual. Image ID as issued by save_image, name/format are plain words."""
+    if not image_id.startswith("IMG_") or not image_id[4:].isalnum() or not name.isalnum() or not fmt.isalnum():
+        raise ValueError("Invalid visual reference")
+    return get_user_storage_path(username) / "visuals" / image_id / f"{name}.{fmt}"
+
+def save_visual(username: str, image_id: str, name: str, fmt: str, data: bytes) -> Path:
+    """Atomically write (or replace) a visual of one image."""
+    file_path = get_visual_path(username, image_id, name, fmt)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = file_path.with_name(f"{file_path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, file_path)
+        return file_path
+    except Exception as e:
+        logger.error(f"Failed to save visual: {e}")
+        raise IOError(f"Storage Error: {e}")
+
+def link_visuals(username: str, source_image_id: str, image_id: str, names, fmt: str) -> bool:
+    """Give image_id the visuals of another image of the same user. False if any file is missing."""
+    try:
+        pairs = [(get_visual_path(username, source_image_id, name, fmt), get_visual_path(username, image_id, name, fmt))
+                 for name in names]
+    except ValueError:
+        return False
+    if not all(source.exists() for source, _ in pairs):
+        return False
+    for source, target in pairs:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if target.exists():
+            continue
+        try:
+            os.link(source, target)
+        except OSError:
+            save_visual(username, image_id, target.stem, fmt, source.read_bytes())
+    return True
@@ -0,0 +1,235 @@
+import logging
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger("ElephMind-VectorCodecs")
+
+# =========================================================================
+# COMPACT EMBEDDING CODECS
+# =========================================================================
+# Encodings of L2-normalized embedding rows for the similar-case partitions.
+# Every codec turns (n, dim) float32 into (n, row_bytes) uint8, so partitions
+# (in memory or memory-mapped files) stay plain fixed-width byte matrices.
+#
+#   codec     bytes / row (dim=1152)   scoring
+#   float32   4 * dim   (4608)  1x     one matmul
+#   float16   2 * dim   (2304)  2x     chunked upcast + matmul
+#   int8      dim + 4   (1156)  ~4x    int8 codes x per-row scale
+#   pq        m         (288)   16x    asymmetric distance: per-query lookup tables,
+#                                      m table reads per row (m = dim / 4 by default)
+#
+# PQ needs training data (256 centroids per sub-space): partitions keep rows
+# in float16 until they hold `train_rows` cases, then train and re-encode.
+# Recall / memory trade-off: scripts/embedding_codec_report.py
+
+SCORE_CHUNK_ROWS = 8192
+PQ_CENTROIDS = 256  # One uint8 code per sub-vector
+KMEANS_ITERATIONS = 10
+
+
+class Float32Codec:
+    name = "float32"
+    needs_training = False
+    train_rows = 0
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.row_bytes = 4 * dim
+
+    @property
+    def trained(self) -> bool:
+        return True
+
+    def encode(self, units: np.ndarray) -> np.ndarray:
+        return np.ascontiguousarray(units, dtype=np.float32).reshape(-1, self.dim).view(np.uint8)
+
+    def decode(self, rows: np.ndarray) -> np.ndarray:
+        return np.ascontiguousarray(rows).view(np.float32)
+
+    def scores(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        return self.decode(rows) @ query
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """Codec state to persist next to the rows (codebooks)."""
+        return {}
+
+
+class Float16Codec(Float32Codec):
+    name = "float16"
+
+    def __init__(self, dim: int):
+        super().__init__(dim)
+        self.row_bytes = 2 * dim
+
+    def encode(self, units: np.ndarray) -> np.ndarray:
+        return np.ascontiguousarray(units, dtype=np.float16).reshape(-1, self.dim).view(np.uint8)
+
+    def decode(self, rows: np.ndarray) -> np.ndarray:
+        return np.ascontiguousarray(rows).view(np.float16).astype(np.float32)
+
+    def scores(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        out = np.empty(rows.shape[0], dtype=np.float32)
+        for start in range(0, rows.shape[0], SCORE_CHUNK_ROWS):
+            out[start:start + SCORE_CHUNK_ROWS] = self.decode(rows[start:start + SCORE_CHUNK_ROWS]) @ query
+        return out
+
+
+class Int8Codec(Float16Codec):
+    """Symmetric scalar quantization: int8 codes + float32 scale (max |x| / 127) per row."""
+
+    name = "int8"
+
+    def __init__(self, dim: int):
+        super().__init__(dim)
+        self.row_bytes = dim + 4
+
+    def encode(self, units: np.ndarray) -> np.ndarray:
+        units = np.asarray(units, dtype=np.float32).reshape(-1, self.dim)
+        scale = np.abs(units).max(axis=1) / 127.0
+        scale[scale == 0] = 1.0
+        out = np.empty((units.shape[0], self.row_bytes), dtype=np.uint8)
+        out[:, :self.dim] = np.rint(units / scale[:, None]).astype(np.int8).view(np.uint8)
+        out[:, self.dim:] = scale.astype(np.float32).reshape(-1, 1).view(np.uint8)
+        return out
+
+    def _split(self, rows: np.ndarray):
+        rows = np.asarray(rows)
+        return rows[:, :self.dim].view(np.int8), np.ascontiguousarray(rows[:, self.dim:]).view(np.float32)[:, 0]
+
+    def decode(self, rows: np.ndarray) -> np.ndarray:
+        codes, scale = self._split(rows)
+        return codes.astype(np.float32) * scale[:, None]
+
+    def scores(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        out = np.empty(rows.shape[0], dtype=np.float32)
+        for start in range(0, rows.shape[0], SCORE_CHUNK_ROWS):
+            codes, scale = self._split(rows[start:start + SCORE_CHUNK_ROWS])
+            out[start:start + codes.shape[0]] = (codes.astype(np.float32) @ query) * scale
+        return out
+
+
+def kmeans(x: np.ndarray, k: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """(k, d) Euclidean k-means centroids (empty clusters reseeded with the worst-fit points)."""
+    rng = np.random.default_rng(seed)
+    k = min(k, x.shape[0])
+    centroids = x[rng.choice(x.shape[0], k, replace=False)].copy()
+    x_sq = (x * x).sum(axis=1)
+
+    for _ in range(iterations):
+        distances = x_sq[:, None] - 2 * (x @ centroids.T) + (centroids * centroids).sum(axis=1)[None, :]
+        labels = np.argmin(distances, axis=1)
+        counts = np.bincount(labels, minlength=k)
+
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, x)
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+
+        empty = np.flatnonzero(~nonempty)
+        if empty.size:
+            worst = np.argsort(-distances[np.arange(x.shape[0]), labels])[:empty.size]
+            centroids[empty] = x[worst]
+    return centroids
+
+
+class PQCodec:
+    """Product quantization: m sub-vectors, 256 centroids each, asymmetric distance computation."""
+
+    name = "pq"
+    needs_training = True
+
+    def __init__(self, dim: int, subvectors: int = 0, train_rows: int = 4096, codebooks: Optional[np.ndarray] = None):
+        m = subvectors or max(1, dim // 4)
+        while dim % m:  # Largest sub-vector count <= requested that splits dim evenly
+            m -= 1
+        self.dim = dim
+        self.m = m
+        self.dsub = dim // m
+        self.row_bytes = m
+        self.train_rows = train_rows
+        self.codebooks = codebooks  # (m, 256, dsub) float32
+
+    @property
+    def trained(self) -> bool:
+        return self.codebooks is not None
+
+    def train(self, units: np.ndarray):
+        units = np.asarray(units, dtype=np.float32).reshape(-1, self.dim)
+        codebooks = np.zeros((self.m, PQ_CENTROIDS, self.dsub), dtype=np.float32)
+        for j in range(self.m):
+            sub = np.ascontiguousarray(units[:, j * self.dsub:(j + 1) * self.dsub])
+            centroids = kmeans(sub, PQ_CENTROIDS, seed=j)
+            codebooks[j, :centroids.shape[0]] = centroids
+            codebooks[j, centroids.shape[0]:] = centroids[0]  # Fewer rows than centroids: unused codes
+        self.codebooks = codebooks
+        logger.info(f"🧮 PQ codebooks trained: {units.shape[0]} rows, {self.m} x {PQ_CENTROIDS} centroids of {self.dsub} dims")
+
+    def encode(self, units: np.ndarray) -> np.ndarray:
+        units = np.asarray(units, dtype=np.float32).reshape(-1, self.dim)
+        codes = np.empty((units.shape[0], self.m), dtype=np.uint8)
+        norms = (self.codebooks * self.codebooks).sum(axis=2)  # (m, 256)
+        for j in range(self.m):
+            sub = units[:, j * self.dsub:(j + 1) * self.dsub]
+            codes[:, j] = np.argmin(norms[j][None, :] - 2 * (sub @ self.codebooks[j].T), axis=1)
+        return codes
+
+    def decode(self, rows: np.ndarray) -> np.ndarray:
+        rows = np.asarray(rows)
+        return self.codebooks[np.arange(self.m)[None, :], rows].reshape(rows.shape[0], self.dim)
+
+    def scores(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        # ADC: the query stays exact, rows are centroids -> score = sum_j <q_j, c_j[code_j]>
+        lut = np.einsum("mkd,md->mk", self.codebooks, query.reshape(self.m, self.dsub))
+        sub_index = np.arange(self.m)[None, :]
+        out = np.empty(rows.shape[0], dtype=np.float32)
+        for start in range(0, rows.shape[0], SCORE_CHUNK_ROWS):
+            chunk = np.asarray(rows[start:start + SCORE_CHUNK_ROWS])
+            out[start:start + chunk.shape[0]] = lut[sub_index, chunk].sum(axis=1)
+        return out
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"codebooks": self.codebooks} if self.trained else {}
+
+
+CODECS = {"float32": Float32Codec, "float16": Float16Codec, "int8": Int8Codec, "pq": PQCodec}
+
+
+def make_codec(name: str, dim: int, pq_subvectors: int = 0, pq_train_rows: int = 4096):
+    if name not in CODECS:
+        raise ValueError(f"Unknown embedding codec '{name}' (expected one of {sorted(CODECS)})")
+    if name == "pq":
+        return PQCodec(dim, subvectors=pq_subvectors, train_rows=pq_train_rows)
+    return CODECS[name](dim)
+
+
+def staging_codec(codec):
+    """Codec rows are written with until `codec` can be trained (itself when no training is needed)."""
+    if codec.needs_training and not codec.trained:
+        return Float16Codec(codec.dim)
+    return codec
+
+
+def load_codec(name: str, dim: int, codebook_path: Optional[Path] = None):
+    """Codec of persisted rows (PQ codebooks from the .npz written with them)."""
+    if name != "pq":
+        return make_codec(name, dim)
+    with np.load(codebook_path) as data:
+        codebooks = data["codebooks"]
+    return PQCodec(dim, subvectors=codebooks.shape[0], codebooks=codebooks)
+
+
+class DecodedRows:
+    """float32 view of encoded rows for code that indexes a float matrix (IVF training / inserts)."""
+
+    def __init__(self, codec, rows: np.ndarray):
+        self.codec = codec
+        self.rows = rows
+        self.shape = (rows.shape[0], codec.dim)
+
+    def __getitem__(self, index) -> np.ndarray:
+        rows = self.rows[index]
+        if rows.ndim == 1:
+            return self.codec.decode(rows[None, :])[0]
+        return self.codec.decode(rows)
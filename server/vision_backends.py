@@ -0,0 +1,237 @@
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image
+
+logger = logging.getLogger("ElephMind-VisionBackend")
+
+# =========================================================================
+# PLUGGABLE VISION BACKENDS
+# =========================================================================
+# Every backend maps preprocessed pixel_values (B, 3, 448, 448) to
+#   - last_hidden_state (B, Tokens, D)   -> segmentation / morphology
+#   - image_embeds      (B, D) normalized -> zero-shot scoring (text bank)
+# The text side never runs here: it comes from the precomputed TextEmbeddingBank.
+
+DEFAULT_ONNX_FILENAME = os.path.join("onnx", "vision_encoder.onnx")
+IMAGE_SIZE = 448  # SigLIP input resolution (fixed)
+
+
+def pooled_embedding(model, vision_outputs) -> torch.Tensor:
+    """Pooled (and projected, for CLIP-style heads) normalized embedding."""
+    pooled = vision_outputs.pooler_output
+    if hasattr(model, 'visual_projection'):
+        pooled = model.visual_projection(pooled)
+    return pooled / pooled.norm(p=2, dim=-1, keepdim=True)
+
+
+class VisionEncoder(nn.Module):
+    """Vision tower + pooling head as a plain tensor->tensors module (exportable)."""
+
+    def __init__(self, model):
+        super(VisionEncoder, self).__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        outputs = self.model.vision_model(pixel_values=pixel_values)
+        return outputs.last_hidden_state, pooled_embedding(self.model, outputs)
+
+
+class TorchVisionBackend:
+    """
+    PyTorch path (reference implementation).
+    compile_mode: None/'off' = eager, 'trace' = frozen TorchScript graph,
+    'compile' = torch.compile. Any compilation failure falls back to eager.
+    """
+    name = "torch"
+
+    def __init__(self, model, compile_mode: Optional[str] = None, max_batch: int = 1):
+        self.model = model
+        self.encoder = VisionEncoder(model).eval()
+        self.compile_mode = None
+        self.compiled = None
+        self.compiled_any_batch = False
+        if compile_mode and compile_mode != "off":
+            self._compile(compile_mode, max_batch)
+
+    @property
+    def label(self) -> str:
+        return f"torch-{self.compile_mode}" if self.compiled is not None else "torch"
+
+    def _compile(self, mode: str, max_batch: int):
+        """Compile once for the fixed 448x448 input, warm up, and validate against eager."""
+        started = time.time()
+        try:
+            example = torch.zeros(1, 3, IMAGE_SIZE, IMAGE_SIZE, device=self.model.device)
+            with torch.no_grad():
+                if mode == "trace":
+                    graph = torch.jit.trace(self.encoder, (example,), strict=False, check_trace=False)
+                    graph = torch.jit.optimize_for_inference(torch.jit.freeze(graph))
+                elif mode == "compile":
+                    graph = torch.compile(self.encoder)
+                else:
+                    logger.warning(f"Unknown INFERENCE_COMPILE '{mode}', staying eager")
+                    return
+
+                # Warmup batch (batch 1 is the guaranteed shape)
+                for _ in range(2):
+                    graph(example)
+                self._check_close(graph, example)
+
+                # Micro-batching sends larger batches: only use the graph for them if it matches eager
+                self.compiled_any_batch = False
+                if max_batch > 1:
+                    batch_example = torch.randn(2, 3, IMAGE_SIZE, IMAGE_SIZE, device=self.model.device)
+                    try:
+                        self._check_close(graph, batch_example)
+                        self.compiled_any_batch = True
+                    except Exception as e:
+                        logger.warning(f"Compiled graph restricted to batch 1: {e}")
+
+            self.compiled = graph
+            self.compile_mode = mode
+            logger.info(f"⚡ Vision encoder compiled ({mode}) in {time.time() - started:.1f}s")
+        except Exception as e:
+            self.compiled = None
+            logger.warning(f"⚠️ Vision encoder compilation ({mode}) failed, using eager mode: {e}")
+
+    def _check_close(self, graph, pixel_values: torch.Tensor, atol: float = 1e-3):
+        _, eager_embeds = self.encoder(pixel_values)
+        _, graph_embeds = graph(pixel_values)
+        drift = float((eager_embeds - graph_embeds).abs().max())
+        if drift > atol:
+            raise RuntimeError(f"compiled output drift {drift:.2e} > {atol}")
+
+    def encode(self, pixel_values: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        pixel_values = pixel_values.to(self.model.device)
+        with torch.no_grad():
+            if self.compiled is not None and (pixel_values.size(0) == 1 or self.compiled_any_batch):
+                try:
+                    return self.compiled(pixel_values)
+                except Exception as e:
+                    logger.error(f"Compiled vision graph failed, reverting to eager mode: {e}")
+                    self.compiled = None
+            return self.encoder(pixel_values)
+
+
+class OnnxVisionBackend:
+    """ONNX Runtime CPU path for an exported VisionEncoder (see export_onnx.py)."""
+    name = "onnx"
+    label = "onnx"
+
+    def __init__(self, onnx_path: str, threads: int = 0):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("onnxruntime not installed!")
+
+        if not os.path.exists(onnx_path):
+            raise FileNotFoundError(f"ONNX vision encoder not found: {onnx_path}")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.onnx_path = onnx_path
+
+    def encode(self, pixel_values: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        feeds = {"pixel_values": pixel_values.detach().cpu().numpy().astype(np.float32)}
+        last_hidden_state, image_embeds = self.session.run(["last_hidden_state", "image_embeds"], feeds)
+        return torch.from_numpy(last_hidden_state), torch.from_numpy(image_embeds)
+
+
+# =========================================================================
+# PARITY CHECK
+# =========================================================================
+
+def synthetic_samples(count: int = 4, size: int = 448) -> List[Image.Image]:
+    """Deterministic synthetic images (noise, gradients, blobs) for checks and warmup."""
+    rng = np.random.default_rng(0)
+    samples = []
+    for i in range(count):
+        if i % 3 == 0:
+            arr = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+        elif i % 3 == 1:
+            ramp = np.linspace(0, 255, size, dtype=np.float32)
+            arr = np.stack([np.tile(ramp, (size, 1))] * 3, axis=-1).astype(np.uint8)
+        else:
+            yy, xx = np.mgrid[0:size, 0:size]
+            blob = np.exp(-(((xx - size / 2) ** 2) + ((yy - size / 2) ** 2)) / (2 * (size / 5) ** 2))
+            arr = np.stack([(blob * 255).astype(np.uint8)] * 3, axis=-1)
+        samples.append(Image.fromarray(arr))
+    return samples
+
+
+def load_sample_folder(folder: str, limit: int = 16) -> List[Image.Image]:
+    """Load up to `limit` PNG/JPEG images from a folder (recursive)."""
+    images = []
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            if name.lower().endswith((".png", ".jpg", ".jpeg")):
+                images.append(Image.open(os.path.join(root, name)).convert("RGB"))
+                if len(images) >= limit:
+                    return images
+    return images
+
+
+def check_parity(reference, candidate, processor, text_bank, images: List[Image.Image], tolerance: float) -> Dict[str, Any]:
+    """
+    Compare zero-shot logits of two backends over every prompt group.
+    Drift is the max absolute logit difference; the candidate passes if drift <= tolerance.
+    """
+    pixel_values = processor(images=images, return_tensors="pt")["pixel_values"]
+    _, ref_embeds = reference.encode(pixel_values)
+    _, cand_embeds = candidate.encode(pixel_values)
+    ref_embeds = ref_embeds.float().cpu()
+    cand_embeds = cand_embeds.float().cpu()
+
+    per_group = {}
+    for group in text_bank.embeddings:
+        ref_logits = text_bank.logits(group, ref_embeds)
+        cand_logits = text_bank.logits(group, cand_embeds)
+        per_group[group] = float((ref_logits - cand_logits).abs().max())
+
+    drift = max(per_group.values()) if per_group else 0.0
+    return {
+        "samples": len(images),
+        "max_abs_logit_diff": round(drift, 6),
+        "per_group": {k: round(v, 6) for k, v in per_group.items()},
+        "tolerance": tolerance,
+        "passed": drift <= tolerance,
+        "prompt_version": text_bank.version,
+    }
+
+
+def create_vision_backend(name: str, model, processor=None, text_bank=None, onnx_path: Optional[str] = None,
+                          parity_tolerance: float = 0.05, threads: int = 0,
+                          compile_mode: Optional[str] = None, max_batch: int = 1):
+    """
+    Build the requested backend. Non-reference backends must pass a parity
+    check against the PyTorch model, otherwise the PyTorch backend is kept.
+    """
+    if name == "torch":
+        return TorchVisionBackend(model, compile_mode=compile_mode, max_batch=max_batch)
+
+    reference = TorchVisionBackend(model)
+
+    if name != "onnx":
+        logger.warning(f"Unknown INFERENCE_BACKEND '{name}', using torch")
+        return reference
+
+    try:
+        candidate = OnnxVisionBackend(onnx_path, threads=threads)
+        report = check_parity(reference, candidate, processor, text_bank, synthetic_samples(), parity_tolerance)
+        if not report["passed"]:
+            logger.error(f"❌ ONNX backend REFUSED: logit drift {report['max_abs_logit_diff']} > {parity_tolerance}")
+            return reference
+        logger.info(f"✅ ONNX Runtime vision backend active (logit drift {report['max_abs_logit_diff']})")
+        return candidate
+    except Exception as e:
+        logger.error(f"ONNX backend unavailable, using torch: {e}")
+        return reference
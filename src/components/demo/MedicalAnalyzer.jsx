@@ -2,6 +2,7 @@ import React, { useState, useRef, useEffect } from 'react';
 import { motion, AnimatePresence } from 'framer-motion';
 import { Upload, X, Loader2, AlertCircle, FileText, CheckCircle2, Stethoscope, Microscope, Lock, MessageSquare, Star } from 'lucide-react';
 import { useNavigate } from 'react-router-dom';
+import { useResultVisual } from '../../config/api';
 
 
 
@@ -20,6 +21,8 @@ const MedicalAnalyzer = () => {
 
     const navigate = useNavigate();
     const token = localStorage.getItem('token');
+    const heatmapSrc = useResultVisual(result, 'heatmap');
+    const originalSrc = useResultVisual(result, 'original_image');
 
 
     // API URL from environment or default
@@ -158,6 +161,10 @@ const MedicalAnalyzer = () => {
                         audio.volume = 0.3;
                         audio.play().catch(() => { }); // Ignore errors if autoplay blocked
                     } catch (e) { }
+                } else if (data.status === 'classified' && data.result) {
+                    // Progressive result: classification first, heatmap attached on 'completed'
+                    setResult(data.result);
+                    setStatus('completed');
                 } else if (data.status === 'failed') {
                     clearInterval(interval);
                     if (data.error && data.error.includes("Unknown image format")) {
@@ -385,7 +392,7 @@ const MedicalAnalyzer = () => {
                                     </div>
 
                                     <div className="space-y-3">
-                                        {result.heatmap && (
+                                        {heatmapSrc && (
                                             <div className="mb-4 p-4 bg-gray-50 dark:bg-gray-700/30 rounded-lg border border-gray-200 dark:border-gray-600">
                                                 <h5 className="font-bold text-sm text-brand-dark dark:text-white mb-2 flex items-center justify-between">
                                                     <span>Visualisation Grad-CAM++ (Explicabilité)</span>
@@ -402,7 +409,7 @@ const MedicalAnalyzer = () => {
                                                         <span className="text-xs font-semibold text-gray-500 block text-center">Image Originale</span>
                                                         <div className="relative rounded-lg overflow-hidden border border-gray-300 dark:border-gray-600 aspect-square bg-black">
                                                             <img
-                                                                src={result.original_image ? `data:image/png;base64,${result.original_image}` : preview}
+                                                                src={originalSrc || preview}
                                                                 alt="Original"
                                                                 className="absolute inset-0 w-full h-full object-contain"
                                                             />
@@ -414,7 +421,7 @@ const MedicalAnalyzer = () => {
                                                         <span className="text-xs font-semibold text-red-500 block text-center">Focus IA (Grad-CAM++)</span>
                                                         <div className="relative rounded-lg overflow-hidden border border-red-200 dark:border-red-900 aspect-square bg-black">
                                                             <img
-                                                                src={`data:image/png;base64,${result.heatmap}`}
+                                                                src={heatmapSrc}
                                                                 alt="Grad-CAM Heatmap"
                                                                 className="absolute inset-0 w-full h-full object-fill"
                                                             />
@@ -1,3 +1,5 @@
+import { useEffect, useState } from 'react';
+
 /**
  * Centralized API Configuration
  * Ensures robust handling of the backend URL across all environments (Dev/Prod).
@@ -38,3 +40,50 @@ export const handleResponse = async (response) => {
     }
     return response.json();
 };
+
+/**
+ * Image src for an analysis visual ('heatmap' | 'original_image').
+ * New results carry an authenticated URL (fetched with the token -> blob URL,
+ * HTTP-cached via ETag); older stored results still inline base64 PNG.
+ * @param {Object} result Analysis result
+ * @param {string} name Visual field name
+ * @returns {string|null}
+ */
+export const useResultVisual = (result, name) => {
+    const url = result?.[`${name}_url`];
+    const legacy = result?.[name];
+    const [src, setSrc] = useState(null);
+
+    useEffect(() => {
+        if (legacy) {
+            setSrc(`data:image/png;base64,${legacy}`);
+            return undefined;
+        }
+        if (!url) {
+            setSrc(null);
+            return undefined;
+        }
+
+        let objectUrl = null;
+        let cancelled = false;
+        const token = localStorage.getItem('token');
+        fetch(`${API_URL}${url}`, { headers: token ? { 'Authorization': `Bearer ${token}` } : {} })
+            .then((res) => (res.ok ? res.blob() : Promise.reject(new Error(`Erreur ${res.status}`))))
+            .then((blob) => {
+                if (cancelled) return;
+                objectUrl = URL.createObjectURL(blob);
+                setSrc(objectUrl);
+            })
+            .catch((err) => {
+                console.warn(`Visual ${name} unavailable:`, err);
+                if (!cancelled) setSrc(null);
+            });
+
+        return () => {
+            cancelled = true;
+            if (objectUrl) URL.revokeObjectURL(objectUrl);
+        };
+    }, [url, legacy, name]);
+
+    return src;
+};
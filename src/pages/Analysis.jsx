@@ -117,7 +117,7 @@ class ErrorBoundary extends Component {
     }
 }
 // API URL
-import { API_URL } from '../config/api';
+import { API_URL, useResultVisual } from '../config/api';
 
 // Patient Form Component with Search
 import { usePatients } from '../context/PatientContext';
@@ -388,6 +388,8 @@ const ImageUploadZone = ({ image, setImage, isAnalyzing, previewOverride }) => {
 const ResultsPanel = ({ result, isAnalyzing }) => {
     const [zoomedImage, setZoomedImage] = useState(null);
     const navigate = useNavigate(); // Fix: Add hook here
+    const heatmapSrc = useResultVisual(result, 'heatmap');
+    const originalSrc = useResultVisual(result, 'original_image');
 
     if (isAnalyzing) {
         return (
@@ -485,20 +487,20 @@ const ResultsPanel = ({ result, isAnalyzing }) => {
             </div>
 
             {/* Image Comparison: Original vs GradCAM++ */}
-            {(result.original_image || result.heatmap) && (
+            {(originalSrc || heatmapSrc) && (
                 <div className="bg-white dark:bg-gray-800 rounded-2xl p-6 shadow-lg border border-gray-100 dark:border-gray-700">
                     <h3 className="text-lg font-bold text-gray-900 dark:text-white mb-4 flex items-center gap-2">
                         <FileImage className="h-5 w-5 text-brand-primary" />
                         Visualisation GradCAM++
                     </h3>
                     <div className="grid grid-cols-2 gap-4">
-                        {result.original_image && (
+                        {originalSrc && (
                             <div
                                 className="relative group cursor-pointer"
-                                onClick={() => setZoomedImage({ src: `data:image/png;base64,${result.original_image}`, title: 'Image Originale' })}
+                                onClick={() => setZoomedImage({ src: originalSrc, title: 'Image Originale' })}
                             >
                                 <img
-                                    src={`data:image/png;base64,${result.original_image}`}
+                                    src={originalSrc}
                                     alt="Image Originale"
                                     className="w-full rounded-xl shadow-md group-hover:shadow-lg transition-shadow"
                                 />
@@ -510,13 +512,13 @@ const ResultsPanel = ({ result, isAnalyzing }) => {
                                 <p className="text-center text-sm text-gray-500 mt-2">Image Originale</p>
                             </div>
                         )}
-                        {result.heatmap && (
+                        {heatmapSrc && (
                             <div
                                 className="relative group cursor-pointer"
-                                onClick={() => setZoomedImage({ src: `data:image/png;base64,${result.heatmap}`, title: 'Zones d\'Attention (GradCAM++)' })}
+                                onClick={() => setZoomedImage({ src: heatmapSrc, title: 'Zones d\'Attention (GradCAM++)' })}
                             >
                                 <img
-                                    src={`data:image/png;base64,${result.heatmap}`}
+                                    src={heatmapSrc}
                                     alt="GradCAM++ Heatmap"
                                     className="w-full rounded-xl shadow-md group-hover:shadow-lg transition-shadow"
                                 />
@@ -785,6 +787,11 @@ const Analysis = () => {
                             setIsAnalyzing(false);
                             return true; // Stop polling
                         }
+                        if (data.status === 'classified') {
+                            // Classification ready, heatmap still queued: show it and keep polling
+                            setResult(data.result);
+                            setIsAnalyzing(false);
+                        }
                     }
                 } catch (e) { console.error("Immediate check failed", e); }
                 return false;
@@ -816,7 +823,8 @@ const Analysis = () => {
                     switch (stateData.state) {
                         case 'ANALYZING':
                             // Job is running -> Resume polling
-                            setIsAnalyzing(true);
+                            setIsAnalyzing(!stateData.result); // 'classified': result shown, heatmap pending
+                            if (stateData.result) setResult(stateData.result);
                             currentJobIdRef.current = stateData.task_id;
                             setCurrentAnalysis({
                                 status: 'analyzing',
@@ -1060,6 +1068,10 @@ const Analysis = () => {
                                 : prev.birthDate
                         }));
                     }
+                } else if (data.status === 'classified' && data.result) {
+                    // Progressive result: classification first, heatmap attached on 'completed'
+                    setResult(data.result);
+                    setIsAnalyzing(false);
                 } else if (data.status === 'failed') {
                     clearInterval(interval);
                     pollingIntervalRef.current = null;